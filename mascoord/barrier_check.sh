@@ -0,0 +1,50 @@
+#!/bin/bash
+
+# Runs the MST simulation with the deadline and quorum barriers, under which the agents of a time step overlap with the
+# late agents of the previous one, and fails when a run fails or an agent logs an error (e.g. a DCOP message of another
+# time step mixed with those of the current one). Run from the mascoord directory, with the environment variables of
+# sample.env set.
+
+# List of dcop_alg methods
+dcop_algs=("dpop" "cocoa")
+
+# List of barriers
+barriers=("quorum --barrier_quorum 0.8" "deadline --barrier_deadline 0.5")
+
+# Number of seeds (repeat each run for these seeds)
+NUM_SEEDS=3
+
+# Fixed parameters
+num_agents=30
+num_remove=5
+num_targets=15
+grid_size=10
+graph_alg="digca"
+scenarios_file="scenarios_a30_r5.pkl"
+
+log_file=$(mktemp)
+failures=0
+
+for dcop_alg in "${dcop_algs[@]}"; do
+  for barrier in "${barriers[@]}"; do
+    for ((seed=0; seed<NUM_SEEDS; seed++)); do
+      # the virtual clock makes every run reproducible
+      python src/factory.py -t inproc -o asyncio -v virtual -p max -s "$seed" -a "$dcop_alg" -g "$graph_alg" \
+        -l info mst-simulation --num_agents "$num_agents" --num_remove "$num_remove" --grid_size "$grid_size" \
+        --num_targets "$num_targets" -f "$scenarios_file" --barrier $barrier > "$log_file" 2>&1
+      status=$?
+      errors=$(grep -c -e ' - ERROR - ' -e 'Traceback' "$log_file")
+
+      if [ $status -ne 0 ] || [ "$errors" -ne 0 ]; then
+        echo "FAILED: dcop_alg=$dcop_alg | barrier=$barrier | seed=$seed (exit status $status, $errors errors)"
+        grep -m 5 -e ' - ERROR - ' "$log_file"
+        failures=$((failures + 1))
+      else
+        echo "ok: dcop_alg=$dcop_alg | barrier=$barrier | seed=$seed"
+      fi
+    done
+  done
+done
+
+rm -f "$log_file"
+exit $failures
@@ -0,0 +1,66 @@
+"""
+Measures the time C-CoCoA takes to answer an inquiry (build the cost map of the sender's domain) for domain sizes of 3
+to 1000 values.
+
+The cost map is built either with a scalar loop evaluating the constraint for every pair of values, or with one
+broadcasted evaluation over the grid of value pairs. `CCoCoA.inquiry_cost_map` uses the loop up to
+`CCoCoA.MAX_SCALAR_INQUIRY_PAIRS` pairs, the break-even point of the two measured here. The loop is timed for the
+domain sizes up to `--max_loop_domain_size`.
+
+Usage (from the mascoord directory, with the environment variables of sample.env set):
+
+    python benchmarks/ccocoa_inquiry_benchmark.py --num_iterations 20
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+from mascoord.definitions import ROOT_DIR
+
+# modules of the src package are imported as top-level modules (see factory.py)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+from mascoord.src.algorithms.dcop.ccocoa import CCoCoA  # noqa: E402
+from mascoord.src.equations import Quadratic  # noqa: E402
+
+DOMAIN_SIZES = [3, 5, 6, 7, 8, 10, 30, 100, 300, 1000]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='C-CoCoA inquiry handling time per domain size')
+    parser.add_argument('-n', '--num_iterations', type=int, default=20)
+    parser.add_argument('-m', '--max_loop_domain_size', type=int, default=300)
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    constraint = Quadratic(*[round(random.uniform(-5, 5), 3) for _ in range(3)])
+
+    print(f'{"domain size":>12}{"loop (ms)":>14}{"broadcast (ms)":>18}{"speedup":>10}{"used":>12}')
+    for domain_size in DOMAIN_SIZES:
+        # same sampling as the DCOP domains
+        sender_domain = random.sample(range(-domain_size * 5, domain_size * 5), domain_size)
+        domain = random.sample(range(-domain_size * 5, domain_size * 5), domain_size)
+        used = 'loop' if domain_size * domain_size <= CCoCoA.MAX_SCALAR_INQUIRY_PAIRS else 'broadcast'
+
+        broadcast = timeit.timeit(
+            lambda: CCoCoA.broadcast_inquiry_cost_map(constraint, sender_domain, domain), number=args.num_iterations,
+        ) / args.num_iterations
+
+        if domain_size <= args.max_loop_domain_size:
+            expected = CCoCoA.scalar_inquiry_cost_map(constraint, sender_domain, domain)
+            if CCoCoA.broadcast_inquiry_cost_map(constraint, sender_domain, domain) != expected:
+                raise AssertionError(f'Cost maps differ for domain size {domain_size}')
+
+            loop = timeit.timeit(
+                lambda: CCoCoA.scalar_inquiry_cost_map(constraint, sender_domain, domain), number=args.num_iterations,
+            ) / args.num_iterations
+            print(f'{domain_size:>12}{loop * 1e3:>14.3f}{broadcast * 1e3:>18.3f}{loop / broadcast:>10.1f}{used:>12}')
+        else:
+            print(f'{domain_size:>12}{"-":>14}{broadcast * 1e3:>18.3f}{"-":>10}{used:>12}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Measures the decode throughput of the message codec for the message types exchanged during a simulation.
+
+The legacy decoder (string replacement followed by `eval`) is included for comparison. It is fed the legacy
+encoding of UTIL messages (nested lists) while the codec carries them as typed array buffers.
+
+Usage (from the mascoord directory, with the environment variables of sample.env set):
+
+    python benchmarks/codec_benchmark.py --num_iterations 20000 --domain_size 9
+"""
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+from mascoord.definitions import ROOT_DIR
+
+# modules of the src package are imported as top-level modules (see factory.py)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+from mascoord.src import codec, messaging  # noqa: E402
+
+
+def legacy_decode(body):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return eval(body.decode('utf-8').replace('true', 'True').replace('false', 'False').replace('null', 'None'))
+
+
+def sample_messages(domain_size, legacy=False):
+    actions = ['up', 'down', 'left', 'right', 'left_up', 'right_up', 'left_down', 'right_down'][:domain_size]
+    neighbors = [f'a{i}' for i in range(1, 6)]
+    cpa = {f'agent-{a}': action for a, action in zip(neighbors, actions)}
+    util = np.random.rand(domain_size)
+    util_matrix = np.random.rand(domain_size, domain_size)
+    if legacy:
+        util, util_matrix = util.tolist(), util_matrix.tolist()
+
+    return {
+        messaging.ANNOUNCE: lambda: messaging.create_announce_message({'agent_id': 'a0'}),
+        messaging.SIM_ENV_CURRENT_TIME_STEP_MSG: lambda: messaging.create_sim_env_current_time_step_message({
+            'current_position': '2-3',
+            'agents_in_comm_range': neighbors,
+            'agent_domain': actions,
+            'neighbor_domains': {a: actions for a in neighbors},
+            'event_timestamp': 1681300000.123,
+            'timestep': 10,
+        }),
+        messaging.UPDATE_STATE_MESSAGE: lambda: messaging.create_update_state_message({
+            'agent_id': 'a0',
+            'state': 'DONE',
+            'cpa': cpa,
+        }),
+        messaging.INQUIRY_MESSAGE: lambda: messaging.create_inquiry_message({
+            'agent_id': 'a0',
+            'domain': actions,
+        }),
+        messaging.COST_MESSAGE: lambda: messaging.create_cost_message({
+            'agent_id': 'a0',
+            'cost_map': [(v1, v2, 1.5) for v1 in actions for v2 in actions[:1]],
+        }),
+        messaging.VALUE_SELECTED_MSG: lambda: messaging.create_value_selected_message({
+            'agent_id': 'a0',
+            'cpa': cpa,
+            'value': 'up',
+            'metrics': {'messages_count': 120, messaging.ANNOUNCE: 4, messaging.COST_MESSAGE: 20},
+            'timestep': 10,
+        }),
+        messaging.UTIL_MESSAGE: lambda: messaging.create_util_message({
+            'agent_id': 'a0',
+            'util': util,
+        }),
+        f'{messaging.UTIL_MESSAGE} (d x d)': lambda: messaging.create_util_message({
+            'agent_id': 'a0',
+            'util': util_matrix,
+        }),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Message codec decode throughput')
+    parser.add_argument('-n', '--num_iterations', type=int, default=20000)
+    parser.add_argument('-d', '--domain_size', type=int, default=9)
+    args = parser.parse_args()
+
+    decoders = {
+        'eval (legacy)': (codec.JSON, legacy_decode),
+        'json': (codec.JSON, codec.decode),
+    }
+    if codec.msgpack is not None:
+        decoders['msgpack'] = (codec.MSGPACK, codec.decode)
+
+    messages = sample_messages(args.domain_size)
+    legacy_messages = sample_messages(args.domain_size, legacy=True)
+
+    print(f'{"message type":<32}{"decoder":<16}{"bytes":>8}{"msgs/s":>14}')
+    for msg_type in messages:
+        for name, (fmt, decode) in decoders.items():
+            codec.set_format(fmt)
+            create_message = legacy_messages[msg_type] if decode is legacy_decode else messages[msg_type]
+            body = create_message()
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            duration = timeit.timeit(lambda: decode(body), number=args.num_iterations)
+            print(f'{msg_type:<32}{name:<16}{len(body):>8}{args.num_iterations / duration:>14,.0f}')
+
+
+if __name__ == '__main__':
+    main()
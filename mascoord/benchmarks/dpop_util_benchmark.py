@@ -0,0 +1,120 @@
+"""
+Measures the throughput of the DPOP UTIL table construction (costs of all the pairs of values of an agent and its
+parent) on the GridWorld of the MST simulation.
+
+The table is built from one batched constraint evaluation (`GridWorld.constraint_evaluation_matrix`). The previous
+construction (one `GridWorld.constraint_evaluation` call per pair of values) is included for comparison. Both are run on
+a GridWorld keeping its state in the cells and on a vectorized GridWorld (`--vectorized` of the MST simulation).
+
+Usage (from the mascoord directory, with the environment variables of sample.env set):
+
+    python benchmarks/dpop_util_benchmark.py --grid_size 20 --num_agents 30 --num_targets 100
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+import numpy as np
+
+from mascoord.definitions import ROOT_DIR
+
+# modules of the src package are imported as top-level modules (see factory.py)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+from mascoord.src import transport  # noqa: E402
+from mascoord.src.envs.mobile_sensing import GridWorld  # noqa: E402
+from mascoord.src.envs.scenario import MSTScenario  # noqa: E402
+
+
+def loop_util_table(env, agent_id, domain, parent, p_domain, c_util_sum):
+    x_ij = np.zeros((len(domain), len(p_domain)))
+    for i in range(len(domain)):
+        for j in range(len(p_domain)):
+            x_ij[i, j] = env.constraint_evaluation(
+                sender=agent_id,
+                agent_values={
+                    parent: p_domain[j],
+                    agent_id: domain[i],
+                }
+            )
+    return x_ij + c_util_sum.reshape(-1, 1)
+
+
+def batched_util_table(env, agent_id, domain, parent, p_domain, c_util_sum):
+    x_ij = env.constraint_evaluation_matrix(
+        sender=agent_id,
+        agent_1=agent_id,
+        values_1=domain,
+        agent_2=parent,
+        values_2=p_domain,
+    )
+    return x_ij + c_util_sum.reshape(-1, 1)
+
+
+def create_env(args, vectorized):
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    env = GridWorld(
+        size=args.grid_size,
+        num_targets=args.num_targets,
+        dcop_alg='dpop',
+        graph_alg='dbfs',
+        seed=args.seed,
+        scenario=MSTScenario(num_add_agents=args.num_agents, num_remove_agents=0).scenario(),
+        vectorized=vectorized,
+    )
+    env._create_cells()
+    env._initialize_targets()
+    for i in range(args.num_agents):
+        env.run_stabilization_computation(f'a{i}')
+    env._build_neighborhood_table()
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DPOP UTIL table construction throughput')
+    parser.add_argument('-n', '--num_iterations', type=int, default=20)
+    parser.add_argument('-g', '--grid_size', type=int, default=20)
+    parser.add_argument('-a', '--num_agents', type=int, default=30)
+    parser.add_argument('-t', '--num_targets', type=int, default=100)
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    transport.set_backend(transport.IN_PROCESS)
+
+    print(f'{"grid world":<14}{"construction":<16}{"tables/s":>12}{"speedup":>10}')
+    for vectorized in (False, True):
+        env = create_env(args, vectorized)
+
+        # one UTIL table per (agent, parent) pair of agents in communication range, with their GridWorld domains
+        edges = []
+        for agent_id in env.agents:
+            for parent in env._neighborhoods.neighbors(agent_id):
+                domain = list(env._neighborhoods.domain(agent_id))
+                p_domain = list(env._neighborhoods.domain(parent))
+                edges.append((agent_id, domain, parent, p_domain, np.random.rand(len(domain))))
+        if not edges:
+            raise ValueError('No pair of agents in communication range, increase the number of agents')
+
+        def run(build):
+            for edge in edges:
+                build(env, *edge)
+
+        for edge in edges:
+            if not np.array_equal(loop_util_table(env, *edge), batched_util_table(env, *edge)):
+                raise AssertionError(f'UTIL tables differ for {edge[0]} -> {edge[2]}')
+
+        name = 'vectorized' if vectorized else 'cells'
+        loop = timeit.timeit(lambda: run(loop_util_table), number=args.num_iterations)
+        batched = timeit.timeit(lambda: run(batched_util_table), number=args.num_iterations)
+        num_tables = len(edges) * args.num_iterations
+        print(f'{name:<14}{"loop":<16}{num_tables / loop:>12,.0f}{"":>10}')
+        print(f'{name:<14}{"batched":<16}{num_tables / batched:>12,.0f}{loop / batched:>10.1f}')
+
+        env.transport.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,55 +1,51 @@
 import datetime
 import functools
-import json
 import math
 import queue
 import random
-import time
 from collections import defaultdict
 from traceback import print_exception
 
-import pika
-
 import config
 import logger
 import mascoord.src.algorithms.graphs
 import mascoord.src.algorithms.graphs.digca
 import messaging
+from mascoord.src import clock, codec, transport
 from mascoord.src.algorithms.graphs import DDFS, DIGCA, DBFS
 from mascoord.src.equations import Quadratic
-from mascoord.src.utils import time_diff, notify_wrap
+from mascoord.src.utils import notify_wrap
 
 
 def parse_amqp_body(body):
-    return eval(body.decode('utf-8').replace('true', 'True').replace('false', 'False').replace('null', 'None'))
+    # a body may carry a batch of messages (see transport.Outbox)
+    return codec.decode_frame(body)
 
 
 def create_on_message(log, agent_id, message_queue, handle_message, agent_snapshot):
-    def on_message(ch, method, properties, body):
-        message = parse_amqp_body(body)
-
-        # avoid own messages (no local is not supported ATM, see https://www.rabbitmq.com/specification.html)
-        if 'agent_id' in message['payload'] and message['payload']['agent_id'] == agent_id:
-            return
+    def on_message(body):
+        for message in parse_amqp_body(body):
+            # avoid own messages (no local is not supported ATM, see https://www.rabbitmq.com/specification.html)
+            if 'agent_id' in message['payload'] and message['payload']['agent_id'] == agent_id:
+                continue
 
-        # message_queue.put(payload)
+            # message_queue.put(payload)
 
-        # log.debug(f'from agent.on_message: received {message}')
+            # log.debug(f'from agent.on_message: received {message}')
 
-        # run agent ops on payload
-        # try:
-        handle_message(message)
-        # except Exception as e:
-        #     log.info(f'Agent snapshot: {agent_snapshot()}\nPayload: {message}')
-        #     log.exception(e)
+            # run agent ops on payload
+            # try:
+            handle_message(message)
+            # except Exception as e:
+            #     log.info(f'Agent snapshot: {agent_snapshot()}\nPayload: {message}')
+            #     log.exception(e)
 
     return on_message
 
 
-def send_report_callback(channel, agent_snapshot):
-    channel.basic_publish(exchange=messaging.COMM_EXCHANGE,
-                          routing_key=f'{messaging.MONITORING_CHANNEL}',
-                          body=messaging.create_agent_report(agent_snapshot()))
+def send_report_callback(agent_transport, agent_snapshot):
+    agent_transport.publish(routing_key=f'{messaging.MONITORING_CHANNEL}',
+                            body=messaging.create_agent_report(agent_snapshot()))
 
 
 def change_constraint_callback(dyna_graph, coefficients, neighbor_id):
@@ -64,7 +60,7 @@ class Agent:
         # agent props
         self.agent_id = agent_id
         self.log = logger.get_logger(agent_id, prefix='Agent')
-        self.terminate = False
+        self._terminate = False
         self.active_constraints = {}
         self.coefficients_dict = kwargs['coefficients_dict'] if 'coefficients_dict' in kwargs else {}
         self.metrics = kwargs['metrics']
@@ -74,48 +70,42 @@ class Agent:
 
         self.is_client_asleep = False
 
-        self.start_time = time.time()
+        self.start_time = clock.time()
         self.accum_time = 0
         self.agent_metrics = AgentMetrics(self.agent_id, self.log)
         self.latest_event_timestamp = None
         self.timestep = -1
+        # DCOP messages of a time step this agent has not reached yet, handled when it does
+        self._early_dcop_messages = []
 
         self.agents_in_comm_range = None
         self.new_agents = set()
 
-        self.client = pika.BlockingConnection(
-            pika.ConnectionParameters(
-                host=config.BROKER_URL,
-                port=config.BROKER_PORT,
-                heartbeat=0,  # only for experiment purposes - see (https://www.rabbitmq.com/heartbeats.html)
-                credentials=pika.credentials.PlainCredentials(config.PIKA_USERNAME, config.PIKA_PASSWORD)
-            ))
-        self.channel = self.client.channel()
-        # self.client.add_callback_threadsafe(callback=self.start)
+        # environment of the simulation the agent takes part in (evaluates the constraints of the DCOP)
+        self.sim_env = kwargs.get('sim_env')
+
+        # agents hosted on an event loop (see host.AsyncAgentHost) get a transport that queues events on the loop
+        self.transport = transport.create_transport(bus=kwargs.get('bus'), loop=kwargs.get('loop'))
         self.queue = f'queue-{self.agent_id}'
-        self.channel.queue_declare(self.queue, exclusive=False)
-
-        self.channel.queue_bind(exchange=messaging.COMM_EXCHANGE,
-                                queue=self.queue,
-                                routing_key=f'{messaging.AGENTS_CHANNEL}.{self.agent_id}.#')
-        self.channel.queue_bind(exchange=messaging.COMM_EXCHANGE,
-                                queue=self.queue,
-                                routing_key=f'{messaging.AGENTS_CHANNEL}.public.#')
+        self.transport.declare_queue(self.queue)
+
+        self.transport.bind(self.queue, f'{messaging.AGENTS_CHANNEL}.{self.agent_id}.#')
+        self.transport.bind(self.queue, f'{messaging.AGENTS_CHANNEL}.public.#')
         # self.channel.queue_bind(exchange=messaging.COMM_EXCHANGE,
         #                         queue=self.queue,
         #                         routing_key=f'{messaging.FACTORY_COMMAND_CHANNEL}.#')
 
-        self.channel.basic_consume(queue=self.queue,
-                                   on_message_callback=create_on_message(self.log,
-                                                                         self.agent_id,
-                                                                         self.message_queue,
-                                                                         self.handle_message,
-                                                                         self.agent_snapshot),
-                                   auto_ack=True)
-
-        # Overwrite basic publish of channel to gather communication metrics
-        self.channel.basic_publish = notify_wrap(
-            self.channel.basic_publish,
+        self.transport.consume(self.queue, create_on_message(self.log,
+                                                             self.agent_id,
+                                                             self.message_queue,
+                                                             self.handle_message,
+                                                             self.agent_snapshot))
+
+        # Overwrite publish of transport to coalesce messages (flushed in listen_to_network) and gather communication
+        # metrics
+        self.outbox = transport.Outbox(self.transport.publish)
+        self.transport.publish = notify_wrap(
+            self.outbox.publish,
             self.agent_metrics.on_message_published,
         )
 
@@ -193,12 +183,31 @@ class Agent:
     def execute_dcop(self):
         self.dcop.execute_dcop()
 
+    @property
+    def outbox_messages_count(self):
+        return self.outbox.messages_count
+
+    @property
+    def outbox_frames_count(self):
+        return self.outbox.frames_count
+
     def increment_messages_count(self):
         self.messages_count += 1
 
     def clear_messages_count(self):
         self.messages_count = 0
 
+    @property
+    def terminate(self):
+        return self._terminate
+
+    @terminate.setter
+    def terminate(self, flag):
+        self._terminate = flag
+        if flag:
+            # wake up the agent's event loop so that it sees the flag
+            self.transport.add_callback_threadsafe(lambda: None)
+
     def shutdown(self):
         self.terminate = True
         self.report_shutdown = True
@@ -206,17 +215,16 @@ class Agent:
 
     def send_report(self):
         try:
-            self.client.add_callback_threadsafe(functools.partial(
+            self.transport.add_callback_threadsafe(functools.partial(
                 send_report_callback,
-                self.channel,
+                self.transport,
                 self.agent_snapshot
             ))
         except Exception as e:
             self.log.info(f'Agent state report failed, retry: {str(e)}')
 
     def report_metrics(self):
-        self.channel.basic_publish(
-            exchange=messaging.COMM_EXCHANGE,
+        self.transport.publish(
             routing_key=f'{messaging.METRICS_CHANNEL}',
             body=messaging.create_metrics_report({
                 'agent_id': self.agent_id,
@@ -225,10 +233,10 @@ class Agent:
             }))
 
     def _start_time(self):
-        self.start_time = time.time()
+        self.start_time = clock.time()
 
     def _time_lapse(self):
-        self.accum_time = time_diff(self.start_time)
+        self.accum_time = (clock.time() - self.start_time) * 1000
 
     def agent_snapshot(self):
         snapshot = {
@@ -271,7 +279,7 @@ class Agent:
 
     def change_constraint(self, coefficients, neighbor_id):
         try:
-            self.client.add_callback_threadsafe(functools.partial(
+            self.transport.add_callback_threadsafe(functools.partial(
                 change_constraint_callback,
                 self.graph,
                 coefficients,
@@ -294,9 +302,14 @@ class Agent:
         if self.latest_event_timestamp and message['timestamp'] < self.latest_event_timestamp:
             return
 
+        # with the deadline and quorum barriers, the environment starts a time step while some agents still run the DCOP
+        # of the previous one: the DCOP messages of another time step would mix with those of the current one
+        if message['type'] in messaging.DCOP_MESSAGE_TYPES and not self._is_current_dcop_message(message):
+            return
+
         match message['type']:
             case messaging.ANNOUNCE:
-                self.client.call_later(0, functools.partial(self.graph.receive_announce, message))
+                self.transport.call_later(0, functools.partial(self.graph.receive_announce, message))
 
             case messaging.ANNOUNCE_RESPONSE:
                 self.graph.receive_announce_response(message)
@@ -411,6 +424,23 @@ class Agent:
         if not self.graph.has_potential_neighbor():
             self.graph.start_dcop()
 
+        # DCOP messages of this time step received before the time step message
+        early_messages, self._early_dcop_messages = self._early_dcop_messages, []
+        for early_message in early_messages:
+            self.handle_message(early_message)
+
+    def _is_current_dcop_message(self, message) -> bool:
+        """
+        Whether a DCOP message belongs to the current time step. The messages of a past time step are dropped, those of
+        a later time step are kept until the agent reaches it.
+        """
+        time_step = message['payload'].get('timestep', self.timestep)
+        if time_step > self.timestep:
+            self._early_dcop_messages.append(message)
+        elif time_step < self.timestep:
+            self.log.debug(f'Dropped {message["type"]} of time step {time_step}, current time step = {self.timestep}')
+        return time_step == self.timestep
+
     def select_random_value(self):
         self.dcop.select_random_value()
 
@@ -426,9 +456,7 @@ class Agent:
         while not self.terminate:
             self.listen_to_network()
 
-            self.graph.connect()
-
-            self.dcop.resolve_value()
+            self.step()
 
             # check if neighbors should be pinged
             # if not last_ping_call_time or datetime.datetime.now() > last_ping_call_time \
@@ -442,41 +470,71 @@ class Agent:
 
         self.release_resources()
 
+    async def run_async(self):
+        """
+        Coroutine version of `__call__` for agents hosted on an asyncio event loop.
+        """
+        self.log.info('Initializing...')
+
+        # register with graph-ui and sim env
+        self.register_agent()
+
+        while not self.terminate:
+            await self.listen_to_network_async()
+
+            self.step()
+
+        self.log.info('Shutting down...')
+
+        self.release_resources()
+
+    def step(self):
+        """
+        Lets the graph and DCOP algorithms act on the messages handled since the last step.
+        """
+        self.graph.connect()
+
+        self.dcop.resolve_value()
+
     def listen_to_network(self):
+        """
+        Blocks until at least one message or scheduled callback has been handled.
+        """
         self._time_lapse()
         # self.log.info('listening...')
-        self.client.sleep(.1)
+        self.outbox.flush()
+        self.transport.process_events()
+        self._start_time()
+
+    async def listen_to_network_async(self):
+        self._time_lapse()
+        self.outbox.flush()
+        await self.transport.process_events_async()
         self._start_time()
 
     def release_resources(self):
+        self.outbox.flush()
+        self.log.info(f'Published {self.outbox.messages_count} messages in {self.outbox.frames_count} frames '
+                      f'(batching factor = {self.outbox.batching_factor:.2f})')
+
         if self.report_shutdown:
             # inform dashboard
-            self.channel.basic_publish(
-                exchange=messaging.COMM_EXCHANGE,
+            self.transport.publish(
                 routing_key=f'{messaging.MONITORING_CHANNEL}',
                 body=messaging.create_agent_shutdown_message({
                     'agent_id': self.agent_id,
                 })
             )
-        # remove rabbitmq resources
-        self.channel.queue_unbind(
-            exchange=messaging.COMM_EXCHANGE,
-            queue=self.queue,
-            routing_key=f'{messaging.AGENTS_CHANNEL}.{self.agent_id}.#'
-        )
-        self.channel.queue_unbind(
-            exchange=messaging.COMM_EXCHANGE,
-            queue=self.queue,
-            routing_key=f'{messaging.AGENTS_CHANNEL}.public.#'
-        )
+        # remove transport resources
+        self.transport.unbind(self.queue, f'{messaging.AGENTS_CHANNEL}.{self.agent_id}.#')
+        self.transport.unbind(self.queue, f'{messaging.AGENTS_CHANNEL}.public.#')
         # self.channel.queue_unbind(
         #     exchange=messaging.COMM_EXCHANGE,
         #     queue=self.queue,
         #     routing_key=f'{messaging.FACTORY_COMMAND_CHANNEL}.#'
         # )
-        self.channel.queue_delete(self.queue)
-        self.channel.close()
-        self.client.close()
+        self.transport.delete_queue(self.queue)
+        self.transport.close()
         self.log.info('Channel closed')
 
     def register_agent(self):
@@ -484,15 +542,13 @@ class Agent:
         agent_reg_info = {
                 'agent_id': self.agent_id,
             }
-        self.channel.basic_publish(
-            exchange=messaging.COMM_EXCHANGE,
+        self.transport.publish(
             routing_key=f'{messaging.MONITORING_CHANNEL}',
             body=messaging.create_agent_registration_dashboard_message(agent_reg_info),
         )
 
         # register with sim environment
-        self.channel.basic_publish(
-            exchange=messaging.COMM_EXCHANGE,
+        self.transport.publish(
             routing_key=f'{messaging.SIM_ENV_CHANNEL}',
             body=messaging.create_agent_registration_message(agent_reg_info),
         )
@@ -513,13 +569,8 @@ class AgentMetrics:
         self.messages_count = 0
         self._msg_type_count = defaultdict(int)
 
-    def on_message_published(self, *args, **kwargs):
-        # extract message
-        if len(args) >= 3:
-            message = args[2]
-        else:
-            message = kwargs['body']
-        message = json.loads(message)
+    def on_message_published(self, routing_key, body):
+        message = codec.decode(body)
 
         ignored_messages = [
             messaging.AGENT_REGISTRATION_DASHBOARD,
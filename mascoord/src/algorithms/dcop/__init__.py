@@ -1,6 +1,9 @@
 import random
 
-from mascoord.src import messaging
+import numpy as np
+
+from mascoord.src import config, messaging
+from mascoord.src.algorithms.dcop import optimization
 
 
 class DCOP:
@@ -58,13 +61,54 @@ class DCOP:
             self.send_cpa_to_dashboard()
         self.agent.metrics.update_metrics()
 
+    @staticmethod
+    def create_cost_map(sender_domain, values, costs) -> list:
+        """
+        Best response of this agent to every value of the sender.
+
+        :param sender_domain: values of the sender (rows of `costs`)
+        :param values: values of this agent (columns of `costs`)
+        :param costs: cost matrix of shape (len(sender_domain), len(values))
+        :return: list of (sender value, value of this agent, cost) with the lowest cost of every sender value
+        """
+        costs = np.asarray(costs, dtype=float)
+        best = np.argmin(costs, axis=1)
+        best_costs = costs[np.arange(len(best)), best]
+        return [
+            (sender_value, values[j], cost)
+            for sender_value, j, cost in zip(sender_domain, best.tolist(), best_costs.tolist())
+        ]
+
+    def create_optimizer(self):
+        """
+        Optimizer of the continuous value of the agent and its neighbors (C-CoCoA and C-DPOP).
+        """
+        shared_config = self.agent.shared_config
+        optimizer = optimization.GradientOptimizer(
+            learning_rate=config.LEARNING_RATE,
+            lower_bound=self.domain_lb,
+            upper_bound=self.domain_ub,
+            max_iter=shared_config.optimizer_max_iter,
+            tol=shared_config.optimizer_tol,
+            step_control=shared_config.optimizer_step,
+        )
+        if shared_config.optimizer_solver == optimization.ANALYTIC:
+            # the gradient descent solves the objectives that are not strictly convex
+            optimizer = optimization.AnalyticOptimizer(self.domain_lb, self.domain_ub, fallback=optimizer)
+        return optimizer
+
+    def time_step_payload(self, data) -> dict:
+        """
+        Payload of a DCOP message, tagged with the time step of the agent (see `Agent.handle_message`).
+        """
+        return {**data, 'timestep': self.agent.timestep}
+
     def send_cpa_to_dashboard(self):
-        self.agent.channel.basic_publish(exchange=messaging.COMM_EXCHANGE,
-                                         routing_key=f'{messaging.MONITORING_CHANNEL}',
-                                         body=messaging.create_cpa_report_message({
-                                             'agent_id': self.agent.agent_id,
-                                             'cpa': self.cpa
-                                         }))
+        self.agent.transport.publish(routing_key=f'{messaging.MONITORING_CHANNEL}',
+                                     body=messaging.create_cpa_report_message({
+                                         'agent_id': self.agent.agent_id,
+                                         'cpa': self.cpa
+                                     }))
 
     def resolve_value(self):
         """
@@ -79,8 +123,7 @@ class DCOP:
         self.value_selection(self.value)
 
     def value_selection(self, val):
-        self.agent.channel.basic_publish(
-            exchange=messaging.COMM_EXCHANGE,
+        self.agent.transport.publish(
             routing_key=f'{messaging.SIM_ENV_CHANNEL}',
             body=messaging.create_value_selected_message({
                 'agent_id': self.agent.agent_id,
@@ -1,5 +1,8 @@
-from mascoord.src import config, messaging
+import numpy as np
+
+from mascoord.src import messaging
 from mascoord.src.algorithms.dcop import DCOP
+from mascoord.src.algorithms.dcop.optimization import QuadraticNeighborhood
 
 
 class CCoCoA(DCOP):
@@ -14,11 +17,15 @@ class CCoCoA(DCOP):
     ACTIVE = 'ACTIVE'
     HOLD = 'HOLD'
 
+    # inquiries with up to this number of (sender value, value) pairs are answered with the scalar loop, which is faster
+    # than the broadcast evaluation for small domains (break-even around 45 pairs, see
+    # benchmarks/ccocoa_inquiry_benchmark.py), e.g. the default domain size of 3
+    MAX_SCALAR_INQUIRY_PAIRS = 40
+
     def __init__(self, *args, **kwargs):
         super(CCoCoA, self).__init__(*args, **kwargs)
         self.state = self.IDLE
-        self.alpha = config.LEARNING_RATE
-        self.max_iter = 100
+        self.optimizer = self.create_optimizer()
         self.neighbor_states = {}
         self.cost_map = {}
 
@@ -67,24 +74,16 @@ class CCoCoA(DCOP):
         best_params = total_cost_dict[self.value]['params']
         self.log.info(f'Best params: {best_params}, {self.value}')
 
-        # perform non-linear optimization
-        for i in range(self.max_iter):
-            grad_sum = 0
-            for neighbor in self.graph.neighbors:
-                if neighbor in best_params:  # needed due to async nature of execution
-                    constraint = self.agent.active_constraints[f'{self.agent.agent_id},{neighbor}']
-                    n_value = best_params[neighbor]
-                    grad_sum += constraint.ddx(self.value, n_value)
-
-                    # neighbor value optimization
-                    n_grad = constraint.ddy(self.value, n_value)
-                    n_value = n_value - self.alpha * n_grad
-                    best_params[neighbor] = min(max(self.domain_lb, n_value), self.domain_ub)
-
-            self.value = self.value - self.alpha * grad_sum
-
-            # clip to be in domain
-            self.value = min(max(self.domain_lb, self.value), self.domain_ub)
+        # perform non-linear optimization of this agent's value and the neighbors' values
+        neighbors = [n for n in self.graph.neighbors if n in best_params]  # needed due to async nature of execution
+        result = self.optimizer.minimize(
+            QuadraticNeighborhood.from_constraints(self.agent, neighbors),
+            self.value,
+            [best_params[n] for n in neighbors],
+        )
+        self.log.info(f'Optimization: {result}')
+        self.value = result.value
+        best_params.update(result.neighbor_values)
 
         # update agent
         self.agent.value_changes_count += 1
@@ -110,27 +109,23 @@ class CCoCoA(DCOP):
                and len(self.cost_map) == len(self.graph.neighbors)
 
     def send_update_state_message(self, recipient, data):
-        self.graph.channel.basic_publish(exchange=messaging.COMM_EXCHANGE,
-                                         routing_key=f'{messaging.AGENTS_CHANNEL}.{recipient}',
-                                         body=messaging.create_update_state_message(data))
+        self.graph.transport.publish(routing_key=f'{messaging.AGENTS_CHANNEL}.{recipient}',
+                                     body=messaging.create_update_state_message(self.time_step_payload(data)))
 
     def send_inquiry_message(self, recipient, data):
-        self.graph.channel.basic_publish(exchange=messaging.COMM_EXCHANGE,
-                                         routing_key=f'{messaging.AGENTS_CHANNEL}.{recipient}',
-                                         body=messaging.create_inquiry_message(data))
+        self.graph.transport.publish(routing_key=f'{messaging.AGENTS_CHANNEL}.{recipient}',
+                                     body=messaging.create_inquiry_message(self.time_step_payload(data)))
 
     def send_cost_message(self, recipient, data):
-        self.graph.channel.basic_publish(exchange=messaging.COMM_EXCHANGE,
-                                         routing_key=f'{messaging.AGENTS_CHANNEL}.{recipient}',
-                                         body=messaging.create_cost_message(data))
+        self.graph.transport.publish(routing_key=f'{messaging.AGENTS_CHANNEL}.{recipient}',
+                                     body=messaging.create_cost_message(self.time_step_payload(data)))
 
     def report_state_change_to_dashboard(self):
-        self.graph.channel.basic_publish(exchange=messaging.COMM_EXCHANGE,
-                                         routing_key=f'{messaging.MONITORING_CHANNEL}',
-                                         body=messaging.create_agent_state_changed_message({
-                                             'agent_id': self.agent.agent_id,
-                                             'state': self.state,
-                                         }))
+        self.graph.transport.publish(routing_key=f'{messaging.MONITORING_CHANNEL}',
+                                     body=messaging.create_agent_state_changed_message({
+                                         'agent_id': self.agent.agent_id,
+                                         'state': self.state,
+                                     }))
 
     def receive_cost_message(self, payload):
         self.log.info(f'Received cost message: {payload}')
@@ -148,25 +143,51 @@ class CCoCoA(DCOP):
         key = f'{self.agent.agent_id},{sender}'
         if key in self.agent.active_constraints:
             constraint = self.agent.active_constraints[f'{self.agent.agent_id},{sender}']
-            cost_map = []
-            for value1 in sender_domain:
-                min_cost = float('inf')
-                entry = None
-
-                # if this agent has already set its value then keep it fixed
-                # iter_list = [self.value] if self.value and sender in self.graph.children else self.domain
 
-                for value2 in self.domain:
-                    cost = constraint.evaluate(value2, value1)
-                    if cost < min_cost:
-                        entry = (value1, value2, cost)
-                        min_cost = cost
+            # if this agent has already set its value then keep it fixed
+            # iter_list = [self.value] if self.value and sender in self.graph.children else self.domain
 
-                cost_map.append(entry)
+            cost_map = self.inquiry_cost_map(constraint, sender_domain, self.domain)
 
             # send cost map (via cost message) to requesting agent
             self.send_cost_message(sender, {'agent_id': self.agent.agent_id, 'cost_map': cost_map})
 
+    @classmethod
+    def inquiry_cost_map(cls, constraint, sender_domain, domain) -> list:
+        """
+        Best response of this agent to every sender value (see `DCOP.create_cost_map`).
+        """
+        if len(sender_domain) * len(domain) <= cls.MAX_SCALAR_INQUIRY_PAIRS:
+            return cls.scalar_inquiry_cost_map(constraint, sender_domain, domain)
+        return cls.broadcast_inquiry_cost_map(constraint, sender_domain, domain)
+
+    @staticmethod
+    def scalar_inquiry_cost_map(constraint, sender_domain, domain) -> list:
+        """
+        Evaluates the constraint for every (sender value, value of this agent) pair.
+        """
+        cost_map = []
+        for value1 in sender_domain:
+            min_cost = float('inf')
+            entry = None
+            for value2 in domain:
+                cost = constraint.evaluate(value2, value1)
+                if cost < min_cost:
+                    entry = (value1, value2, cost)
+                    min_cost = cost
+            cost_map.append(entry)
+        return cost_map
+
+    @classmethod
+    def broadcast_inquiry_cost_map(cls, constraint, sender_domain, domain) -> list:
+        """
+        Evaluates the constraint over the grid of (sender value, value of this agent) pairs at once.
+        """
+        # sender values as a column and values of this agent as a row, broadcast to the grid by the evaluation
+        x = np.asarray(domain).reshape(1, -1)
+        y = np.asarray(sender_domain).reshape(-1, 1)
+        return cls.create_cost_map(sender_domain, domain, constraint.evaluate(x, y))
+
     def receive_update_state_message(self, payload):
         self.log.info(f'Received update state message: {payload}')
         data = payload['payload']
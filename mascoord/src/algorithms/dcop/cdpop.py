@@ -1,7 +1,7 @@
 import numpy as np
 
-from mascoord.src import config
 from mascoord.src.algorithms.dcop.dpop import DPOP
+from mascoord.src.algorithms.dcop.optimization import QuadraticNeighborhood
 
 
 class CDPOP(DPOP):
@@ -12,8 +12,7 @@ class CDPOP(DPOP):
 
     def __init__(self, *args, **kwargs):
         super(CDPOP, self).__init__(*args, **kwargs)
-        self.max_iter = 100
-        self.alpha = config.LEARNING_RATE
+        self.optimizer = self.create_optimizer()
         self.X_ij_prev_norm = None
         self.prev_initial_val = None
 
@@ -22,7 +21,7 @@ class CDPOP(DPOP):
         c_util_sum = np.zeros((len(self.domain), len(self.domain)))
         for child in self.graph.children:
             c_util = self.util_messages[child]
-            c_util_sum += np.array(c_util)
+            c_util_sum += np.asarray(c_util)
 
         # parent-level projection
         x_i = np.min(c_util_sum, axis=0)
@@ -40,7 +39,7 @@ class CDPOP(DPOP):
             self.X_ij = constraint.evaluate(xx, yy) + c_util_sum.T
 
             if self.X_ij_prev_norm is None or np.linalg.norm(self.X_ij) != self.X_ij_prev_norm:
-                self.send_util_message(self.graph.parent, self.X_ij.tolist())
+                self.send_util_message(self.graph.parent, self.X_ij)
             self.X_ij_prev_norm = np.linalg.norm(self.X_ij)
         else:
             # set this agent's initial value
@@ -52,7 +51,7 @@ class CDPOP(DPOP):
             if self.prev_initial_val is None or self.prev_initial_val != initial_val:
                 agent_values = {self.agent.agent_id: self.value}
                 for child in self.graph.children:
-                    c_util = np.array(self.util_messages[child])
+                    c_util = np.asarray(self.util_messages[child])
                     agent_values[child] = self.neighbor_domains[child][np.argmin(c_util[:, j])]
 
                 self.nonlinear_optimization(agent_values)
@@ -96,7 +95,7 @@ class CDPOP(DPOP):
 
                 k = self.domain.index(self.value)
                 for child in self.graph.children:
-                    c_util = np.array(self.util_messages[child])
+                    c_util = np.asarray(self.util_messages[child])
                     agent_values[child] = self.neighbor_domains[child][np.argmin(c_util[:, k])]
 
                 self.nonlinear_optimization(agent_values)
@@ -111,22 +110,18 @@ class CDPOP(DPOP):
             self.prev_initial_val = initial_val
 
     def nonlinear_optimization(self, agent_values):
-        # non-linear optimization
-        for i in range(self.max_iter):
-            grad_sum = 0
-            for neighbor in self.graph.neighbors:
-                constraint = self.agent.active_constraints[f'{self.agent.agent_id},{neighbor}']
-                n_value = agent_values[neighbor]
-                grad_sum += constraint.ddx(self.value, n_value)
-
-                # child value optimization (parent value is already set)
-                if self.graph.is_child(neighbor):
-                    n_grad = constraint.ddy(self.value, n_value)
-                    n_value = n_value - self.alpha * n_grad
-                    agent_values[neighbor] = min(max(self.domain_lb, n_value), self.domain_ub)
-
-            self.value = self.value - self.alpha * grad_sum
-            self.value = min(max(self.domain_lb, self.value), self.domain_ub)
+        # non-linear optimization (the children's values are optimized, the parent's value is already set)
+        neighbors = list(self.graph.neighbors)
+        result = self.optimizer.minimize(
+            QuadraticNeighborhood.from_constraints(
+                self.agent, neighbors, free=[self.graph.is_child(n) for n in neighbors],
+            ),
+            self.value,
+            [agent_values[n] for n in neighbors],
+        )
+        self.log.info(f'Optimization: {result}')
+        self.value = result.value
+        agent_values.update(result.neighbor_values)
         self.agent.value_changes_count += 1
         self.params = agent_values
         self.calculate_and_report_cost(agent_values)
@@ -2,7 +2,6 @@ import random
 
 from mascoord.src import config, messaging
 from mascoord.src.algorithms.dcop import DCOP
-from mascoord.src.envs.mobile_sensing import GridWorld
 
 
 class CoCoA(DCOP):
@@ -133,32 +132,27 @@ class CoCoA(DCOP):
                and len(self.cost_map) == len(self.graph.neighbors)
 
     def send_update_state_message(self, recipient, data):
-        self.graph.channel.basic_publish(exchange=messaging.COMM_EXCHANGE,
-                                         routing_key=f'{messaging.AGENTS_CHANNEL}.{recipient}',
-                                         body=messaging.create_update_state_message(data))
+        self.graph.transport.publish(routing_key=f'{messaging.AGENTS_CHANNEL}.{recipient}',
+                                     body=messaging.create_update_state_message(self.time_step_payload(data)))
 
     def send_execution_request_message(self, recipient, data):
-        self.graph.channel.basic_publish(exchange=messaging.COMM_EXCHANGE,
-                                         routing_key=f'{messaging.AGENTS_CHANNEL}.{recipient}',
-                                         body=messaging.create_execution_request_message(data))
+        self.graph.transport.publish(routing_key=f'{messaging.AGENTS_CHANNEL}.{recipient}',
+                                     body=messaging.create_execution_request_message(self.time_step_payload(data)))
 
     def _send_inquiry_message(self, recipient, data):
-        self.graph.channel.basic_publish(exchange=messaging.COMM_EXCHANGE,
-                                         routing_key=f'{messaging.AGENTS_CHANNEL}.{recipient}',
-                                         body=messaging.create_inquiry_message(data))
+        self.graph.transport.publish(routing_key=f'{messaging.AGENTS_CHANNEL}.{recipient}',
+                                     body=messaging.create_inquiry_message(self.time_step_payload(data)))
 
     def send_cost_message(self, recipient, data):
-        self.graph.channel.basic_publish(exchange=messaging.COMM_EXCHANGE,
-                                         routing_key=f'{messaging.AGENTS_CHANNEL}.{recipient}',
-                                         body=messaging.create_cost_message(data))
+        self.graph.transport.publish(routing_key=f'{messaging.AGENTS_CHANNEL}.{recipient}',
+                                     body=messaging.create_cost_message(self.time_step_payload(data)))
 
     def report_state_change_to_dashboard(self):
-        self.graph.channel.basic_publish(exchange=messaging.COMM_EXCHANGE,
-                                         routing_key=f'{messaging.MONITORING_CHANNEL}',
-                                         body=messaging.create_agent_state_changed_message({
-                                             'agent_id': self.agent.agent_id,
-                                             'state': self.state,
-                                         }))
+        self.graph.transport.publish(routing_key=f'{messaging.MONITORING_CHANNEL}',
+                                     body=messaging.create_agent_state_changed_message({
+                                         'agent_id': self.agent.agent_id,
+                                         'state': self.state,
+                                     }))
 
     def receive_cost_message(self, payload):
         self.log.info(f'Received cost message: {payload}')
@@ -173,27 +167,18 @@ class CoCoA(DCOP):
         sender = data['agent_id']
         sender_domain = data['domain']
 
-        cost_map = []
-        for value1 in sender_domain:
-            min_cost = float('inf')
-            entry = None
-
-            # if this agent has already set its value then keep it fixed
-            iter_list = [self.value] if self.value and sender in self.graph.children else self.domain
-
-            for value2 in iter_list:
-                cost = GridWorld.constraint_evaluation(
-                    sender=sender,
-                    agent_values={
-                        sender: value1,
-                        self.agent.agent_id: value2,
-                    }
-                )
-                if cost < min_cost:
-                    entry = (value1, value2, cost)
-                    min_cost = cost
-
-            cost_map.append(entry)
+        # if this agent has already set its value then keep it fixed
+        iter_list = [self.value] if self.value and sender in self.graph.children else self.domain
+
+        # costs of all the (sender value, value of this agent) pairs
+        costs = self.agent.sim_env.constraint_evaluation_matrix(
+            sender=sender,
+            agent_1=sender,
+            values_1=sender_domain,
+            agent_2=self.agent.agent_id,
+            values_2=iter_list,
+        )
+        cost_map = self.create_cost_map(sender_domain, iter_list, costs)
 
         # send cost map (via cost message) to requesting agent
         self.send_cost_message(sender, {'agent_id': self.agent.agent_id, 'cost_map': cost_map})
@@ -2,7 +2,6 @@ import numpy as np
 
 from mascoord.src import messaging, config
 from mascoord.src.algorithms.dcop import DCOP
-from mascoord.src.envs.mobile_sensing import GridWorld
 
 
 class DPOP(DCOP):
@@ -62,7 +61,7 @@ class DPOP(DCOP):
         for child in self.graph.children:
             c_util = self.util_messages[child]
             try:
-                c_util_sum += np.array(c_util)
+                c_util_sum += np.asarray(c_util)
             except Exception as e:
                 self.log.error(str(e))
 
@@ -70,21 +69,18 @@ class DPOP(DCOP):
         if self.graph.parent:
             p_domain = self.neighbor_domains[self.graph.parent]
 
-            self.X_ij = np.zeros((len(self.domain), len(p_domain)))
-
-            for i in range(len(self.domain)):
-                for j in range(len(p_domain)):
-                    self.X_ij[i, j] = GridWorld.constraint_evaluation(
-                        sender=self.agent.agent_id,
-                        agent_values={
-                            self.graph.parent: p_domain[j],
-                            self.agent.agent_id: self.domain[i],
-                        }
-                    )
+            # costs of all the (value of this agent, parent value) pairs
+            self.X_ij = self.agent.sim_env.constraint_evaluation_matrix(
+                sender=self.agent.agent_id,
+                agent_1=self.agent.agent_id,
+                values_1=self.domain,
+                agent_2=self.graph.parent,
+                values_2=p_domain,
+            )
             self.X_ij = self.X_ij + c_util_sum.reshape(-1, 1)
             x_j = self.optimization_op(self.X_ij, axis=0)
 
-            self.send_util_message(self.graph.parent, x_j.tolist())
+            self.send_util_message(self.graph.parent, x_j)
         else:
             # parent-level projection
             self.cost = float(self.optimization_op(c_util_sum))
@@ -161,12 +157,11 @@ class DPOP(DCOP):
         self._send_util_requests_to_children()
 
     def send_util_message(self, recipient, util):
-        self.graph.channel.basic_publish(exchange=messaging.COMM_EXCHANGE,
-                                         routing_key=f'{messaging.AGENTS_CHANNEL}.{recipient}',
-                                         body=messaging.create_util_message({
-                                             'agent_id': self.agent.agent_id,
-                                             'util': util,
-                                         }))
+        self.graph.transport.publish(routing_key=f'{messaging.AGENTS_CHANNEL}.{recipient}',
+                                     body=messaging.create_util_message(self.time_step_payload({
+                                         'agent_id': self.agent.agent_id,
+                                         'util': util,
+                                     })))
 
     def receive_value_message(self, payload):
         self.log.info(f'Received VALUE message: {payload}')
@@ -194,19 +189,17 @@ class DPOP(DCOP):
                 self.send_value_message(child, {'cpa': self.cpa})
 
     def send_value_message(self, recipient, value):
-        self.graph.channel.basic_publish(exchange=messaging.COMM_EXCHANGE,
-                                         routing_key=f'{messaging.AGENTS_CHANNEL}.{recipient}',
-                                         body=messaging.create_value_message({
-                                             'agent_id': self.agent.agent_id,
-                                             'value': value,
-                                         }))
+        self.graph.transport.publish(routing_key=f'{messaging.AGENTS_CHANNEL}.{recipient}',
+                                     body=messaging.create_value_message(self.time_step_payload({
+                                         'agent_id': self.agent.agent_id,
+                                         'value': value,
+                                     })))
 
     def request_util_message(self, child):
-        self.graph.channel.basic_publish(exchange=messaging.COMM_EXCHANGE,
-                                         routing_key=f'{messaging.AGENTS_CHANNEL}.{child}',
-                                         body=messaging.create_request_util_message({
-                                             'agent_id': self.agent.agent_id,
-                                         }))
+        self.graph.transport.publish(routing_key=f'{messaging.AGENTS_CHANNEL}.{child}',
+                                     body=messaging.create_request_util_message(self.time_step_payload({
+                                         'agent_id': self.agent.agent_id,
+                                     })))
 
     def receive_util_message_request(self, payload):
         self.log.info(f'Received UTIL request message: {payload}')
@@ -0,0 +1,284 @@
+"""
+Continuous optimization of the values of an agent and its neighbors (C-CoCoA and C-DPOP).
+
+The local objective of an agent is the sum of its Quadratic constraints with its neighbors:
+
+    f(x, y) = sum_k a_k * x^2 + b_k * x * y_k + c_k * y_k^2
+
+where x is the value of the agent and y_k the value of its k-th neighbor. The coefficients of the constraints are
+stacked into arrays once, then every iteration is a projected gradient step on all the values at once (the values are
+clipped to the domain bounds). The values of some neighbors can be kept fixed (e.g. the parent's value in C-DPOP).
+
+The step size is either fixed (the learning rate), found by backtracking line search, or adapted per value (Adam, whose
+values move by about the learning rate per iteration). The optimization stops after the maximum number of iterations,
+or earlier when a tolerance is set and no value moves by more than it.
+
+Since the objective is quadratic, it can also be minimized exactly when it is strictly convex (`AnalyticOptimizer`),
+the gradient descent being the fallback for the other objectives.
+"""
+import numpy as np
+
+FIXED_STEP = 'fixed'
+LINE_SEARCH = 'line-search'
+ADAM = 'adam'
+
+STEP_CONTROLS = [FIXED_STEP, LINE_SEARCH, ADAM]
+
+GRADIENT = 'gradient'
+ANALYTIC = 'analytic'
+
+SOLVERS = [GRADIENT, ANALYTIC]
+
+
+class QuadraticNeighborhood:
+    """
+    Local objective of an agent over its value and the values of its neighbors.
+    """
+
+    def __init__(self, neighbors, a, b, c, free=None):
+        self.neighbors = list(neighbors)
+        self.a = np.asarray(a, dtype=float)
+        self.b = np.asarray(b, dtype=float)
+        self.c = np.asarray(c, dtype=float)
+        # neighbors whose value is optimized along with the agent's value
+        self.free = np.ones(len(self.neighbors), dtype=bool) if free is None else np.asarray(free, dtype=bool)
+
+    @classmethod
+    def from_constraints(cls, agent, neighbors, free=None):
+        """
+        Stacks the coefficients of the active constraints of the agent with the given neighbors.
+        """
+        coefficients = np.array([
+            [
+                agent.active_constraints[f'{agent.agent_id},{neighbor}'].coefficients[k] for k in ('a', 'b', 'c')
+            ] for neighbor in neighbors
+        ], dtype=float).reshape(-1, 3)
+        return cls(neighbors, coefficients[:, 0], coefficients[:, 1], coefficients[:, 2], free=free)
+
+    def evaluate(self, x, y) -> float:
+        return float(np.sum(self.a * x ** 2 + self.b * x * y + self.c * y ** 2))
+
+    def gradient(self, x, y):
+        """
+        :return: derivative with respect to x, derivatives with respect to the y_k (0 for the fixed neighbors)
+        """
+        dx = float(np.sum(2 * self.a * x + self.b * y))
+        dy = np.where(self.free, self.b * x + 2 * self.c * y, 0.)
+        return dx, dy
+
+    def hessian(self):
+        """
+        Hessian of the objective with respect to the agent's value and the values of the free neighbors (in this order)
+        and the constant gradient added by the fixed neighbors.
+
+        The objective over these values u is `0.5 * u^T H u + g^T u` (plus a constant).
+        """
+        free = np.flatnonzero(self.free)
+        hessian = np.zeros((len(free) + 1, len(free) + 1))
+        hessian[0, 0] = 2 * np.sum(self.a)
+        hessian[0, 1:] = hessian[1:, 0] = self.b[free]
+        hessian[1:, 1:] = np.diag(2 * self.c[free])
+        return hessian
+
+    def __len__(self):
+        return len(self.neighbors)
+
+
+class OptimizationResult:
+
+    def __init__(self, value, neighbor_values, num_iterations, converged, solver=GRADIENT):
+        self.value = value
+        # neighbor -> value
+        self.neighbor_values = neighbor_values
+        self.num_iterations = num_iterations
+        self.converged = converged
+        self.solver = solver
+
+    def __str__(self):
+        return f'OptimizationResult(value={self.value}, solver={self.solver}, num_iterations={self.num_iterations}, ' \
+               f'converged={self.converged})'
+
+
+class GradientOptimizer:
+    """
+    Projected gradient descent on a `QuadraticNeighborhood`.
+    """
+
+    def __init__(self, learning_rate, lower_bound, upper_bound, max_iter=100, tol=None, step_control=FIXED_STEP,
+                 beta1=.9, beta2=.999, epsilon=1e-8):
+        if step_control not in STEP_CONTROLS:
+            raise ValueError(f'Unknown step control: {step_control}')
+
+        self.learning_rate = learning_rate
+        self.lower_bound = lower_bound
+        self.upper_bound = upper_bound
+        self.max_iter = max_iter
+        self.tol = tol
+        self.step_control = step_control
+
+        # Adam
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+
+    def minimize(self, objective: QuadraticNeighborhood, value, neighbor_values) -> OptimizationResult:
+        """
+        Minimizes the objective starting from the given values.
+
+        :param objective: the local objective
+        :param value: initial value of the agent
+        :param neighbor_values: initial values of the neighbors, in the order of `objective.neighbors`
+        """
+        # the agent's value is the first entry of z, followed by the values of the neighbors
+        z = np.concatenate(([value], np.asarray(neighbor_values, dtype=float)))
+        step = self.learning_rate
+        m = np.zeros_like(z)
+        v = np.zeros_like(z)
+
+        num_iterations = 0
+        converged = False
+        while num_iterations < self.max_iter:
+            num_iterations += 1
+            g = self._gradient(objective, z)
+
+            if self.step_control == LINE_SEARCH:
+                z_new, step = self._line_search(objective, z, g, step)
+            elif self.step_control == ADAM:
+                m = self.beta1 * m + (1 - self.beta1) * g
+                v = self.beta2 * v + (1 - self.beta2) * g ** 2
+                m_hat = m / (1 - self.beta1 ** num_iterations)
+                v_hat = v / (1 - self.beta2 ** num_iterations)
+                z_new = self._project(z - self.learning_rate * m_hat / (np.sqrt(v_hat) + self.epsilon))
+            else:
+                z_new = self._project(z - step * g)
+
+            moved = float(np.max(np.abs(z_new - z)))
+            z = z_new
+            if self.tol is not None and moved <= self.tol:
+                converged = True
+                break
+
+        return OptimizationResult(
+            value=float(z[0]),
+            neighbor_values={neighbor: float(y) for neighbor, y in zip(objective.neighbors, z[1:])},
+            num_iterations=num_iterations,
+            converged=converged,
+        )
+
+    @staticmethod
+    def _gradient(objective, z):
+        dx, dy = objective.gradient(z[0], z[1:])
+        return np.concatenate(([dx], dy))
+
+    def _project(self, z):
+        return np.clip(z, self.lower_bound, self.upper_bound)
+
+    def _line_search(self, objective, z, g, step, shrink=.5, max_backtracks=30):
+        """
+        Backtracking line search of the projected gradient step, starting from twice the previous step size.
+
+        :return: the new values and the step size used
+        """
+        f = objective.evaluate(z[0], z[1:])
+        step *= 2
+        for _ in range(max_backtracks):
+            z_new = self._project(z - step * g)
+            d = z_new - z
+            # sufficient decrease of the quadratic upper bound of the objective
+            if objective.evaluate(z_new[0], z_new[1:]) <= f + float(g @ d) + float(d @ d) / (2 * step):
+                break
+            step *= shrink
+        return z_new, step
+
+
+class AnalyticOptimizer:
+    """
+    Exact minimization of a strictly convex `QuadraticNeighborhood` over the domain box.
+
+    The objective is strictly convex when its Hessian is positive definite (checked with a Cholesky factorization).
+    Its unconstrained minimum is then the solution of one linear system, used when it lies in the box. Otherwise the
+    box-constrained problem is solved exactly using the structure of the Hessian: given the agent's value x, the
+    neighbors' values are independent and each is its unconstrained minimizer clipped to the bounds. Minimizing over
+    them leaves a convex, piecewise quadratic function of x, whose pieces are delimited by the values of x at which a
+    neighbor's value reaches a bound, and the minimum of every piece is known in closed form.
+
+    The objectives that are not strictly convex are handed to the `fallback` optimizer.
+    """
+
+    def __init__(self, lower_bound, upper_bound, fallback: GradientOptimizer):
+        self.lower_bound = lower_bound
+        self.upper_bound = upper_bound
+        self.fallback = fallback
+
+    def minimize(self, objective: QuadraticNeighborhood, value, neighbor_values) -> OptimizationResult:
+        neighbor_values = np.asarray(neighbor_values, dtype=float)
+        hessian = objective.hessian()
+        try:
+            np.linalg.cholesky(hessian)
+        except np.linalg.LinAlgError:
+            return self.fallback.minimize(objective, value, neighbor_values)
+
+        free = objective.free
+        fixed = ~free
+        # gradient of the fixed neighbors' terms with respect to the agent's value
+        g = np.zeros(len(hessian))
+        g[0] = np.sum(objective.b[fixed] * neighbor_values[fixed])
+
+        u = np.linalg.solve(hessian, -g)
+        if np.any(u < self.lower_bound) or np.any(u > self.upper_bound):
+            x = self._minimize_box(objective, neighbor_values)
+            u = np.concatenate(([x], self._best_responses(objective, x)))
+
+        z = neighbor_values.copy()
+        z[free] = u[1:]
+        return OptimizationResult(
+            value=float(u[0]),
+            neighbor_values={neighbor: float(y) for neighbor, y in zip(objective.neighbors, z)},
+            num_iterations=0,
+            converged=True,
+            solver=ANALYTIC,
+        )
+
+    def _best_responses(self, objective, x):
+        """
+        Values of the free neighbors minimizing the objective for the agent's value x.
+        """
+        free = objective.free
+        return np.clip(-objective.b[free] * x / (2 * objective.c[free]), self.lower_bound, self.upper_bound)
+
+    def _minimize_box(self, objective, neighbor_values):
+        """
+        The agent's value minimizing the objective over the box, the free neighbors taking their best responses.
+        """
+        free = objective.free
+        a, b, c = objective.a, objective.b, objective.c
+        bf, cf = b[free], c[free]
+
+        # values of x at which a free neighbor's best response reaches a bound
+        breakpoints = [self.lower_bound, self.upper_bound]
+        for bound in (self.lower_bound, self.upper_bound):
+            nonzero = bf != 0
+            breakpoints.extend((-2 * cf[nonzero] * bound / bf[nonzero]).tolist())
+        breakpoints = np.unique(np.clip(breakpoints, self.lower_bound, self.upper_bound))
+
+        # constant part of the quadratic in x: terms of the fixed neighbors (A x^2 + B x)
+        fixed_a = np.sum(a)
+        fixed_b = np.sum(b[~free] * neighbor_values[~free])
+
+        best_x, best_f = None, None
+        for lo, hi in zip(breakpoints[:-1], breakpoints[1:]):
+            # the neighbors that are clipped do not change within the piece
+            y = self._best_responses(objective, (lo + hi) / 2)
+            clipped = (y <= self.lower_bound) | (y >= self.upper_bound)
+            quad_a = fixed_a + np.sum(-bf[~clipped] ** 2 / (4 * cf[~clipped]))
+            quad_b = fixed_b + np.sum(bf[clipped] * y[clipped])
+            x = min(max(-quad_b / (2 * quad_a), lo), hi) if quad_a > 0 else lo
+
+            for candidate in (x, lo, hi):
+                values = neighbor_values.copy()
+                values[free] = self._best_responses(objective, candidate)
+                f = objective.evaluate(candidate, values)
+                if best_f is None or f < best_f:
+                    best_x, best_f = candidate, f
+
+        return float(best_x)
@@ -12,14 +12,13 @@ class DynaGraph:
 
     def __init__(self, agent):
         self.agent = agent
-        self.channel = self.agent.channel
+        self.transport = self.agent.transport
         self.parent = None
         self.children = []
         self.pseudo_children = []
         self.pseudo_parents = []
         self.children_history = {}
         self.log = self.agent.log
-        self.client = agent.client
         self.exec_started = False
 
     def has_no_neighbors(self):
@@ -49,19 +48,17 @@ class DynaGraph:
         self.exec_started = True
 
     def send_to_agent(self, body, to):
-        self.channel.basic_publish(exchange=messaging.COMM_EXCHANGE,
-                                   routing_key=f'{messaging.AGENTS_CHANNEL}.{to}',
-                                   body=body)
+        self.transport.publish(routing_key=f'{messaging.AGENTS_CHANNEL}.{to}',
+                               body=body)
 
     def report_connection(self, parent, child, constraint):
-        self.channel.basic_publish(exchange=messaging.COMM_EXCHANGE,
-                                   routing_key=f'{messaging.MONITORING_CHANNEL}',
-                                   body=messaging.create_agent_connection_message({
-                                       'agent_id': self.agent.agent_id,
-                                       'child': child,
-                                       'parent': parent,
-                                       'constraint': str(constraint),
-                                   }))
+        self.transport.publish(routing_key=f'{messaging.MONITORING_CHANNEL}',
+                               body=messaging.create_agent_connection_message({
+                                   'agent_id': self.agent.agent_id,
+                                   'child': child,
+                                   'parent': parent,
+                                   'constraint': str(constraint),
+                               }))
 
     def has_potential_parent(self):
         ...
@@ -74,8 +71,7 @@ class DynaGraph:
 
     def report_agent_disconnection(self, agent):
         # inform dashboard about disconnection
-        self.channel.basic_publish(
-            exchange=messaging.COMM_EXCHANGE,
+        self.transport.publish(
             routing_key=f'{messaging.MONITORING_CHANNEL}',
             body=messaging.create_agent_disconnection_message({
                 'agent_id': self.agent.agent_id,
@@ -85,8 +81,7 @@ class DynaGraph:
         )
 
         # update current graph
-        self.channel.basic_publish(
-            exchange=messaging.COMM_EXCHANGE,
+        self.transport.publish(
             routing_key=f'{messaging.SIM_ENV_CHANNEL}',
             body=messaging.create_remove_graph_edge_message({
                 'agent_id': self.agent.agent_id,
@@ -1,5 +1,3 @@
-import time
-
 from mascoord.src import messaging
 from mascoord.src.algorithms.graphs.base import DynaGraph, get_agent_order
 
@@ -53,21 +51,23 @@ class DBFS(DynaGraph):
                 sm_agt = agt
 
         # send layer messages if this agent has the smallest order
-        if self.agent.agents_in_comm_range and sm_agt:
-            time.sleep(.2)  # wait for other agents to be ready for messages
-            if self.agent.agent_id == sm_agt:
-                self.level = 0
-                for a in self.agent.agents_in_comm_range:
-                    self.log.debug(f'Sending root level msg to {a}')
-                    self.send_to_agent(
-                        body=messaging.create_dbfs_level_message({
-                            'agent_id': self.agent.agent_id,
-                            'level': self.level,
-                            'extra_args': self.agent.connection_extra_args,
-                        }),
-                        to=a,
-                    )
-                    self._potential_children_count += 1
+        if self.agent.agents_in_comm_range and sm_agt and self.agent.agent_id == sm_agt:
+            # wait for other agents to be ready for messages without blocking the agent's event loop
+            self.transport.call_later(.2, self._send_root_level_messages)
+
+    def _send_root_level_messages(self):
+        self.level = 0
+        for a in self.agent.agents_in_comm_range:
+            self.log.debug(f'Sending root level msg to {a}')
+            self.send_to_agent(
+                body=messaging.create_dbfs_level_message({
+                    'agent_id': self.agent.agent_id,
+                    'level': self.level,
+                    'extra_args': self.agent.connection_extra_args,
+                }),
+                to=a,
+            )
+            self._potential_children_count += 1
 
     def receive_dbfs_level_message(self, message):
         self.log.debug(f'Received DBFS level message: {message}')
@@ -126,8 +126,7 @@ class DBFS(DynaGraph):
         self.agent.connection_extra_args_callback(sender, msg['extra_args'])
 
         # update current sim graph
-        self.channel.basic_publish(
-            exchange=messaging.COMM_EXCHANGE,
+        self.transport.publish(
             routing_key=f'{messaging.SIM_ENV_CHANNEL}',
             body=messaging.create_add_graph_edge_message({
                 'agent_id': self.agent.agent_id,
@@ -35,8 +35,7 @@ class DDFS(DynaGraph):
         self._max = 0
 
         # send neighbor data to sim env
-        self.channel.basic_publish(
-            exchange=messaging.COMM_EXCHANGE,
+        self.transport.publish(
             routing_key=f'{messaging.SIM_ENV_CHANNEL}',
             body=messaging.create_neighbor_data_message({
                 'agent_id': self.agent.agent_id,
@@ -200,8 +199,7 @@ class DDFS(DynaGraph):
         self.agent.connection_extra_args_callback(msg['agent_id'], msg['extra_args'])
 
         # update current graph
-        self.channel.basic_publish(
-            exchange=messaging.COMM_EXCHANGE,
+        self.transport.publish(
             routing_key=f'{messaging.SIM_ENV_CHANNEL}',
             body=messaging.create_add_graph_edge_message({
                 'agent_id': self.agent.agent_id,
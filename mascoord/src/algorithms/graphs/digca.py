@@ -1,5 +1,5 @@
+import functools
 import random
-import time
 
 from mascoord.src import messaging
 from mascoord.src.algorithms.graphs.base import DynaGraph, get_agent_order
@@ -27,22 +27,39 @@ class DIGCA(DynaGraph):
         self._ignored_ann_msgs = {}
         self._parent_already_assigned_msgs = {}
         self._timeout_delay_in_seconds = .5
-        self._timeout_delay_start = None
+        self._timeout_delay_elapsed = False
+        self._time_step_token = 0
+        self._announce_window_in_seconds = .1
+        self._awaiting_announce_responses = False
 
     def on_time_step_changed(self):
         self._ignored_ann_msgs.clear()
         self._parent_already_assigned_msgs.clear()
         self._has_sent_parent_available = False
-        self._timeout_delay_start = time.time()
         self.exec_started = False
 
+        # the agent loop is event-driven, so schedule a wake-up for when the DCOP start delay elapses
+        self._timeout_delay_elapsed = False
+        self._time_step_token += 1
+        self.transport.call_later(
+            self._timeout_delay_in_seconds,
+            functools.partial(self._on_timeout_delay_elapsed, self._time_step_token),
+        )
+
+    def _on_timeout_delay_elapsed(self, token):
+        # ignore timers scheduled in earlier time steps
+        if token == self._time_step_token:
+            self._timeout_delay_elapsed = True
+
     def connect(self):
         if not self.parent and self.has_potential_parent() and self.state == State.INACTIVE:
+            if self._awaiting_announce_responses:
+                return
+
             self.log.debug(f'Publishing Announce message...')
 
             # publish Announce message
-            self.channel.basic_publish(
-                exchange=messaging.COMM_EXCHANGE,
+            self.transport.publish(
                 routing_key=f'{messaging.SIM_ENV_CHANNEL}',
                 body=messaging.create_announce_message({
                     'agent_id': self.agent.agent_id,
@@ -50,41 +67,12 @@ class DIGCA(DynaGraph):
             )
 
             # wait to receive responses
-            self.agent.listen_to_network()
+            self._awaiting_announce_responses = True
+            self.transport.call_later(self._announce_window_in_seconds, self._select_parent)
 
-            self.log.debug(f'AnnounceResponse list in connect: {self.announceResponseList}')
-
-            # select agent to connect to
-            selected_agent = None
-            if self.announceResponseList:
-                selected_agent = random.choice(self.announceResponseList)
-
-            if selected_agent is not None:
-                self.log.debug(f'Selected agent for AddMe: {selected_agent}')
-                self.send_to_agent(
-                    body=messaging.create_add_me_message({'agent_id': self.agent.agent_id}),
-                    to=selected_agent,
-                )
-                self.state = State.ACTIVE
-
-            # send announce response ignored messages
-            for a in set(self.announceResponseList):
-                if a != selected_agent:
-                    self.channel.basic_publish(
-                        exchange=messaging.COMM_EXCHANGE,
-                        routing_key=f'{messaging.AGENTS_CHANNEL}.{a}',
-                        body=messaging.create_announce_response_ignored_message({
-                            'agent_id': self.agent.agent_id,
-                        })
-                    )
-
-            self.announceResponseList.clear()
-
-        elif not self.exec_started \
-                and self._timeout_delay_start \
-                and time.time() - self._timeout_delay_start > self._timeout_delay_in_seconds:
+        elif not self.exec_started and self._timeout_delay_elapsed:
             self.start_dcop()
-            self._timeout_delay_start = None
+            self._timeout_delay_elapsed = False
 
             # all_potential_children = set(self._get_potential_children())
             # exclusion_set = set(self._parent_already_assigned_msgs.keys()) ^ set(self.neighbors)
@@ -104,6 +92,39 @@ class DIGCA(DynaGraph):
         # else:
         #     self.log.debug(f'Not announcing, state={self.state}')
 
+    def _select_parent(self):
+        """
+        Called when the announce window closes to select a parent from the agents that responded.
+        """
+        self._awaiting_announce_responses = False
+
+        self.log.debug(f'AnnounceResponse list in connect: {self.announceResponseList}')
+
+        # select agent to connect to
+        selected_agent = None
+        if self.announceResponseList:
+            selected_agent = random.choice(self.announceResponseList)
+
+        if selected_agent is not None:
+            self.log.debug(f'Selected agent for AddMe: {selected_agent}')
+            self.send_to_agent(
+                body=messaging.create_add_me_message({'agent_id': self.agent.agent_id}),
+                to=selected_agent,
+            )
+            self.state = State.ACTIVE
+
+        # send announce response ignored messages
+        for a in set(self.announceResponseList):
+            if a != selected_agent:
+                self.transport.publish(
+                    routing_key=f'{messaging.AGENTS_CHANNEL}.{a}',
+                    body=messaging.create_announce_response_ignored_message({
+                        'agent_id': self.agent.agent_id,
+                    })
+                )
+
+        self.announceResponseList.clear()
+
     def receive_announce(self, message):
         self.log.debug(f'Received announce: {message}')
         sender = message['payload']['agent_id']
@@ -146,8 +167,7 @@ class DIGCA(DynaGraph):
             self.log.info(f'Added agent {sender} to children: {self.children}')
 
             # update current graph
-            self.channel.basic_publish(
-                exchange=messaging.COMM_EXCHANGE,
+            self.transport.publish(
                 routing_key=f'{messaging.SIM_ENV_CHANNEL}',
                 body=messaging.create_add_graph_edge_message({
                     'agent_id': self.agent.agent_id,
@@ -185,8 +205,7 @@ class DIGCA(DynaGraph):
             self.log.info(f'Set parent node to agent {sender}')
 
             # update current graph
-            self.channel.basic_publish(
-                exchange=messaging.COMM_EXCHANGE,
+            self.transport.publish(
                 routing_key=f'{messaging.SIM_ENV_CHANNEL}',
                 body=messaging.create_add_graph_edge_message({
                     'agent_id': self.agent.agent_id,
@@ -218,8 +237,7 @@ class DIGCA(DynaGraph):
                 #     body=messaging.create_ping_message({'agent_id': self.agent.agent_id}),
                 #     to=agent,
                 # )
-                self.channel.basic_publish(
-                    exchange=messaging.COMM_EXCHANGE,
+                self.transport.publish(
                     routing_key=f'{messaging.SIM_ENV_CHANNEL}',
                     body=messaging.create_ping_message({'agent_id': self.agent.agent_id, 'recipient': agent})
                 )
@@ -345,8 +363,7 @@ class DIGCA(DynaGraph):
         # self.log.info(f'Received parent available message: {message}')
         if self.parent:
             sender = message['payload']['agent_id']
-            self.channel.basic_publish(
-                exchange=messaging.COMM_EXCHANGE,
+            self.transport.publish(
                 routing_key=f'{messaging.AGENTS_CHANNEL}.{sender}',
                 body=messaging.create_parent_already_assigned_message({
                     'agent_id': self.agent.agent_id,
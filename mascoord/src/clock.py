@@ -0,0 +1,237 @@
+"""
+Clocks used for timestamps, delays and the event loop of the agent host.
+
+By default the wall clock is used. With the virtual clock, simulations run as a discrete-event simulation: the agents,
+the simulation environment and the runner are hosted on one `VirtualTimeEventLoop` (see `host.AsyncAgentHost`), whose
+time only advances, straight to the next scheduled timer, when there is nothing else to run. Delays then take no wall
+time and, since all components run on one thread in a deterministic order, runs are reproducible for a given seed.
+
+Other threads that drive a virtual-time simulation (e.g. the factory executing handlers) must do so within
+`driving()`, so the loop does not advance the time while they are working, and wait with `sleep` and `wait`.
+"""
+import asyncio
+import concurrent.futures
+import contextlib
+import datetime
+import selectors
+import threading
+import time as _time
+
+WALL = 'wall'
+VIRTUAL = 'virtual'
+
+CLOCKS = [WALL, VIRTUAL]
+
+
+class WallClock:
+    """
+    Real time.
+    """
+
+    name = WALL
+
+    def time(self):
+        return _time.time()
+
+    def monotonic(self):
+        return _time.monotonic()
+
+    def sleep(self, duration):
+        _time.sleep(duration)
+
+    def wait(self, future, timeout=None):
+        """
+        Waits for a `concurrent.futures.Future` to be done.
+        """
+        concurrent.futures.wait([future], timeout=timeout)
+
+    def driving(self):
+        return contextlib.nullcontext()
+
+    def new_event_loop(self):
+        return asyncio.new_event_loop()
+
+
+class VirtualClock:
+    """
+    Simulated time, advanced by a `VirtualTimeEventLoop`.
+    """
+
+    name = VIRTUAL
+
+    # minimum difference between two timestamps, so that the timestamps of messages keep their creation order
+    TIMESTAMP_RESOLUTION = 1e-9
+
+    def __init__(self):
+        self.loop = None
+        self._now = 0.
+        self._last_timestamp = 0.
+        self._num_drivers = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def time(self):
+        with self._lock:
+            self._last_timestamp = max(self._now, self._last_timestamp + self.TIMESTAMP_RESOLUTION)
+            return self._last_timestamp
+
+    def monotonic(self):
+        return self._now
+
+    def advance(self, duration):
+        self._now += duration
+
+    @property
+    def is_driven(self):
+        """
+        Whether a thread other than the event loop is working on the simulation (the time must not advance).
+        """
+        return self._num_drivers > 0
+
+    def _acquire(self):
+        with self._lock:
+            self._num_drivers += 1
+
+    def _release(self):
+        with self._lock:
+            self._num_drivers -= 1
+
+        # wake up the event loop to let it advance the time
+        if self.loop is not None and not self._on_loop():
+            self.loop.call_soon_threadsafe(lambda: None)
+
+    def _on_loop(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    @contextlib.contextmanager
+    def driving(self):
+        self._acquire()
+        self._local.driving = True
+        try:
+            yield
+        finally:
+            self._local.driving = False
+            self._release()
+
+    def wait(self, future, timeout=None):
+        """
+        Waits for a `concurrent.futures.Future` completed by the event loop. A driving thread lets the time advance
+        while it waits and resumes driving when the future is done, before the loop can advance the time again.
+        """
+        if self._on_loop():
+            raise RuntimeError('Cannot wait on the event loop thread')
+
+        driving = getattr(self._local, 'driving', False)
+        resumed = threading.Event()
+
+        def on_done(_):
+            # called by the event loop when it completes the future (or right away if it is already done)
+            if driving:
+                self._acquire()
+            resumed.set()
+
+        future.add_done_callback(on_done)
+        if driving:
+            self._release()
+
+        if not resumed.wait(timeout) and driving:
+            future.remove_done_callback(on_done)
+            self._acquire()
+
+    def sleep(self, duration):
+        self.wait(asyncio.run_coroutine_threadsafe(asyncio.sleep(duration), self.loop))
+
+    def new_event_loop(self):
+        if self.loop is not None:
+            raise RuntimeError('The virtual clock is already used by an event loop')
+        self.loop = VirtualTimeEventLoop(self)
+        return self.loop
+
+
+class _VirtualTimeSelector:
+    """
+    Selector of a `VirtualTimeEventLoop`. Instead of blocking until the next timer is due, advances the clock to it.
+    """
+
+    def __init__(self, selector, virtual_clock):
+        self._selector = selector
+        self._clock = virtual_clock
+
+    def select(self, timeout=None):
+        events = self._selector.select(0)
+        if events or timeout == 0:
+            return events
+
+        # block until something happens if nothing is scheduled or another thread is working on the simulation
+        if timeout is None or self._clock.is_driven:
+            return self._selector.select(None)
+
+        self._clock.advance(timeout)
+        return []
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop running on the time of a `VirtualClock`.
+    """
+
+    def __init__(self, virtual_clock):
+        self._virtual_clock = virtual_clock
+        super(VirtualTimeEventLoop, self).__init__(_VirtualTimeSelector(selectors.DefaultSelector(), virtual_clock))
+
+    def time(self):
+        return self._virtual_clock.monotonic()
+
+
+_clock = WallClock()
+
+
+def set_clock(name):
+    global _clock
+
+    if name not in CLOCKS:
+        raise ValueError(f'Unknown clock: {name}')
+    if name != _clock.name:
+        _clock = VirtualClock() if name == VIRTUAL else WallClock()
+
+
+def get_clock():
+    return _clock
+
+
+def is_virtual():
+    return _clock.name == VIRTUAL
+
+
+def time():
+    return _clock.time()
+
+
+def monotonic():
+    return _clock.monotonic()
+
+
+def now():
+    return datetime.datetime.fromtimestamp(_clock.time())
+
+
+def sleep(duration):
+    _clock.sleep(duration)
+
+
+def wait(future, timeout=None):
+    _clock.wait(future, timeout)
+
+
+def driving():
+    return _clock.driving()
+
+
+def new_event_loop():
+    return _clock.new_event_loop()
@@ -0,0 +1,149 @@
+"""
+Message codec shared by every producer and consumer on the communication exchange.
+
+Messages are encoded with msgpack when it is installed and with JSON otherwise. Decoding detects the format of each
+body, so JSON messages (e.g. the dashboard commands published by the middleware) can be consumed alongside msgpack
+ones. Messages read by the dashboard must always be JSON, use `encode(message, fmt=JSON)` for those.
+
+NumPy arrays are carried as raw typed buffers (dtype, shape and bytes): a msgpack extension type, or a tagged object
+with base64 data in JSON. They are decoded into read-only arrays that share memory with the received body.
+
+Several encoded messages of the same format can be concatenated into one frame (see `encode_batch`), consumers use
+`decode_frame` to get the messages of a body whether or not it is a batch.
+"""
+import base64
+import json
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK = 'msgpack'
+JSON = 'json'
+
+FORMATS = [MSGPACK, JSON]
+
+_format = MSGPACK if msgpack is not None else JSON
+
+# first byte of a JSON encoded object or array
+_JSON_START_BYTES = (ord('{'), ord('['))
+
+# msgpack extension type code of numpy arrays
+_NDARRAY_EXT_CODE = 1
+
+# key of the JSON object representation of numpy arrays
+_NDARRAY_KEY = '__ndarray__'
+
+
+def set_format(name):
+    global _format
+
+    if name not in FORMATS:
+        raise ValueError(f'Unknown message format: {name}')
+    if name == MSGPACK and msgpack is None:
+        raise ValueError('msgpack is not installed, install it or use the json format')
+    _format = name
+
+
+def get_format():
+    return _format
+
+
+def _default(obj):
+    """
+    Encodes the (numpy) types that are not natively supported by msgpack and json.
+    """
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} cannot be encoded')
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, np.ndarray) and obj.dtype.kind in 'biuf':
+        header = msgpack.packb([obj.dtype.str, list(obj.shape)])
+        return msgpack.ExtType(_NDARRAY_EXT_CODE, header + np.ascontiguousarray(obj).tobytes())
+    return _default(obj)
+
+
+def _msgpack_ext_hook(code, data):
+    if code == _NDARRAY_EXT_CODE:
+        unpacker = msgpack.Unpacker()
+        unpacker.feed(data)
+        dtype, shape = unpacker.unpack()
+        return np.frombuffer(data, dtype=dtype, offset=unpacker.tell()).reshape(shape)
+    return msgpack.ExtType(code, data)
+
+
+def _json_default(obj):
+    if isinstance(obj, np.ndarray) and obj.dtype.kind in 'biuf':
+        return {
+            _NDARRAY_KEY: base64.b64encode(np.ascontiguousarray(obj)).decode('ascii'),
+            'dtype': obj.dtype.str,
+            'shape': list(obj.shape),
+        }
+    return _default(obj)
+
+
+def _json_object_hook(obj):
+    if _NDARRAY_KEY in obj:
+        return np.frombuffer(base64.b64decode(obj[_NDARRAY_KEY]), dtype=obj['dtype']).reshape(obj['shape'])
+    return obj
+
+
+def encode(message, fmt=None):
+    """
+    Encodes a message.
+
+    :param message: the message (usually a dict created by `messaging._create_msg`)
+    :param fmt: the format to use. Defaults to the selected format (see `set_format`).
+    :return: bytes for msgpack, str for json
+    """
+    fmt = fmt or _format
+    if fmt == MSGPACK:
+        return msgpack.packb(message, default=_msgpack_default, use_bin_type=True)
+    return json.dumps(message, default=_json_default)
+
+
+def decode(body):
+    """
+    Decodes a message body encoded with either msgpack or json.
+    """
+    if isinstance(body, str) or not body or body[0] in _JSON_START_BYTES or msgpack is None:
+        return json.loads(body, object_hook=_json_object_hook)
+    return msgpack.unpackb(body, raw=False, strict_map_key=False, ext_hook=_msgpack_ext_hook)
+
+
+def encode_batch(bodies):
+    """
+    Concatenates encoded messages into one frame, decoded as a list of messages by `decode_frame`.
+
+    The frame is a msgpack array (or a JSON array) of the messages, so the bodies are not re-encoded.
+
+    :param bodies: messages encoded with `encode`
+    :return: the frame, or None if the bodies are not all encoded with the same format
+    """
+    if all(isinstance(body, str) for body in bodies):
+        return '[' + ','.join(bodies) + ']'
+    if msgpack is not None and all(isinstance(body, bytes) and body and body[0] not in _JSON_START_BYTES
+                                   for body in bodies):
+        return msgpack.Packer().pack_array_header(len(bodies)) + b''.join(bodies)
+    return None
+
+
+def decode_frame(body):
+    """
+    Decodes a message body that is either a single message or a batch created by `encode_batch`.
+
+    :return: list of messages
+    """
+    decoded = decode(body)
+    if isinstance(decoded, list):
+        return decoded
+    return [decoded]
@@ -27,5 +27,12 @@ class SharedConfig:
         self.optimization_op = 'max'
         self.logger_level = 'DEBUG'
 
+        # continuous optimization of C-CoCoA and C-DPOP (see algorithms.dcop.optimization)
+        self.optimizer_solver = 'gradient'
+        self.optimizer_step = 'fixed'
+        # no early stopping by default
+        self.optimizer_tol = None
+        self.optimizer_max_iter = 100
+
 
 shared_config = SharedConfig()
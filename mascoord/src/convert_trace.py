@@ -0,0 +1,26 @@
+"""
+Converts a simulation trace (see envs/trace.py) to the per time step grid and graph files.
+
+Usage (from the mascoord directory, with the environment variables of sample.env set):
+
+    python src/convert_trace.py simulation_metrics_a30_r5/trace-0_cocoa_digca.trace simulation_metrics_a30_r5
+"""
+import argparse
+import os
+
+from mascoord.src.envs.trace import TRACE_EXT, convert_to_files
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Converts a simulation trace to per time step grid and graph files')
+    parser.add_argument('trace', type=str, help='Path to the .trace file')
+    parser.add_argument('output_folder', type=str, help='Folder of the grids-<suffix> and graphs-<suffix> folders')
+    args = parser.parse_args()
+
+    # traces are named trace-<suffix> by the GridWorld
+    name = os.path.basename(args.trace)
+    if name.endswith(TRACE_EXT):
+        name = name[:-len(TRACE_EXT)]
+    if name.startswith('trace-'):
+        name = name[len('trace-'):]
+
+    convert_to_files(args.trace, args.output_folder, name)
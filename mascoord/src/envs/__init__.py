@@ -1,62 +1,71 @@
 import threading
+import time
 from typing import Tuple
 
-import pika
-import networkx as nx
-
-from mascoord.src import logger, messaging, config
+from mascoord.src import codec, logger, messaging, transport
+from mascoord.src.envs.graphs import VersionedGraph
+from mascoord.src.envs.history import StateHistory
 
 
 class SimulationEnvironment(object):
     """
     Base class for all simulation environments used for D-DCOP
     """
-    agents = {}
-    log = None
 
-    def __init__(self, name, time_step_delay, scenario):
+    def __init__(self, name, time_step_delay, scenario, loop=None, bus=None):
         self._terminate = False
         self.log = logger.get_logger(name)
         self.name = name
         self.scenario = scenario
         self._events_iterator = iter(scenario) if scenario else None
-        self._state_history = []
+        self._state_history = StateHistory()
         self.time_step_delay = time_step_delay
-        # self.agents = {}
+        self.agents = {}
+        # in-process bus of the environment and its agents (None for the process-wide bus)
+        self.bus = bus
 
         # graphs
-        self._current_graph = nx.Graph()
-        self._previous_graph = None
+        # interaction graph, a version is committed at the end of every time step
+        self._graph = VersionedGraph()
 
         # communication props
         self.queue_name = 'sim-env-queue'
-        self.client = pika.BlockingConnection(pika.ConnectionParameters(
-            host=config.BROKER_URL,
-            port=config.BROKER_PORT,
-            heartbeat=0,  # only for experiment purposes - not recommended (https://www.rabbitmq.com/heartbeats.html)
-            credentials=pika.credentials.PlainCredentials(config.PIKA_USERNAME, config.PIKA_PASSWORD))
-        )
-        self.channel = self.client.channel()
-        self.channel.exchange_declare(exchange=messaging.COMM_EXCHANGE, exchange_type='topic')
-        self.channel.queue_declare(queue=self.queue_name, exclusive=True)
+        # the environment is consumed on the event loop of the agent host with the virtual clock (see run_async), an
+        # in-process bus of its own isolates it from the other environments of the process
+        self.transport = transport.create_transport(bus=bus, loop=loop)
+        self.transport.declare_exchange()
+        self.transport.declare_queue(self.queue_name, exclusive=True)
 
         # register topics (aka routing keys) associated to the factory queue
-        self.channel.queue_bind(
-            exchange=messaging.COMM_EXCHANGE,
-            queue=self.queue_name,
-            routing_key=f'{messaging.SIM_ENV_CHANNEL}.#'
-        )
+        self.transport.bind(self.queue_name, f'{messaging.SIM_ENV_CHANNEL}.#')
 
         # subscribe to in-coming msgs
-        self.channel.basic_consume(queue=self.queue_name, on_message_callback=self._on_message, auto_ack=True)
+        self.transport.consume(self.queue_name, self._on_message)
+
+    def _on_message(self, body):
+        for msg in codec.decode_frame(body):
+            print(msg, body)
+
+    @property
+    def terminate(self):
+        return self._terminate
 
-    def _on_message(self, ch, method, properties, body):
-        msg = eval(body.decode('utf-8'))
-        print(msg, ch, method, properties, body)
+    @terminate.setter
+    def terminate(self, flag):
+        self._terminate = flag
+        if flag:
+            # wake up the message loop so that it sees the flag
+            self.transport.add_callback_threadsafe(lambda: None)
 
     def _listen_for_messages(self):
-        while not self._terminate:
-            self.client.sleep(0)
+        start_cpu_time = time.thread_time()
+        while not self.terminate:
+            self.transport.process_events()
+        self.log.info(f'Message loop CPU time: {time.thread_time() - start_cpu_time:.2f}s')
+
+    async def _listen_for_messages_async(self):
+        while not self.terminate:
+            await self.transport.process_events_async()
 
     def step(self):
         ...
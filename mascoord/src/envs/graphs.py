@@ -0,0 +1,200 @@
+import networkx as nx
+
+
+class GraphDeltaTracker:
+    """
+    Tracks the net changes of a graph since the last reset (snapshot).
+
+    The nodes of our graphs are labelled (agent IDs), hence the edit distance between the snapshot and the current
+    graph is the size of the symmetric difference of their node and edge sets: the nodes and edges inserted plus the
+    nodes and edges deleted. A change that undoes an earlier change of the same node or edge cancels it out.
+
+    The tracker must be told about every change before it is applied to the graph (see `add_node`, `add_edge`,
+    `remove_node` and `remove_edge`).
+    """
+
+    def __init__(self):
+        self.added_nodes = set()
+        self.removed_nodes = set()
+        self.added_edges = set()
+        self.removed_edges = set()
+
+    @staticmethod
+    def _edge(u, v):
+        return frozenset((u, v))
+
+    def add_node(self, graph: nx.Graph, node):
+        if graph.has_node(node):
+            return
+        if node in self.removed_nodes:
+            self.removed_nodes.remove(node)
+        else:
+            self.added_nodes.add(node)
+
+    def remove_node(self, graph: nx.Graph, node):
+        if not graph.has_node(node):
+            return
+        for neighbor in list(graph.neighbors(node)):
+            self.remove_edge(graph, node, neighbor)
+        if node in self.added_nodes:
+            self.added_nodes.remove(node)
+        else:
+            self.removed_nodes.add(node)
+
+    def add_edge(self, graph: nx.Graph, u, v):
+        self.add_node(graph, u)
+        self.add_node(graph, v)
+        if graph.has_edge(u, v):
+            return
+        edge = self._edge(u, v)
+        if edge in self.removed_edges:
+            self.removed_edges.remove(edge)
+        else:
+            self.added_edges.add(edge)
+
+    def remove_edge(self, graph: nx.Graph, u, v):
+        if not graph.has_edge(u, v):
+            return
+        edge = self._edge(u, v)
+        if edge in self.added_edges:
+            self.added_edges.remove(edge)
+        else:
+            self.removed_edges.add(edge)
+
+    def clear(self, graph: nx.Graph):
+        """
+        Records the removal of all the nodes and edges of the graph.
+        """
+        for u, v in graph.edges:
+            self.remove_edge(graph, u, v)
+        for node in graph.nodes:
+            if node in self.added_nodes:
+                self.added_nodes.remove(node)
+            else:
+                self.removed_nodes.add(node)
+
+    def reset(self):
+        """
+        Takes a snapshot of the current graph.
+        """
+        self.added_nodes.clear()
+        self.removed_nodes.clear()
+        self.added_edges.clear()
+        self.removed_edges.clear()
+
+    @property
+    def edit_distance(self) -> int:
+        return len(self.added_nodes) + len(self.removed_nodes) + len(self.added_edges) + len(self.removed_edges)
+
+
+class VersionedGraph:
+    """
+    Undirected graph with cheap snapshots (versions).
+
+    Instead of copying the graph, every change is recorded in a log, and a version is the position in the log at which
+    it was committed. The changes since the last committed version are tracked to give the edit distance to it, and a
+    retained version can be rebuilt on demand by undoing the changes made after it. Only the latest `max_versions`
+    versions are retained, the log is trimmed to the changes made since the oldest of them.
+    """
+
+    ADD_NODE = 'add_node'
+    REMOVE_NODE = 'remove_node'
+    ADD_EDGE = 'add_edge'
+    REMOVE_EDGE = 'remove_edge'
+    CLEAR = 'clear'
+
+    def __init__(self, max_versions=2):
+        self.graph = nx.Graph()
+        self.delta = GraphDeltaTracker()
+        self.max_versions = max_versions
+        self._log = []
+        # log positions of the retained versions, the oldest first
+        self._versions = []
+        self._num_versions = 0
+
+    def add_node(self, node):
+        if not self.graph.has_node(node):
+            self.delta.add_node(self.graph, node)
+            self._log.append((self.ADD_NODE, node, None))
+            self.graph.add_node(node)
+
+    def remove_node(self, node):
+        if self.graph.has_node(node):
+            for neighbor in list(self.graph.neighbors(node)):
+                self.remove_edge(node, neighbor)
+            self.delta.remove_node(self.graph, node)
+            self._log.append((self.REMOVE_NODE, node, None))
+            self.graph.remove_node(node)
+
+    def add_edge(self, u, v):
+        self.add_node(u)
+        self.add_node(v)
+        if not self.graph.has_edge(u, v):
+            self.delta.add_edge(self.graph, u, v)
+            self._log.append((self.ADD_EDGE, u, v))
+            self.graph.add_edge(u, v)
+
+    def remove_edge(self, u, v):
+        if self.graph.has_edge(u, v):
+            self.delta.remove_edge(self.graph, u, v)
+            self._log.append((self.REMOVE_EDGE, u, v))
+            self.graph.remove_edge(u, v)
+
+    def clear(self):
+        self.delta.clear(self.graph)
+        self._log.append((self.CLEAR, list(self.graph.nodes), list(self.graph.edges)))
+        self.graph.clear()
+
+    def commit(self) -> int:
+        """
+        Takes a snapshot of the current graph.
+
+        :return: the version of the snapshot
+        """
+        self._versions.append(len(self._log))
+        self._num_versions += 1
+        if len(self._versions) > self.max_versions:
+            self._versions.pop(0)
+            start = self._versions[0]
+            del self._log[:start]
+            self._versions = [position - start for position in self._versions]
+
+        self.delta.reset()
+        return self._num_versions - 1
+
+    @property
+    def num_versions(self):
+        """
+        Number of committed versions, including the ones that are no longer retained.
+        """
+        return self._num_versions
+
+    @property
+    def edit_distance(self) -> int:
+        """
+        Edit distance between the last committed version and the current graph.
+        """
+        return self.delta.edit_distance
+
+    def get_version(self, version) -> nx.Graph:
+        """
+        Rebuilds a retained version of the graph.
+        """
+        first_version = self._num_versions - len(self._versions)
+        if not first_version <= version < self._num_versions:
+            raise KeyError(f'Version {version} is not retained')
+
+        graph = self.graph.copy()
+        for op, u, v in reversed(self._log[self._versions[version - first_version]:]):
+            if op == self.CLEAR:
+                graph.add_nodes_from(u)
+                graph.add_edges_from(v)
+            elif op == self.ADD_NODE:
+                graph.remove_node(u)
+            elif op == self.REMOVE_NODE:
+                graph.add_node(u)
+            elif op == self.ADD_EDGE:
+                graph.remove_edge(u, v)
+            else:
+                graph.add_edge(u, v)
+        return graph
@@ -0,0 +1,85 @@
+from collections import deque
+
+
+class StateHistory:
+    """
+    Bounded history of the grid occupancy of a simulation.
+
+    An entry holds the changes of the occupancy (cell ID -> contents of the non-empty cells) since the previous entry,
+    a cell that became empty is recorded with empty contents. At most `depth` entries are kept (all if `depth` is
+    None), the oldest entries are evicted as new ones are added. The history only serves the queries of the latest
+    time steps, every time step is written to the metrics files (or the trace) when it is recorded.
+    """
+
+    def __init__(self, depth=None):
+        if depth is not None and depth < 1:
+            raise ValueError(f'Invalid history depth: {depth}')
+
+        self.depth = depth
+        # (time step, occupancy changes)
+        self._entries = deque()
+        # occupancy before the oldest entry and after the latest entry
+        self._base = {}
+        self._current = {}
+
+    def append(self, time_step, occupancy):
+        """
+        Adds the occupancy of a time step.
+
+        :param time_step: the time step
+        :param occupancy: dict of cell ID to the contents of the non-empty cells
+        """
+        changes = {
+            cell_id: contents for cell_id, contents in occupancy.items() if self._current.get(cell_id) != contents
+        }
+        for cell_id in self._current:
+            if cell_id not in occupancy:
+                changes[cell_id] = []
+        self._current = dict(occupancy)
+        self._entries.append((time_step, changes))
+
+        if self.depth is not None and len(self._entries) > self.depth:
+            _, changes = self._entries.popleft()
+            self._apply(self._base, changes)
+
+    @staticmethod
+    def _apply(occupancy, changes):
+        for cell_id, contents in changes.items():
+            if contents:
+                occupancy[cell_id] = contents
+            else:
+                occupancy.pop(cell_id, None)
+
+    @property
+    def time_steps(self):
+        return [entry[0] for entry in self._entries]
+
+    @property
+    def latest(self) -> dict:
+        return dict(self._current)
+
+    def occupancy(self, time_step) -> dict:
+        """
+        The occupancy of a time step that has not been evicted.
+        """
+        occupancy = dict(self._base)
+        for entry_time_step, changes in self._entries:
+            self._apply(occupancy, changes)
+            if entry_time_step == time_step:
+                return occupancy
+        raise KeyError(f'Time step {time_step} is not in the history')
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        """
+        Iterates over (time step, occupancy) of the entries.
+        """
+        occupancy = dict(self._base)
+        for time_step, changes in self._entries:
+            self._apply(occupancy, changes)
+            yield time_step, dict(occupancy)
+
+    def __str__(self):
+        return str([(f't={time_step}', occupancy) for time_step, occupancy in self])
@@ -1,6 +1,4 @@
-import copy
-import csv
-import datetime
+import math
 import os.path
 import random
 from collections import defaultdict
@@ -9,8 +7,12 @@ import networkx as nx
 import numpy as np
 
 from mascoord.definitions import ROOT_DIR
-from mascoord.src import messaging
+from mascoord.src import clock, codec, messaging
 from mascoord.src.envs import SimulationEnvironment
+from mascoord.src.envs.spatial import GridHash, NeighborhoodTable
+from mascoord.src.envs.history import StateHistory
+from mascoord.src.envs.trace import TraceWriter, cell_ids as grid_cell_ids
+from mascoord.src.envs.writer import BackgroundWriter, CsvSink, SnapshotFilesSink, TraceSink
 
 METRICS_HEADERS = [
     'timestep',
@@ -46,8 +48,36 @@ METRICS_HEADERS = [
     messaging.DBFS_LEVEL_MESSAGE,
     messaging.DBFS_ACK_MESSAGE,
     messaging.DBFS_LEVEL_IGNORED_MESSAGE,
+    'step latency',
+    'max arrival time',
+    'num late agents',
+    'late agents',
 ]
 
+LATE_ARRIVALS_HEADERS = ['timestep', 'agent_id', 'lateness']
+
+# time step barrier policies: wait for all agents, until a deadline, or for a fraction of the agents
+FULL_BARRIER = 'full'
+DEADLINE_BARRIER = 'deadline'
+QUORUM_BARRIER = 'quorum'
+
+BARRIERS = [FULL_BARRIER, DEADLINE_BARRIER, QUORUM_BARRIER]
+
+# number of the latest time steps whose barrier release time is kept to measure the lateness of the late agents
+RELEASE_TIMES_WINDOW = 16
+
+# (row, column) offset of the cell reached by every action
+ACTION_OFFSETS = {
+    'up': (-1, 0),
+    'down': (1, 0),
+    'left': (0, -1),
+    'right': (0, 1),
+    'left_up': (-1, -1),
+    'left_down': (1, -1),
+    'right_up': (-1, 1),
+    'right_down': (1, 1),
+}
+
 
 class GridCell:
     """
@@ -113,12 +143,18 @@ class GridCell:
     def right_down(self):
         return str(self.i + 1) + '-' + str(self.j + 1)
 
-    def __str__(self):
+    def get_visible_contents(self):
+        """
+        The agents and active targets in the cell.
+        """
         contents = []
         for c in self.contents:
             if isinstance(c, Target) and c.is_active or isinstance(c, MobileSensingAgent):
                 contents.append(str(c))
-        return f'{self.cell_id}: {str(contents)}'
+        return contents
+
+    def __str__(self):
+        return f'{self.cell_id}: {str(self.get_visible_contents())}'
 
     def __hash__(self):
         return hash(self.cell_id)
@@ -133,8 +169,17 @@ class MobileSensingAgent:
         self.credibility = 5
         self.sensing_range = 1
         self.mobility_range = 2
+        # counts the agent's own cell: a range of r covers the (2r - 1) x (2r - 1) square of cells centered on the
+        # agent, so the default range of 3 is a 5x5 neighborhood (see communication_radius)
         self.communication_range = 3
 
+    @property
+    def communication_radius(self) -> int:
+        """
+        Chebyshev distance (in cells) from the agent's cell to the farthest cell in its communication range.
+        """
+        return self.communication_range - 1
+
     def __str__(self):
         # return f'Agent(id={self.player_id}, cred={self.credibility})'
         return self.agent_id
@@ -160,16 +205,81 @@ class Target:
         return hash(self.target_id)
 
 
+class GridState:
+    """
+    Array representation of the GridWorld: number of agents and of active targets per cell.
+
+    The arrays are padded with a border of empty cells, cell `i-j` (1-based) is at index `[i, j]`. Since the targets
+    do not move and all the targets of a cell are detected together, detection is tracked per cell.
+    """
+
+    def __init__(self, size):
+        shape = (size + 2, size + 2)
+        self.agents = np.zeros(shape, dtype=np.int32)
+        self.active_targets = np.zeros(shape, dtype=np.int32)
+        self.detected = np.zeros(shape, dtype=bool)
+
+    def add_target(self, cell: GridCell):
+        self.active_targets[cell.i, cell.j] += 1
+
+    def add_agent(self, cell: GridCell):
+        self.agents[cell.i, cell.j] += 1
+
+    def remove_agent(self, cell: GridCell):
+        self.agents[cell.i, cell.j] -= 1
+
+    def move_agent(self, from_cell: GridCell, to_cell: GridCell):
+        self.agents[from_cell.i, from_cell.j] -= 1
+        self.agents[to_cell.i, to_cell.j] += 1
+
+    def score(self) -> float:
+        weights = np.where(self.agents > 1, 2., np.where(self.agents == 1, 0.5, 0.))
+        return float(np.sum(weights * self.active_targets))
+
+    def mark_detected_targets(self):
+        """
+        Marks the targets of the occupied cells as detected.
+
+        :return: indices of the newly detected cells
+        """
+        newly_detected = (self.agents > 0) & ~self.detected
+        self.detected |= newly_detected
+        return np.argwhere(newly_detected)
+
+    def disable_detected_targets(self):
+        """
+        Disables the detected targets of the occupied cells.
+
+        :return: indices of the cells whose targets were disabled
+        """
+        disabled = (self.agents > 0) & self.detected & (self.active_targets > 0)
+        self.active_targets[disabled] = 0
+        return np.argwhere(disabled)
+
+
 class GridWorld(SimulationEnvironment):
     name = 'GridWorld'
-    grid = {}
 
-    def __init__(self, size, num_targets, dcop_alg, graph_alg, seed,  scenario=None):
-        super(GridWorld, self).__init__(self.name, time_step_delay=10, scenario=scenario)
-        self._copy_graph = graph_alg == 'digca'
+    def __init__(self, size, num_targets, dcop_alg, graph_alg, seed,  scenario=None, loop=None, vectorized=False,
+                 trace=False, trace_compression=True, bus=None, barrier=FULL_BARRIER, barrier_deadline=5.,
+                 barrier_quorum=1., history_depth=100):
+        super(GridWorld, self).__init__(self.name, time_step_delay=10, scenario=scenario, loop=loop, bus=bus)
+        # DIGCA maintains the graph across time steps, the other algorithms rebuild it in every time step
+        self._persistent_graph = graph_alg == 'digca'
         self.log.info(f'Number of scenarios: {len(scenario)}')
         self._delayed_actions = {}
         self.grid_size = size
+        self.grid = {}
+        # scores and target detection are computed on arrays instead of the contents of the cells
+        self._state = GridState(size) if vectorized else None
+        # positions of the agents, for communication range queries
+        self._agents_index = GridHash()
+        # legal actions of every cell and neighborhoods of the agents in the current time step
+        self._cell_actions = {}
+        self._neighborhoods = NeighborhoodTable()
+        # cell reached by every action from every cell (flat index in the padded grid, -1 when off the grid)
+        self._action_cell_indices = {}
+        self._cells_by_index = {}
         # self.grid = {}
         self._current_time_step = -1
         self._event_timestamp = None
@@ -184,17 +294,43 @@ class GridWorld(SimulationEnvironment):
         self._transition_function = m / m.sum(axis=1).reshape(-1, 1)
         self.scores = defaultdict(float)
 
+        if barrier not in BARRIERS:
+            raise ValueError(f'Unknown barrier policy: {barrier}')
+
+        # the time step ends when the barrier is reached, the agents that have not selected a value by then (late
+        # agents) keep their position
+        self.barrier = barrier
+        self.barrier_deadline = barrier_deadline
+        self.barrier_quorum = barrier_quorum
+        self._step_start_time = None
+        self._arrival_times = {}
+        # time step -> time its barrier was released, for the latest time steps (see RELEASE_TIMES_WINDOW)
+        self._release_times = {}
+
         self._registered_agents = []
         self._ack_agents = []
         self._paused_msgs = defaultdict(list)
 
         # metrics-related
         self._metrics = {}
-        self._metrics_file_headers = []
         self._sim_file_suffix = f'{seed}_{dcop_alg}_{graph_alg}'
         self._metrics_file_name = f'metrics_{self._sim_file_suffix}.csv'
         self.metrics_folder = f'simulation_metrics_a{self.scenario.num_add_agents}_r{self.scenario.num_remove_agents}'
 
+        # grid and graph snapshots are appended to a trace instead of being written to a pair of files per time step
+        self._trace_enabled = trace
+        self._trace_compression = trace_compression
+        self._occupancy = {}
+
+        # the latest time steps are kept in memory
+        self._state_history = StateHistory(history_depth)
+
+        # metrics and snapshots are written off the time step critical path
+        self._writer = None
+        self._metrics_sink = None
+        self._late_arrivals_sink = None
+        self._snapshots_sink = None
+
         self._handlers = {
             messaging.AGENT_REGISTRATION: self._receive_agent_registration,
             messaging.ANNOUNCE: self._receive_announce_msg,
@@ -205,18 +341,24 @@ class GridWorld(SimulationEnvironment):
         }
 
     def __call__(self, *args, **kwargs):
+        self._start()
+        self._listen_for_messages()
+
+    async def run_async(self):
+        self._start()
+        await self._listen_for_messages_async()
+
+    def _start(self):
         self.log.info('Started GridWorld simulation environment')
         self._create_cells()
         self._initialize_targets()
 
-        # initialize metrics file
-        self._write_metrics_file_header(METRICS_HEADERS)
+        # initialize metrics file and snapshots
+        self._create_writer()
 
         # start processing events in scenario object
         self.step()
 
-        self._listen_for_messages()
-
     def _initialize_targets(self):
         # get all possible positions
         cell_ids = list(self.grid.keys())
@@ -236,15 +378,17 @@ class GridWorld(SimulationEnvironment):
             # add target to cell
             self._targets[target.target_id] = target
             selected_cell.add(target)
+            if self._state is not None:
+                self._state.add_target(selected_cell)
 
-    def _on_message(self, ch, method, properties, body):
-        msg = eval(body.decode('utf-8'))
-        func = self._handlers.get(msg['type'], None)
+    def _on_message(self, body):
+        for msg in codec.decode_frame(body):
+            func = self._handlers.get(msg['type'], None)
 
-        if func:
-            func(msg['payload'])
-        else:
-            self.log.warning(f'Message type {msg["type"]} has no handler')
+            if func:
+                func(msg['payload'])
+            else:
+                self.log.warning(f'Message type {msg["type"]} has no handler')
 
     def _receive_agent_registration(self, msg):
         self.log.info(f'Received agent registration: {msg}')
@@ -256,8 +400,7 @@ class GridWorld(SimulationEnvironment):
 
     def _send_time_step_info(self, agent_id):
         self.log.info(f'Sending time step info to agent {agent_id}')
-        self.channel.basic_publish(
-            exchange=messaging.COMM_EXCHANGE,
+        self.transport.publish(
             routing_key=f'{messaging.AGENTS_CHANNEL}.{agent_id}',
             body=messaging.create_sim_env_current_time_step_message(
                 self.get_time_step_data(agent_id),
@@ -270,9 +413,8 @@ class GridWorld(SimulationEnvironment):
         # self.client.call_later(0, functools.partial(self._broadcast_announce, msg))
 
     def _broadcast_announce(self, msg):
-        for agent in self.get_agents_in_communication_range(msg['agent_id']):
-            self.channel.basic_publish(
-                exchange=messaging.COMM_EXCHANGE,
+        for agent in self._neighborhoods.neighbors(msg['agent_id']):
+            self.transport.publish(
                 routing_key=f'{messaging.AGENTS_CHANNEL}.{agent}',
                 body=messaging.create_announce_message(msg)
             )
@@ -287,7 +429,7 @@ class GridWorld(SimulationEnvironment):
                 self.log.info('Skipping delay event')
                 evt = next(self._events_iterator)
 
-            self._event_timestamp = datetime.datetime.now().timestamp()
+            self._event_timestamp = clock.time()
 
             for a in evt.actions:
                 if a.type == 'add-agent':
@@ -295,8 +437,7 @@ class GridWorld(SimulationEnvironment):
                     self.run_stabilization_computation(a.args['agent'])
 
                     # send message to factory
-                    self.channel.basic_publish(
-                        exchange=messaging.COMM_EXCHANGE,
+                    self.transport.publish(
                         routing_key=f'{messaging.FACTORY_COMMAND_CHANNEL}',
                         body=messaging.create_agent_added_message({
                             'agent': a.args['agent'],
@@ -308,8 +449,7 @@ class GridWorld(SimulationEnvironment):
                     self.remove_agent(a.args['agent'])
 
                     # send message to factory
-                    self.channel.basic_publish(
-                        exchange=messaging.COMM_EXCHANGE,
+                    self.transport.publish(
                         routing_key=f'{messaging.FACTORY_COMMAND_CHANNEL}',
                         body=messaging.create_agent_removed_message({
                             'agent': a.args['agent'],
@@ -336,9 +476,12 @@ class GridWorld(SimulationEnvironment):
 
         # add sensor to cell
         selected_cell.add(msa)
+        self._agents_index.insert(msa.agent_id, selected_cell.i, selected_cell.j)
+        if self._state is not None:
+            self._state.add_agent(selected_cell)
 
         # add node to current graph
-        self._current_graph.add_node(agent)
+        self._graph.add_node(agent)
 
     def remove_agent(self, agent):
         # remove agent from agents list
@@ -347,10 +490,12 @@ class GridWorld(SimulationEnvironment):
         # remove agent from currently occupied cell
         cell: GridCell = msa.current_cell
         cell.contents.pop(cell.contents.index(msa))
+        self._agents_index.remove(agent)
+        if self._state is not None:
+            self._state.remove_agent(cell)
 
         # remove node from current graph
-        if self._current_graph.has_node(agent):
-            self._current_graph.remove_node(agent)
+        self._graph.remove_node(agent)
 
         # remove from registered agents
         self._registered_agents.remove(agent)
@@ -358,14 +503,18 @@ class GridWorld(SimulationEnvironment):
     def next_time_step(self):
         self._disable_detected_targets()
         self._current_time_step += 1
-        grid = [str(v) for v in self.grid.values()]
-        self._state_history.append((f't={str(self._current_time_step)}', grid))
+        self._occupancy = self._get_occupancy()
         self.log.info(f'Current time step: {self._current_time_step}')
 
+        # the agents only move between time steps
+        self._build_neighborhood_table()
+
         self._ack_agents.clear()
         self._paused_msgs.clear()
 
         # send time step information to already registered agents
+        self._step_start_time = clock.monotonic()
+        self._arrival_times.clear()
         for agent in self._registered_agents:
             self._send_time_step_info(agent)
 
@@ -374,54 +523,67 @@ class GridWorld(SimulationEnvironment):
             self.log.debug('No active agents, moving to next time step')
             self._receive_value_selection({}, is_forced=True)
 
+        elif self.barrier == DEADLINE_BARRIER:
+            time_step = self._current_time_step
+            self.transport.call_later(self.barrier_deadline, lambda: self._on_barrier_deadline(time_step))
+
+    def _get_occupancy(self):
+        """
+        Contents of the non-empty cells, in the order of the grid.
+        """
+        cells = {agent.current_cell for agent in self.agents.values()}
+        cells.update(target.current_cell for target in self._targets.values() if target.is_active)
+        return {cell.cell_id: cell.get_visible_contents() for cell in sorted(cells, key=lambda c: (c.i, c.j))}
+
     def _create_cells(self):
         for i in range(1, self.grid_size + 1):
             for j in range(1, self.grid_size + 1):
                 cell = GridCell(i, j)
                 self.grid[cell.cell_id] = cell
 
+        for cell in self.grid.values():
+            self._cell_actions[cell.cell_id] = tuple(self._get_legit_actions(cell))
+            self._cells_by_index[self._cell_index(cell.i, cell.j)] = cell
+            self._action_cell_indices[cell.cell_id] = {
+                action: self._cell_index(cell.i + di, cell.j + dj) for action, (di, dj) in ACTION_OFFSETS.items()
+            }
+
+    def _cell_index(self, i, j):
+        """
+        Flat index of cell i-j in the padded grid (see GridState), -1 when it is off the grid.
+        """
+        if 1 <= i <= self.grid_size and 1 <= j <= self.grid_size:
+            return i * (self.grid_size + 2) + j
+        return -1
+
+    def _build_neighborhood_table(self):
+        self._neighborhoods = NeighborhoodTable(
+            neighbors={agent_id: self.get_agents_in_communication_range(agent_id) for agent_id in self.agents},
+            domains={
+                agent_id: self._cell_actions[agent.current_cell.cell_id] for agent_id, agent in self.agents.items()
+            },
+        )
+
     def get_time_step_data(self, agent_id):
-        sensor = self.agents.get(agent_id, None)
+        neighbors = self._neighborhoods.neighbors(agent_id)
         return {
-            'current_position': sensor.current_cell.cell_id,
+            'current_position': self.agents[agent_id].current_cell.cell_id,
             # 'score': self.calc_agent_score(self.agents[agent_id]),  # score in the just ended time step
-            'agents_in_comm_range': [] if sensor is None else self.get_agents_in_communication_range(agent_id),
-            'agent_domain': self._get_legit_actions(self.agents[agent_id].current_cell),
-            'neighbor_domains': {
-                agt: self._get_legit_actions(self.agents[agt].current_cell)
-                for agt in self.get_agents_in_communication_range(agent_id)
-            },
+            'agents_in_comm_range': list(neighbors),
+            'agent_domain': list(self._neighborhoods.domain(agent_id)),
+            'neighbor_domains': {agt: list(self._neighborhoods.domain(agt)) for agt in neighbors},
             'event_timestamp': self._event_timestamp,
             'timestep': self._current_time_step
         }
 
     def get_agents_in_communication_range(self, agent_id) -> list:
-        nearby_agents = []
-        cells_to_inspect = []
+        """
+        Returns the agents within the communication range of the given agent (see
+        `MobileSensingAgent.communication_range`).
+        """
         agent: MobileSensingAgent = self.agents[agent_id]
         cell: GridCell = agent.current_cell
-
-        # compile list of cells to inspect
-        cells_to_inspect.append(cell)
-        if agent.communication_range > 1:
-            up = self.grid.get(cell.up(), None)
-            down = self.grid.get(cell.down(), None)
-            left = self.grid.get(cell.left(), None)
-            right = self.grid.get(cell.right(), None)
-            left_up = self.grid.get(cell.left_up(), None)
-            right_up = self.grid.get(cell.right_up(), None)
-            left_down = self.grid.get(cell.left_down(), None)
-            right_down = self.grid.get(cell.right_down(), None)
-            cells_to_inspect += [up, down, left, right, left_up, right_up, left_down, right_down]
-
-        # inspect cells for agents
-        for cell in cells_to_inspect:
-            if cell:
-                for obj in cell.contents:
-                    if isinstance(obj, MobileSensingAgent) and obj.agent_id != agent_id:
-                        nearby_agents.append(obj.agent_id)
-
-        return nearby_agents
+        return self._agents_index.query(cell.i, cell.j, agent.communication_radius, exclude=agent_id)
 
     def _get_legit_actions(self, cell):
         actions = []
@@ -444,20 +606,19 @@ class GridWorld(SimulationEnvironment):
                 actions.append('right_down')
         return actions
 
-    @classmethod
-    def constraint_evaluation(cls, sender: str, agent_values: dict):
+    def constraint_evaluation(self, sender: str, agent_values: dict):
         selected_cells = []
         score = 0.
 
         for k, val in agent_values.items():
             try:
-                current_cell = cls.agents[k].current_cell
+                current_cell = self.agents[k].current_cell
                 action = getattr(current_cell, val)
-                cell = cls.grid.get(action(), None)
+                cell = self.grid.get(action(), None)
                 if cell:
                     selected_cells.append(cell)
             except KeyError as e:
-                cls.log.error(f'constraint_evaluation: {str(e)} - sender={sender}, msg = {agent_values}')
+                self.log.error(f'constraint_evaluation: {str(e)} - sender={sender}, msg = {agent_values}')
 
         if len(selected_cells) > 1:
             unique_cells = list(set(selected_cells))
@@ -475,14 +636,59 @@ class GridWorld(SimulationEnvironment):
 
         return score
 
+    def constraint_evaluation_matrix(self, sender: str, agent_1: str, values_1: list, agent_2: str, values_2: list):
+        """
+        Evaluates the constraint between two agents for all the pairs of their values at once.
+
+        :return: array of shape (len(values_1), len(values_2)), entry [a, b] is
+            `constraint_evaluation(sender, {agent_1: values_1[a], agent_2: values_2[b]})`
+        """
+        cells_1, targets_1 = self._action_cells(sender, agent_1, values_1)
+        cells_2, targets_2 = self._action_cells(sender, agent_2, values_2)
+
+        same_cell = (cells_1[:, None] == cells_2[None, :]) & (cells_1[:, None] >= 0)
+        return np.where(same_cell, 2. * targets_1[:, None], .5 * (targets_1[:, None] + targets_2[None, :]))
+
+    def _action_cells(self, sender, agent_id, values):
+        """
+        The cells an agent reaches with each of the values (flat index in the padded grid, -1 when off the grid) and
+        their number of active targets.
+        """
+        agent = self.agents.get(agent_id)
+        if agent is None:
+            self.log.error(f'constraint_evaluation_matrix: unknown agent {agent_id} - sender={sender}')
+            return np.full(len(values), -1, dtype=np.int64), np.zeros(len(values))
+
+        action_cells = self._action_cell_indices[agent.current_cell.cell_id]
+        cells = np.array([action_cells[val] for val in values], dtype=np.int64)
+
+        if self._state is not None:
+            targets = np.where(cells >= 0, self._state.active_targets.ravel()[cells], 0.)
+        else:
+            targets = np.array([
+                self._cells_by_index[k].get_num_active_targets() if k >= 0 else 0 for k in cells.tolist()
+            ], dtype=float)
+
+        return cells, targets
+
     def _receive_value_selection(self, msg, is_forced=False):
         self.log.info(f'Received action selection: {msg}')
 
         if not is_forced:
+            # the barrier of the time step of this selection has already been released
+            if msg.get('timestep', self._current_time_step) < self._current_time_step:
+                self._record_late_arrival(msg)
+                return
+
             self._delayed_actions[msg['agent_id']] = msg
+            self._arrival_times[msg['agent_id']] = clock.monotonic() - self._step_start_time
 
-        if len(self._delayed_actions) == len(self.agents) or is_forced:
+        if is_forced or self._is_barrier_reached():
             self.log.info('Collecting simulation metrics...')
+            self._release_times[self._current_time_step] = clock.monotonic()
+            if len(self._release_times) > RELEASE_TIMES_WINDOW:
+                # the time steps are released in order, the first entry is the oldest
+                del self._release_times[next(iter(self._release_times))]
             # apply selected actions
             self._apply_all_actions()
 
@@ -498,6 +704,27 @@ class GridWorld(SimulationEnvironment):
         else:
             self.log.debug(f'delayed actions: {self._delayed_actions.keys()}, agents = {self.agents.keys()}')
 
+    def _is_barrier_reached(self):
+        num_agents = len(self.agents)
+        if self.barrier == QUORUM_BARRIER:
+            return len(self._delayed_actions) >= math.ceil(self.barrier_quorum * num_agents)
+        return len(self._delayed_actions) == num_agents
+
+    def _on_barrier_deadline(self, time_step):
+        if time_step == self._current_time_step and not self.terminate:
+            late_agents = [agent for agent in self.agents if agent not in self._delayed_actions]
+            self.log.info(f'Time step {time_step} deadline elapsed, late agents: {late_agents}')
+            self._receive_value_selection({}, is_forced=True)
+
+    def _record_late_arrival(self, msg):
+        time_step = msg['timestep']
+        # the lateness of an agent later than the window of release times is measured from the oldest one kept (a lower
+        # bound)
+        oldest_release_time = next(iter(self._release_times.values()), self._step_start_time)
+        lateness = clock.monotonic() - self._release_times.get(time_step, oldest_release_time)
+        self.log.info(f'Agent {msg["agent_id"]} selected a value for time step {time_step} {lateness:.3f}s late')
+        self._writer.submit(self._late_arrivals_sink, [time_step, msg['agent_id'], lateness])
+
     def _apply_selected_action(self, agent, value):
         # apply action
         agt = self.agents.get(agent)
@@ -510,13 +737,19 @@ class GridWorld(SimulationEnvironment):
                     current_agt_cell.contents.remove(agt)
                     agt.current_cell = new_cell
                     new_cell.contents.append(agt)
+                    self._agents_index.move(agent, new_cell.i, new_cell.j)
+                    if self._state is not None:
+                        self._state.move_agent(current_agt_cell, new_cell)
                     self.log.debug(f'Agent {agent} changed from {current_agt_cell.cell_id} to {new_cell.cell_id}')
 
     def calculate_global_score(self) -> float:  # number of violations, score
         self.log.debug('Calculating global score')
-        score = 0.
-        for cell in self.grid.values():
-            score += self._calculate_cell_score(cell)
+        if self._state is not None:
+            score = self._state.score()
+        else:
+            score = 0.
+            for cell in self.grid.values():
+                score += self._calculate_cell_score(cell)
         self._mark_detected_targets()
         return score
 
@@ -542,7 +775,18 @@ class GridWorld(SimulationEnvironment):
 
         return score
 
+    def _cells_at(self, indices):
+        return [self.grid[f'{i}-{j}'] for i, j in indices]
+
     def _disable_detected_targets(self):
+        if self._state is not None:
+            # keep the targets in sync for the grid history and the constraint evaluation
+            for cell in self._cells_at(self._state.disable_detected_targets()):
+                for c in cell.contents:
+                    if isinstance(c, Target):
+                        c.is_active = False
+            return
+
         for agt in self.agents:
             for c in self.agents[agt].current_cell.contents:
                 if isinstance(c, Target) and c.is_detected:
@@ -552,50 +796,73 @@ class GridWorld(SimulationEnvironment):
         """
         To be called after computing scores of all agents.
         """
+        if self._state is not None:
+            for cell in self._cells_at(self._state.mark_detected_targets()):
+                for c in cell.contents:
+                    if isinstance(c, Target):
+                        c.is_detected = True
+            return
+
         for agt in self.agents:
             for c in self.agents[agt].current_cell.contents:
                 if isinstance(c, Target):
                     c.is_detected = True
 
     def on_simulation_ended(self):
+        # write all the pending records
+        self.close_writer()
+
         for agent in self.agents:
-            self.channel.basic_publish(
-                exchange=messaging.COMM_EXCHANGE,
+            self.transport.publish(
                 routing_key=f'{messaging.AGENTS_CHANNEL}.{agent}',
                 body=messaging.create_stop_agent_message({})
             )
-        self._terminate = True
+        self.terminate = True
+
+    def close_writer(self):
+        """
+        Writes the queued metrics and snapshots and closes their files.
+        """
+        if self._writer is not None:
+            self._writer.close()
 
     def _receive_add_graph_edge(self, msg):
         self.log.debug(f'Received add-graph edge msg: {msg}')
-        self._current_graph.add_edge(u_of_edge=msg['from'], v_of_edge=msg['to'])
+        self._graph.add_edge(msg['from'], msg['to'])
 
     def _receive_remove_graph_edge(self, msg):
         self.log.debug(f'Received remove-graph edge msg: {msg}')
-        if self._current_graph.has_edge(msg['from'], msg['to']):
-            self._current_graph.remove_edge(msg['from'], msg['to'])
+        self._graph.remove_edge(msg['from'], msg['to'])
 
-    def _copy_current_graph(self):
-        if self._copy_graph:
-            self._previous_graph = copy.deepcopy(self._current_graph)
-        else:
-            self._previous_graph = self._current_graph
-            self._current_graph = nx.Graph()
+    def _commit_graph_version(self):
+        self._graph.commit()
+        if not self._persistent_graph:
+            self._graph.clear()
+
+    def _create_writer(self):
+        folder = os.path.join(ROOT_DIR, self.metrics_folder)
+        os.makedirs(folder, exist_ok=True)
 
-    def _write_metrics_file_header(self, headers):
-        os.makedirs(os.path.join(ROOT_DIR, self.metrics_folder), exist_ok=True)
-        file = os.path.join(ROOT_DIR, self.metrics_folder, self._metrics_file_name)
-        with open(file, mode='w', encoding='utf-8', newline='') as f:
-            csvwriter = csv.writer(f)
-            csvwriter.writerow(headers)
-        self._metrics_file_headers = headers
+        self._writer = BackgroundWriter()
+        self._metrics_sink = self._writer.add_sink(
+            CsvSink(os.path.join(folder, self._metrics_file_name), METRICS_HEADERS)
+        )
+        self._late_arrivals_sink = self._writer.add_sink(
+            CsvSink(os.path.join(folder, f'late_arrivals_{self._sim_file_suffix}.csv'), LATE_ARRIVALS_HEADERS)
+        )
+        if self._trace_enabled:
+            self._snapshots_sink = self._writer.add_sink(TraceSink(TraceWriter(
+                os.path.join(folder, f'trace-{self._sim_file_suffix}'),
+                grid_size=self.grid_size,
+                compress=self._trace_compression,
+            )))
+        else:
+            self._snapshots_sink = self._writer.add_sink(
+                SnapshotFilesSink(folder, self._sim_file_suffix, grid_cell_ids(self.grid_size))
+            )
 
     def _add_metrics_csv_line(self, ts_metrics: dict):
-        data = [ts_metrics.get(c, 0) for c in METRICS_HEADERS]
-        file = os.path.join(ROOT_DIR, self.metrics_folder, self._metrics_file_name)
-        with open(file, mode='a', encoding='utf-8', newline='\n') as f:
-            csvwriter = csv.writer(f)
-            csvwriter.writerow(data)
+        self._writer.submit(self._metrics_sink, [ts_metrics.get(c, 0) for c in METRICS_HEADERS])
 
     def _record_simulation_metrics(self):
         self._metrics[self._current_time_step] = defaultdict(int)
@@ -608,53 +875,36 @@ class GridWorld(SimulationEnvironment):
             for metric, val in record['metrics'].items():
                 ts_metrics[metric] += val
 
+        # barrier metrics
+        late_agents = [agent for agent in self.agents if agent not in self._delayed_actions]
+        ts_metrics['step latency'] = self._release_times[self._current_time_step] - self._step_start_time
+        ts_metrics['max arrival time'] = max(self._arrival_times.values(), default=0.)
+        ts_metrics['num late agents'] = len(late_agents)
+        ts_metrics['late agents'] = ';'.join(late_agents)
+
         # graph metrics
         self.log.debug('Updating sim time step metrics...')
-        if self._previous_graph is None:
+        if self._graph.num_versions == 0:
             ts_metrics['edit distance'] = 0
         else:
             self.log.debug('calculating edit distance')
-            # self.log.debug(f'({nx.to_numpy_array(self._previous_graph).tolist()}), '
-            #                f'({nx.to_numpy_array(self._current_graph).tolist()})')
-            ts_metrics['edit distance'] = nx.graph_edit_distance(
-                G1=self._previous_graph,
-                G2=self._current_graph,
-                timeout=5,
-            )
+            ts_metrics['edit distance'] = self._graph.edit_distance
 
         self.log.debug('setting num components')
-        ts_metrics['num components'] = nx.number_connected_components(self._current_graph)
+        ts_metrics['num components'] = nx.number_connected_components(self._graph.graph)
         self.log.debug('setting number of nodes')
-        ts_metrics['num nodes'] = nx.number_of_nodes(self._current_graph)
+        ts_metrics['num nodes'] = nx.number_of_nodes(self._graph.graph)
 
-        # save metrics to file
-        self.log.debug('Saving time step metrics to file...')
+        # save metrics, grid and graph info to file (the graph is mutable, its nodes and edges are copied)
+        self.log.debug('Saving time step metrics, grid and graph...')
         self._add_metrics_csv_line(ts_metrics)
+        self._state_history.append(self._current_time_step, self._occupancy)
+        self._writer.submit(self._snapshots_sink, (
+            self._current_time_step, self._occupancy, list(self._graph.graph.nodes), list(self._graph.graph.edges)
+        ))
 
-        # save grid info to file
-        self.log.debug('Writing sim grids...')
-        os.makedirs(os.path.join(ROOT_DIR, self.metrics_folder, f'grids-{self._sim_file_suffix}'), exist_ok=True)
-        grid_info = self._state_history[-1]
-        with open(os.path.join(
-                ROOT_DIR,
-                f'{self.metrics_folder}/grids-{self._sim_file_suffix}',
-                f'grid-{self._current_time_step}.txt'
-        ), 'w') as f:
-            f.write(str(grid_info))
-
-        # save graph info to file
-        self.log.debug('Writing sim graphs...')
-        os.makedirs(os.path.join(ROOT_DIR, self.metrics_folder, f'graphs-{self._sim_file_suffix}'), exist_ok=True)
-        nx.write_adjlist(
-            self._current_graph,
-            os.path.join(
-                ROOT_DIR,
-                f'{self.metrics_folder}/graphs-{self._sim_file_suffix}/{self._current_time_step}.adjlist'
-            )
-        )
-
-        self.log.debug('copying graph...')
-        self._copy_current_graph()
+        self.log.debug('committing graph version...')
+        self._commit_graph_version()
 
     def _receive_neighbor_data(self, msg):
         self.log.debug(f'Received neighbor data: {msg}')
@@ -663,12 +913,11 @@ class GridWorld(SimulationEnvironment):
         self._ack_agents.append(msg['agent_id'])
 
         # broadcast this neighbor data to all neighbors that are ready to receive it or pause it for those not ready yet
-        for agent in self.get_agents_in_communication_range(msg['agent_id']):
+        for agent in self._neighborhoods.neighbors(msg['agent_id']):
             body = messaging.create_neighbor_data_message(msg)
             key = f'{messaging.AGENTS_CHANNEL}.{agent}'
             if agent in self._ack_agents:
-                self.channel.basic_publish(
-                    exchange=messaging.COMM_EXCHANGE,
+                self.transport.publish(
                     routing_key=key,
                     body=body
                 )
@@ -682,8 +931,7 @@ class GridWorld(SimulationEnvironment):
             self.log.debug(f'Sending {len(paused_msgs)} paused messages to {msg["agent_id"]}')
         for _ in range(len(paused_msgs)):
             key, body = paused_msgs.pop()
-            self.channel.basic_publish(
-                exchange=messaging.COMM_EXCHANGE,
+            self.transport.publish(
                 routing_key=key,
                 body=body
             )
@@ -0,0 +1,96 @@
+from types import MappingProxyType
+
+
+class GridHash:
+    """
+    Spatial index of items on an integer grid.
+
+    Items are kept in square buckets of `bucket_size` x `bucket_size` cells, keyed by their bucket coordinates. A range
+    query only visits the buckets overlapping the queried square, and the index is updated in place when items move.
+    Distances are Chebyshev distances, i.e. the 8 surrounding cells of a cell are at distance 1.
+    """
+
+    def __init__(self, bucket_size=4):
+        self.bucket_size = bucket_size
+        self._buckets = {}
+        self._positions = {}
+
+    def _bucket_key(self, i, j):
+        return i // self.bucket_size, j // self.bucket_size
+
+    def insert(self, item, i, j):
+        if item in self._positions:
+            raise KeyError(f'{item} is already in the index')
+        self._positions[item] = (i, j)
+        self._buckets.setdefault(self._bucket_key(i, j), {})[item] = (i, j)
+
+    def remove(self, item):
+        i, j = self._positions.pop(item)
+        key = self._bucket_key(i, j)
+        bucket = self._buckets[key]
+        del bucket[item]
+        if not bucket:
+            del self._buckets[key]
+
+    def move(self, item, i, j):
+        old_key = self._bucket_key(*self._positions[item])
+        new_key = self._bucket_key(i, j)
+        if old_key == new_key:
+            self._positions[item] = (i, j)
+            self._buckets[new_key][item] = (i, j)
+        else:
+            self.remove(item)
+            self.insert(item, i, j)
+
+    def position(self, item):
+        return self._positions[item]
+
+    def query(self, i, j, radius, exclude=None) -> list:
+        """
+        Returns the items within `radius` of cell (i, j), except `exclude`.
+        """
+        items = []
+        min_bi, min_bj = self._bucket_key(i - radius, j - radius)
+        max_bi, max_bj = self._bucket_key(i + radius, j + radius)
+
+        for bi in range(min_bi, max_bi + 1):
+            for bj in range(min_bj, max_bj + 1):
+                bucket = self._buckets.get((bi, bj))
+                if not bucket:
+                    continue
+                for item, (ii, jj) in bucket.items():
+                    if abs(ii - i) <= radius and abs(jj - j) <= radius and item != exclude:
+                        items.append(item)
+
+        return items
+
+    def __contains__(self, item):
+        return item in self._positions
+
+    def __len__(self):
+        return len(self._positions)
+
+
+class NeighborhoodTable:
+    """
+    Immutable snapshot of the neighborhoods of a set of agents: the agents in communication range of every agent and
+    the domain (legal actions) of every agent.
+    """
+
+    __slots__ = ('_neighbors', '_domains')
+
+    def __init__(self, neighbors=None, domains=None):
+        self._neighbors = MappingProxyType({k: tuple(v) for k, v in (neighbors or {}).items()})
+        self._domains = MappingProxyType({k: tuple(v) for k, v in (domains or {}).items()})
+
+    def neighbors(self, agent_id) -> tuple:
+        return self._neighbors.get(agent_id, ())
+
+    def domain(self, agent_id) -> tuple:
+        return self._domains[agent_id]
+
+    def __contains__(self, agent_id):
+        return agent_id in self._neighbors
+
+    def __len__(self):
+        return len(self._neighbors)
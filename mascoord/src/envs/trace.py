@@ -0,0 +1,175 @@
+"""
+Append-only trace of the per time step snapshots (grid occupancy and graph) of a simulation run.
+
+A trace is two files:
+
+- `<name>.trace`: a header (magic, then a length-prefixed JSON object with the grid size and whether the records are
+  compressed), followed by one length-prefixed record per time step. A record is the step's snapshot encoded with the
+  message codec and, optionally, compressed with zlib.
+- `<name>.trace.idx`: one fixed-size entry (time step, offset and length of the record) per record, for random access.
+
+Both files are only appended to, so a trace can be read while the simulation is still writing it.
+
+A trace can be converted to the per time step files (grid-<t>.txt and <t>.adjlist) with `convert_trace.py`.
+"""
+import json
+import os
+import struct
+import zlib
+
+import networkx as nx
+
+from mascoord.src import codec
+
+MAGIC = b'DDTRACE1'
+
+TRACE_EXT = '.trace'
+INDEX_EXT = '.trace.idx'
+
+_LENGTH = struct.Struct('<I')
+_INDEX_ENTRY = struct.Struct('<qqI')
+
+
+def cell_ids(grid_size):
+    """
+    IDs of the cells of a GridWorld, in the order of its grid.
+    """
+    return [f'{i}-{j}' for i in range(1, grid_size + 1) for j in range(1, grid_size + 1)]
+
+
+class TraceWriter:
+    """
+    Appends time step snapshots to a trace.
+    """
+
+    def __init__(self, path, grid_size, compress=True, compression_level=6):
+        self.path = path
+        self.compress = compress
+        self.compression_level = compression_level
+        header = json.dumps({'grid_size': grid_size, 'compressed': compress}).encode('utf-8')
+
+        self._file = open(path + TRACE_EXT, 'wb')
+        self._index_file = open(path + INDEX_EXT, 'wb')
+        self._file.write(MAGIC + _LENGTH.pack(len(header)) + header)
+        self._offset = self._file.tell()
+
+    def write(self, time_step, occupancy, nodes, edges):
+        """
+        Appends the snapshot of a time step.
+
+        :param time_step: the time step
+        :param occupancy: dict of cell ID to the contents (str) of the non-empty cells
+        :param nodes: nodes of the graph
+        :param edges: edges of the graph, as (u, v) pairs
+        """
+        record = codec.encode({
+            't': time_step,
+            'grid': occupancy,
+            'nodes': list(nodes),
+            'edges': [[u, v] for u, v in edges],
+        })
+        if isinstance(record, str):
+            record = record.encode('utf-8')
+        if self.compress:
+            record = zlib.compress(record, self.compression_level)
+
+        self._file.write(_LENGTH.pack(len(record)) + record)
+        self._index_file.write(_INDEX_ENTRY.pack(time_step, self._offset, len(record)))
+        self._offset += _LENGTH.size + len(record)
+
+    def flush(self):
+        self._file.flush()
+        self._index_file.flush()
+
+    def close(self):
+        self._file.close()
+        self._index_file.close()
+
+
+class TraceReader:
+    """
+    Reads the time step snapshots of a trace.
+    """
+
+    def __init__(self, path):
+        if path.endswith(TRACE_EXT):
+            path = path[:-len(TRACE_EXT)]
+        self.path = path
+
+        self._file = open(path + TRACE_EXT, 'rb')
+        if self._file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path + TRACE_EXT} is not a trace file')
+        header_length, = _LENGTH.unpack(self._file.read(_LENGTH.size))
+        header = json.loads(self._file.read(header_length))
+        self.grid_size = header['grid_size']
+        self.compressed = header['compressed']
+
+        # time step -> (offset, length) of its record
+        self._index = {}
+        with open(path + INDEX_EXT, 'rb') as f:
+            for time_step, offset, length in _INDEX_ENTRY.iter_unpack(f.read()):
+                self._index[time_step] = (offset, length)
+
+    @property
+    def time_steps(self):
+        return sorted(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, time_step):
+        return time_step in self._index
+
+    def read(self, time_step) -> dict:
+        """
+        Reads the snapshot of a time step.
+
+        :return: dict with the time step ('t'), the occupancy of the non-empty cells ('grid'), the nodes ('nodes') and
+        the edges ('edges') of the graph
+        """
+        offset, length = self._index[time_step]
+        self._file.seek(offset + _LENGTH.size)
+        record = self._file.read(length)
+        if self.compressed:
+            record = zlib.decompress(record)
+        return codec.decode(record)
+
+    def __iter__(self):
+        for time_step in self.time_steps:
+            yield self.read(time_step)
+
+    def grid(self, time_step) -> list:
+        """
+        The grid of a time step, in the format of the grid history of the environment (str of every cell).
+        """
+        occupancy = self.read(time_step)['grid']
+        return [f'{cell_id}: {str(occupancy.get(cell_id, []))}' for cell_id in cell_ids(self.grid_size)]
+
+    def graph(self, time_step) -> nx.Graph:
+        snapshot = self.read(time_step)
+        graph = nx.Graph()
+        graph.add_nodes_from(snapshot['nodes'])
+        graph.add_edges_from(snapshot['edges'])
+        return graph
+
+    def close(self):
+        self._file.close()
+
+
+def convert_to_files(trace_path, output_folder, suffix):
+    """
+    Writes the per time step files of a trace (`grids-<suffix>/grid-<t>.txt` and `graphs-<suffix>/<t>.adjlist`).
+    """
+    reader = TraceReader(trace_path)
+    grids_folder = os.path.join(output_folder, f'grids-{suffix}')
+    graphs_folder = os.path.join(output_folder, f'graphs-{suffix}')
+    os.makedirs(grids_folder, exist_ok=True)
+    os.makedirs(graphs_folder, exist_ok=True)
+
+    for time_step in reader.time_steps:
+        with open(os.path.join(grids_folder, f'grid-{time_step}.txt'), 'w') as f:
+            f.write(str((f't={time_step}', reader.grid(time_step))))
+        nx.write_adjlist(reader.graph(time_step), os.path.join(graphs_folder, f'{time_step}.adjlist'))
+
+    reader.close()
+
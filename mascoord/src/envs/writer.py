@@ -0,0 +1,226 @@
+"""
+Background writing of the simulation environment's per time step records (metrics, grid and graph snapshots).
+
+The environment submits records to a `BackgroundWriter`, whose thread writes them to their sink in batches (all the
+records queued when it wakes up), so the environment can move to the next time step without waiting on the disk. The
+queue is bounded: when the writer falls behind, `submit` blocks until there is room (backpressure) and the time spent
+blocked is reported as the writer's stall time.
+
+The writer thread is a daemon, so the queued records are written by `close`, which is also called at interpreter exit.
+"""
+import atexit
+import csv
+import os
+import queue
+import threading
+import time
+
+import networkx as nx
+
+from mascoord.src import logger
+
+# sentinel closing the writer
+_STOP = object()
+
+
+class CsvSink:
+    """
+    Appends rows to a CSV file kept open for the whole run.
+    """
+
+    def __init__(self, path, headers):
+        self._file = open(path, mode='w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(headers)
+
+    def write_batch(self, rows):
+        self._writer.writerows(rows)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class SnapshotFilesSink:
+    """
+    Writes the grid (grid-<t>.txt) and graph (<t>.adjlist) of every time step to their own files.
+
+    Records are (time step, occupancy, nodes, edges).
+    """
+
+    def __init__(self, folder, suffix, cell_ids):
+        self._cell_ids = cell_ids
+        self._grids_folder = os.path.join(folder, f'grids-{suffix}')
+        self._graphs_folder = os.path.join(folder, f'graphs-{suffix}')
+        os.makedirs(self._grids_folder, exist_ok=True)
+        os.makedirs(self._graphs_folder, exist_ok=True)
+
+    def write_batch(self, records):
+        for time_step, occupancy, nodes, edges in records:
+            grid = [f'{cell_id}: {str(occupancy.get(cell_id, []))}' for cell_id in self._cell_ids]
+            with open(os.path.join(self._grids_folder, f'grid-{time_step}.txt'), 'w') as f:
+                f.write(str((f't={time_step}', grid)))
+
+            graph = nx.Graph()
+            graph.add_nodes_from(nodes)
+            graph.add_edges_from(edges)
+            nx.write_adjlist(graph, os.path.join(self._graphs_folder, f'{time_step}.adjlist'))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TraceSink:
+    """
+    Appends the grid and graph of every time step to a trace (see `trace.TraceWriter`).
+
+    Records are (time step, occupancy, nodes, edges).
+    """
+
+    def __init__(self, trace_writer):
+        self._trace = trace_writer
+
+    def write_batch(self, records):
+        for time_step, occupancy, nodes, edges in records:
+            self._trace.write(time_step, occupancy=occupancy, nodes=nodes, edges=edges)
+
+    def flush(self):
+        self._trace.flush()
+
+    def close(self):
+        self._trace.close()
+
+
+class BackgroundWriter:
+    """
+    Writes records to sinks on a background thread.
+    """
+
+    def __init__(self, max_pending=64, name='EnvWriter'):
+        self.log = logger.get_logger(name)
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._sinks = []
+        self._closed = False
+        # a record is queued before the stop marker or not at all (reentrant: close may run in a signal handler
+        # interrupting a submit)
+        self._lock = threading.RLock()
+
+        # stats
+        self.num_records = 0
+        self.num_batches = 0
+        self.num_stalls = 0
+        self.stall_time = 0.
+        self.max_pending = 0
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+        # write the queued records when the process exits without closing the writer (e.g. on Ctrl-C)
+        atexit.register(self.close)
+
+    def add_sink(self, sink):
+        self._sinks.append(sink)
+        return sink
+
+    def submit(self, sink, record):
+        """
+        Queues a record for a sink. Blocks while the queue is full.
+
+        The records submitted after the writer is closed (e.g. by a time step ending during the shutdown) are dropped
+        with a warning.
+        """
+        with self._lock:
+            if self._closed:
+                self.log.warning(f'The writer is closed, dropped a record for {type(sink).__name__}')
+                return
+
+            try:
+                self._queue.put_nowait((sink, record))
+            except queue.Full:
+                start = time.perf_counter()
+                self._queue.put((sink, record))
+                self.num_stalls += 1
+                self.stall_time += time.perf_counter() - start
+            self.max_pending = max(self.max_pending, self._queue.qsize())
+
+    def _run(self):
+        stop = False
+        while not stop:
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = self._write(items)
+
+            for _ in items:
+                self._queue.task_done()
+
+    def _write(self, items) -> bool:
+        """
+        Writes a batch of queued items.
+
+        :return: whether the batch holds the stop marker
+        """
+        # group the records of the batch by sink, keeping their order
+        stop = False
+        batches = {}
+        for item in items:
+            if item is _STOP:
+                stop = True
+            else:
+                sink, record = item
+                batches.setdefault(sink, []).append(record)
+
+        for sink, records in batches.items():
+            try:
+                sink.write_batch(records)
+                sink.flush()
+            except Exception:
+                self.log.exception(f'Failed to write {len(records)} records to {type(sink).__name__}')
+            self.num_records += len(records)
+        self.num_batches += 1
+        return stop
+
+    def flush(self):
+        """
+        Waits until all the submitted records are written.
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Writes the pending records, stops the thread and closes the sinks.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        atexit.unregister(self.close)
+        self._thread.join()
+
+        # records queued behind the stop marker (only possible when close interrupts a submit on the same thread)
+        leftovers = []
+        while True:
+            try:
+                leftovers.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if leftovers:
+            self._write(leftovers)
+            for _ in leftovers:
+                self._queue.task_done()
+
+        for sink in self._sinks:
+            sink.close()
+
+        self.log.info(f'Wrote {self.num_records} records in {self.num_batches} batches, max pending = '
+                      f'{self.max_pending}, stalled {self.num_stalls} times for {self.stall_time:.3f}s')
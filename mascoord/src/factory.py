@@ -10,6 +10,9 @@ import numpy as np
 
 import config
 import logger
+from mascoord.src import clock, codec, host, sharding, transport
+from mascoord.src.algorithms.dcop import optimization
+from mascoord.src.envs import mobile_sensing
 from mascoord.src.config import DYNAMIC_SIM_ENV
 from mascoord.src.runner import Runner
 from mascoord.src.utils import time_since
@@ -70,12 +73,98 @@ if __name__ == '__main__':
         default='min',
         dest='opt_op',
     )
+    parser.add_argument(
+        '--opt_solver',
+        choices=optimization.SOLVERS,
+        default=optimization.GRADIENT,
+        help='The continuous optimization of C-CoCoA and C-DPOP. The analytic solver minimizes the (quadratic) local '
+             'objective exactly when it is strictly convex and falls back to gradient descent otherwise',
+    )
+    parser.add_argument(
+        '--opt_step',
+        choices=optimization.STEP_CONTROLS,
+        default=optimization.FIXED_STEP,
+        help='The step size control of the continuous optimization of C-CoCoA and C-DPOP',
+    )
+    parser.add_argument(
+        '--opt_tol',
+        type=float,
+        default=None,
+        help='The continuous optimization stops when no value changes by more than this tolerance. By default (or '
+             'with a tolerance <= 0) it always runs the maximum number of iterations',
+    )
+    parser.add_argument(
+        '--opt_max_iter',
+        type=int,
+        default=100,
+        help='The maximum number of iterations of the continuous optimization',
+    )
     parser.add_argument(
         '-s',
         '--seed',
         default=0,
         type=int,
     )
+    parser.add_argument(
+        '-t',
+        '--transport',
+        choices=transport.BACKENDS,
+        default=transport.RABBITMQ,
+        help='The message transport. Use inproc to run all agents on an in-process message bus (no broker)',
+    )
+    parser.add_argument(
+        '-c',
+        '--connection_pool_size',
+        type=int,
+        default=0,
+        help='The number of broker connections shared by all agents (rabbitmq transport). '
+             'Use 0 to open one connection per agent',
+    )
+    parser.add_argument(
+        '-o',
+        '--agent_host',
+        choices=host.HOST_MODES,
+        default=host.THREADS,
+        help='How agents are executed: one thread per agent or as coroutines on a single asyncio event loop. '
+             'The asyncio host requires the inproc transport or a connection pool',
+    )
+    parser.add_argument(
+        '-m',
+        '--message_format',
+        choices=codec.FORMATS,
+        default=codec.get_format(),
+        help='The encoding of agent and simulation messages. Dashboard messages are always encoded as JSON',
+    )
+    parser.add_argument(
+        '-b',
+        '--no_batching',
+        action='store_true',
+        help='Publish every agent message on its own instead of coalescing the messages of an event loop iteration '
+             'into one frame per recipient',
+    )
+    parser.add_argument(
+        '-v',
+        '--clock',
+        choices=clock.CLOCKS,
+        default=clock.WALL,
+        help='The clock of timers and delays. With the virtual clock, the simulation runs as a reproducible '
+             'discrete-event simulation in which delays take no time (requires -t inproc -o asyncio)',
+    )
+    parser.add_argument(
+        '-n',
+        '--num_shards',
+        type=int,
+        default=1,
+        help='The number of processes hosting the agents. Sharding requires the rabbitmq transport',
+    )
+    parser.add_argument(
+        '-k',
+        '--placement',
+        choices=sharding.PLACEMENTS,
+        default=sharding.HASH,
+        help='How agents are assigned to shards: by hash of the agent ID or close to their neighbors in the '
+             'predefined graph',
+    )
 
     subparsers = parser.add_subparsers(
         title='Execution modes',
@@ -163,9 +252,72 @@ if __name__ == '__main__':
         type=str,
         help="Path to pickled scenarios object",
     )
+    sim_parser.add_argument(
+        "--vectorized",
+        action="store_true",
+        help="Keep the GridWorld state in NumPy arrays (vectorized scores and target detection)",
+    )
+    sim_parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Append the per time step grids and graphs to a trace file instead of writing a pair of files per step",
+    )
+    sim_parser.add_argument(
+        "--no_trace_compression",
+        action="store_true",
+        help="Do not compress the records of the trace",
+    )
+    sim_parser.add_argument(
+        "--barrier",
+        default=mobile_sensing.FULL_BARRIER,
+        choices=mobile_sensing.BARRIERS,
+        help="When a time step ends: when all agents have selected a value (full), after a deadline or when a "
+             "quorum of the agents have selected a value. Late agents keep their position.",
+    )
+    sim_parser.add_argument(
+        "--barrier_deadline",
+        default=5.,
+        type=float,
+        help="Duration (seconds) of a time step with the deadline barrier",
+    )
+    sim_parser.add_argument(
+        "--barrier_quorum",
+        default=.9,
+        type=float,
+        help="Fraction of the agents that end a time step with the quorum barrier",
+    )
+    sim_parser.add_argument(
+        "--history_depth",
+        default=100,
+        type=int,
+        help="Number of time steps of the grid history kept in memory",
+    )
 
     args = parser.parse_args()
 
+    if args.num_shards < 1:
+        parser.error('the number of shards must be at least 1')
+    if args.num_shards > 1 and args.transport == transport.IN_PROCESS:
+        parser.error('sharding requires the rabbitmq transport, the inproc bus is not shared between processes')
+    if args.num_shards > 1 and args.command == 'mst-simulation':
+        parser.error('sharding is not supported by mst-simulation, the agents read the environment in-process')
+    if args.clock == clock.VIRTUAL and (args.transport != transport.IN_PROCESS or args.agent_host != host.ASYNCIO
+                                        or args.num_shards > 1):
+        parser.error('the virtual clock requires the inproc transport and the asyncio agent host (without sharding)')
+    if args.clock == clock.VIRTUAL and args.command is None:
+        parser.error('the virtual clock cannot be used with the dashboard')
+    if args.command == 'mst-simulation' and args.barrier_deadline <= 0:
+        parser.error('the barrier deadline must be positive')
+    if args.command == 'mst-simulation' and not 0 < args.barrier_quorum <= 1:
+        parser.error('the barrier quorum must be in (0, 1]')
+    if args.command == 'mst-simulation' and args.history_depth < 1:
+        parser.error('the history depth must be at least 1')
+
+    # string hashing, hence the iteration order of sets, must not vary between runs to reproduce a simulation
+    if args.clock == clock.VIRTUAL and os.environ.get('PYTHONHASHSEED') != str(args.seed):
+        os.environ['PYTHONHASHSEED'] = str(args.seed)
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
     from mascoord.src import logger, handlers
 
     seed = args.seed
@@ -173,59 +325,76 @@ if __name__ == '__main__':
     random.seed(seed)
 
     handlers.set_domain_size(args.domain_size)
+    transport.set_backend(args.transport)
+    transport.set_connection_pool_size(args.connection_pool_size)
+    codec.set_format(args.message_format)
+    transport.set_outbox_enabled(not args.no_batching)
+    clock.set_clock(args.clock)
+    handlers.set_host_mode(args.agent_host)
 
     command = args.command
     config.shared_config.execution_mode = command
     config.shared_config.logger_level = args.logger_level.upper()
     config.shared_config.optimization_op = args.opt_op
+    config.shared_config.optimizer_solver = args.opt_solver
+    config.shared_config.optimizer_step = args.opt_step
+    config.shared_config.optimizer_tol = args.opt_tol if args.opt_tol is not None and args.opt_tol > 0 else None
+    config.shared_config.optimizer_max_iter = args.opt_max_iter
+
+    handlers.set_num_shards(args.num_shards, args.placement, seed)
+
+    # the factory drives the simulation (see clock.VirtualClock)
+    with clock.driving():
+        if command == 'graph-gen':
+            handlers.set_dcop_algorithm('no-dcop')
+            config.shared_config.use_predefined_graph = False
 
-    if command == 'graph-gen':
-        handlers.set_dcop_algorithm('no-dcop')
-        config.shared_config.use_predefined_graph = False
-
-        for degree in args.degrees:
-            random.seed(degree)
-            config.shared_config.max_out_degree = degree
-            for k in range(args.num_diff_graphs):
-                log.info(f'------------- Degree: {degree}, run: {k + 1} ----------------')
-                handlers.metrics.can_save = False
-                runner = Runner(args)
-                runner.execute_graph_gen()
-                handlers.save_simulation_handler({
-                    'prefix': f'max-deg-{degree}-graph-{k + 1}-'
-                })
-                handlers.reset_buffers()
-                runner.release_resources()
-
-    elif command == 'simulation':
-        config.shared_config.use_predefined_graph = True
-        simulations = os.listdir('../simulations')
-        sim_files = [file for file in simulations if '.sim' in file]
-
-        for algorithm in args.algs:
-            handlers.set_dcop_algorithm(algorithm)
-            for i in range(args.num_runs):
-                random.seed(i)
-                for filename in sim_files:
-                    log.info(f'---------- Executing: {algorithm}, run: {i + 1}, filename: {filename} -------------')
-                    handlers.set_metrics_file_prefix(f'{filename}-run-{i + 1}-')
+            for degree in args.degrees:
+                random.seed(degree)
+                config.shared_config.max_out_degree = degree
+                for k in range(args.num_diff_graphs):
+                    log.info(f'------------- Degree: {degree}, run: {k + 1} ----------------')
+                    handlers.metrics.can_save = False
                     runner = Runner(args)
-                    runner.execute_sim_from_files(filename)
+                    runner.execute_graph_gen()
+                    handlers.save_simulation_handler({
+                        'prefix': f'max-deg-{degree}-graph-{k + 1}-'
+                    })
                     handlers.reset_buffers()
                     runner.release_resources()
 
-    elif command == 'mst-simulation':
-        config.shared_config.execution_mode = DYNAMIC_SIM_ENV
-        handlers.set_dcop_algorithm(args.algs[0])
-        handlers.set_graph_algorithm(args.graph_alg)
-        runner = Runner(args)
-        signal.signal(signal.SIGINT, functools.partial(_on_force_exit, runner.on_force_exit))
-        runner.start_simulation_environment(args)
-        runner.wait()
-    else:
-        handlers.set_dcop_algorithm(args.algs[0])
-        runner = Runner(args)
-        runner.execute_sim_with_dashboard()
+        elif command == 'simulation':
+            config.shared_config.use_predefined_graph = True
+            simulations = os.listdir('../simulations')
+            sim_files = [file for file in simulations if '.sim' in file]
+
+            for algorithm in args.algs:
+                handlers.set_dcop_algorithm(algorithm)
+                for i in range(args.num_runs):
+                    random.seed(i)
+                    for filename in sim_files:
+                        log.info(f'---------- Executing: {algorithm}, run: {i + 1}, filename: {filename} -------------')
+                        handlers.set_metrics_file_prefix(f'{filename}-run-{i + 1}-')
+                        runner = Runner(args)
+                        runner.execute_sim_from_files(filename)
+                        handlers.reset_buffers()
+                        runner.release_resources()
+
+        elif command == 'mst-simulation':
+            config.shared_config.execution_mode = DYNAMIC_SIM_ENV
+            handlers.set_dcop_algorithm(args.algs[0])
+            handlers.set_graph_algorithm(args.graph_alg)
+            runner = Runner(args)
+            signal.signal(signal.SIGINT, functools.partial(_on_force_exit, runner.on_force_exit))
+            runner.start_simulation_environment(args)
+            runner.wait()
+        else:
+            handlers.set_dcop_algorithm(args.algs[0])
+            runner = Runner(args)
+            runner.execute_sim_with_dashboard()
+
+    handlers.close_shard_pool()
+    transport.close_connection_pool()
 
     sim_time = time_since(start_time)
     log.info(f'Elapsed time: {sim_time}')
@@ -1,8 +1,8 @@
 import datetime
+import functools
 import os
 import random
 import threading
-import time
 
 import pandas as pd
 
@@ -11,6 +11,7 @@ import config
 import logger
 import messaging
 import utils
+from mascoord.src import clock, host, sharding
 from mascoord.src.algorithms.dcop import DCOP
 from mascoord.src.algorithms.dcop.ccocoa import CCoCoA
 from mascoord.src.algorithms.dcop.cocoa import CoCoA
@@ -31,6 +32,7 @@ CHANGE_CONSTRAINT = 'change_constraint'
 last_event = None
 last_event_date_time = None
 dcop_algorithm = None
+dcop_algorithm_name = None
 graph_algorithm = None
 
 costs_per_event = {}
@@ -39,6 +41,29 @@ time_per_event = {}
 
 domain_size = 2
 
+host_mode = host.THREADS
+agent_host = None
+
+shard_pool = None
+
+# agent attributes aggregated by the metrics table
+AGENT_STAT_ATTRS = [
+    'messages_count',
+    'cost',
+    'value_changes_count',
+    'announce_msg_count',
+    'announce_res_msg_count',
+    'add_me_count',
+    'child_added_count',
+    'parent_assigned_count',
+    'already_active_count',
+    'ping_msg_count',
+    'ping_msg_resp_count',
+    'constraint_changed_count',
+    'outbox_messages_count',
+    'outbox_frames_count',
+]
+
 metrics_file_prefix = None
 
 
@@ -70,12 +95,21 @@ def reset_buffers():
 
     commands.clear()
 
+    if shard_pool:
+        shard_pool.reset()
+
     metrics = MetricsTable()
 
     log.info('----------------- Reset complete ----------------------')
 
 
-def create_and_start_agent(agent_id):
+def create_agent(agent_id, loop=None, sim_env=None, bus=None):
+    """
+    Creates an agent of the configured DCOP algorithm.
+
+    :param sim_env: the environment of the simulation the agent takes part in, if any
+    :param bus: the in-process message bus the agent is attached to (defaults to the process-wide bus)
+    """
     if dcop_algorithm:
         dcop_agent = agent.Agent(
             agent_id, dcop_algorithm,
@@ -83,17 +117,28 @@ def create_and_start_agent(agent_id):
             domain_size=domain_size,
             metrics=metrics,
             shared_config=config.shared_config,
-            graph_algorithm=graph_algorithm
+            graph_algorithm=graph_algorithm,
+            sim_env=sim_env,
+            bus=bus,
+            loop=loop,
         )
         agents[agent_id] = dcop_agent
-        dcop_agent()
+        return dcop_agent
     else:
         log.error('DCOP algorithm must be provided before creating an agent')
 
 
+def create_and_start_agent(agent_id, sim_env=None, bus=None):
+    dcop_agent = create_agent(agent_id, sim_env=sim_env, bus=bus)
+    if dcop_agent:
+        dcop_agent()
+
+
 def set_dcop_algorithm(alg):
     global dcop_algorithm
+    global dcop_algorithm_name
 
+    dcop_algorithm_name = alg
     dcop_algorithm = {
         'cocoa': CoCoA,
         'c-cocoa': CCoCoA,
@@ -112,6 +157,55 @@ def set_domain_size(size):
     domain_size = size
 
 
+def set_host_mode(mode):
+    global host_mode
+    global agent_host
+
+    if mode not in host.HOST_MODES:
+        raise ValueError(f'Unknown agent host mode: {mode}')
+    host_mode = mode
+
+    if host_mode == host.ASYNCIO and agent_host is None:
+        agent_host = host.AsyncAgentHost()
+
+
+def set_num_shards(num_shards, placement=sharding.HASH, seed=0):
+    global shard_pool
+
+    if num_shards < 1:
+        raise ValueError(f'Invalid number of shards: {num_shards}')
+
+    if num_shards > 1 and shard_pool is None:
+        shard_pool = sharding.ShardPool(num_shards, placement, seed)
+
+
+def close_shard_pool():
+    global shard_pool
+
+    if shard_pool:
+        shard_pool.close()
+        shard_pool = None
+
+
+def get_shard_configuration():
+    """
+    The handlers' settings the shards need to create agents.
+    """
+    return {
+        'dcop_algorithm': dcop_algorithm_name,
+        'graph_algorithm': graph_algorithm,
+        'domain_size': domain_size,
+        'host_mode': host_mode,
+        'shared_config': dict(vars(config.shared_config)),
+        'coefficients_dict': dict(utils.coefficients_dict),
+    }
+
+
+def get_agent_stats(node):
+    node.set_edge_costs()
+    return {attr: getattr(node, attr) for attr in AGENT_STAT_ATTRS}
+
+
 def test_msg_handler(msg):
     print('This is a test message handler: ', msg)
 
@@ -127,12 +221,13 @@ def add_agent_handler(msg):
             commands.append(evt)
 
             metrics.last_event = evt
-            metrics.last_event_date_time = datetime.datetime.now()
+            metrics.last_event_date_time = clock.now()
 
             _spawn_agent(agent_id)
 
             if not is_graph_gen():
-                time.sleep(config.HANDLER_COMM_EXEC_DELAY_IN_SECONDS)
+                clock.sleep(config.HANDLER_COMM_EXEC_DELAY_IN_SECONDS)
+                _update_sharded_metrics()
     else:
         for i in range(num_agents):
             agent_id = i if is_graph_gen() else len(agents)
@@ -140,12 +235,12 @@ def add_agent_handler(msg):
             commands.append(evt)
 
             metrics.last_event = evt
-            metrics.last_event_date_time = datetime.datetime.now()
+            metrics.last_event_date_time = clock.now()
 
             _spawn_agent(agent_id=agent_id)
 
             # if not is_graph_gen():
-            #     time.sleep(config.HANDLER_COMM_EXEC_DELAY_IN_SECONDS)
+            #     clock.sleep(config.HANDLER_COMM_EXEC_DELAY_IN_SECONDS)
 
     # time.sleep(2)
     # client.publish(f'{messaging.FACTORY_COMMAND_CHANNEL}/',
@@ -158,10 +253,25 @@ def is_graph_gen():
     return config.shared_config.execution_mode == 'graph-gen'
 
 
-def _spawn_agent(agent_id):
-    t = threading.Thread(target=create_and_start_agent, args=(str(agent_id),))
-    agent_id_to_thread[str(agent_id)] = t
-    t.start()
+def _spawn_agent(agent_id, sim_env=None, bus=None):
+    if shard_pool:
+        sharded_agent = shard_pool.add_agent(str(agent_id), get_shard_configuration())
+        agents[str(agent_id)] = sharded_agent
+        agent_id_to_thread[str(agent_id)] = sharded_agent
+    elif host_mode == host.ASYNCIO:
+        agent_id_to_thread[str(agent_id)] = agent_host.spawn(
+            functools.partial(create_agent, str(agent_id), sim_env=sim_env, bus=bus)
+        )
+    else:
+        t = threading.Thread(target=create_and_start_agent, args=(str(agent_id), sim_env, bus))
+        agent_id_to_thread[str(agent_id)] = t
+        t.start()
+
+
+def _update_sharded_metrics():
+    # agents hosted by shards cannot update the metrics table of the factory, so it is updated after each event
+    if shard_pool:
+        metrics.update_metrics()
 
 
 def remove_agent_handler(msg):
@@ -189,13 +299,14 @@ def remove_agent_handler(msg):
                 commands.append(evt)
 
                 metrics.last_event = evt
-                metrics.last_event_date_time = datetime.datetime.now()
+                metrics.last_event_date_time = clock.now()
 
                 selected_agent.shutdown()
                 agent_id_to_thread[selected_id].join()
                 terminated_agents.append(selected_agent)
 
-                time.sleep(config.HANDLER_COMM_EXEC_DELAY_IN_SECONDS)
+                clock.sleep(config.HANDLER_COMM_EXEC_DELAY_IN_SECONDS)
+                _update_sharded_metrics()
 
                 # agents.pop(selected_id)
                 log.info(f'Removed agent {selected_agent}')
@@ -225,11 +336,12 @@ def change_constraint_handler(msg):
             commands.append(evt)
 
             metrics.last_event = evt
-            metrics.last_event_date_time = datetime.datetime.now()
+            metrics.last_event_date_time = clock.now()
 
             selected_agent.change_constraint(coefficients, selected_neighbor)
 
-            time.sleep(config.HANDLER_COMM_EXEC_DELAY_IN_SECONDS)
+            clock.sleep(config.HANDLER_COMM_EXEC_DELAY_IN_SECONDS)
+            _update_sharded_metrics()
 
 
 def agent_report_handler(msg):
@@ -327,9 +439,12 @@ def current_datetime():
     return datetime.datetime.now().strftime('%m-%d-%Y-%H-%M-%S')
 
 
-def agent_added_handler(msg):
+def agent_added_handler(msg, sim_env=None, bus=None):
+    """
+    Spawns an agent added by a simulation environment (the runner binds the environment and its bus).
+    """
     log.info(f'Received agent added message: {msg}')
-    _spawn_agent(msg['payload']['agent'])
+    _spawn_agent(msg['payload']['agent'], sim_env=sim_env, bus=bus)
 
 
 def agent_removed_handler(msg):
@@ -370,6 +485,9 @@ class MetricsTable:
         self.ping_msg_resp_count = {}
         self.constraint_changed_count = {}
 
+        self.outbox_messages_count = {}
+        self.outbox_frames_count = {}
+
         self.last_event = None
         self.last_event_date_time = None
 
@@ -390,25 +508,27 @@ class MetricsTable:
             ping_msg_count = 0
             ping_msg_resp_count = 0
             constraint_changed_count = 0
-
-            for node in agents.values():
-                if not node.terminate:
-                    num_active_agents += 1
-                    messages_count += node.messages_count
-                    total_cost += node.cost
-                    num_changes += node.value_changes_count
-
-                    announce_msg_count += node.announce_msg_count
-                    announce_res_msg_count += node.announce_res_msg_count
-                    add_me_count += node.add_me_count
-                    child_added_count += node.child_added_count
-                    parent_assigned_count += node.parent_assigned_count
-                    already_active_count += node.already_active_count
-                    ping_msg_count += node.ping_msg_count
-                    ping_msg_resp_count += node.ping_msg_resp_count
-                    constraint_changed_count += node.constraint_changed_count
-
-                    node.set_edge_costs()
+            outbox_messages_count = 0
+            outbox_frames_count = 0
+
+            for stats in self._gather_agent_stats():
+                num_active_agents += 1
+                messages_count += stats['messages_count']
+                total_cost += stats['cost']
+                num_changes += stats['value_changes_count']
+
+                announce_msg_count += stats['announce_msg_count']
+                announce_res_msg_count += stats['announce_res_msg_count']
+                add_me_count += stats['add_me_count']
+                child_added_count += stats['child_added_count']
+                parent_assigned_count += stats['parent_assigned_count']
+                already_active_count += stats['already_active_count']
+                ping_msg_count += stats['ping_msg_count']
+                ping_msg_resp_count += stats['ping_msg_resp_count']
+                constraint_changed_count += stats['constraint_changed_count']
+
+                outbox_messages_count += stats['outbox_messages_count']
+                outbox_frames_count += stats['outbox_frames_count']
 
             self.cost[self.last_event] = total_cost
             self.edge_cost_per_event[self.last_event] = sum(self.edge_cost_per_agent.values())
@@ -426,8 +546,19 @@ class MetricsTable:
             self.ping_msg_resp_count[self.last_event] = ping_msg_resp_count
             self.constraint_changed_count[self.last_event] = constraint_changed_count
 
+            self.outbox_messages_count[self.last_event] = outbox_messages_count
+            self.outbox_frames_count[self.last_event] = outbox_frames_count
+
             save_simulation_metrics_handler()
 
+    def _gather_agent_stats(self):
+        if shard_pool:
+            agent_stats, edge_costs = shard_pool.gather_stats()
+            self.edge_cost_per_agent.update(edge_costs)
+            return agent_stats
+
+        return [get_agent_stats(node) for node in agents.values() if not node.terminate]
+
     def update_edge_cost(self, agent1, agent2, cost):
         k1 = agent1
         k2 = agent2
@@ -457,11 +588,18 @@ class MetricsTable:
                 'ping_msg_count': list(self.ping_msg_count.values()),
                 'ping_msg_resp_count': list(self.ping_msg_resp_count.values()),
                 'constraint_changed_count': list(self.constraint_changed_count.values()),
+
+                # message coalescing stats (see transport.Outbox)
+                'outbox_message_count': list(self.outbox_messages_count.values()),
+                'outbox_frame_count': list(self.outbox_frames_count.values()),
+                'batching_factor': [m / f if f else 0. for m, f in zip(self.outbox_messages_count.values(),
+                                                                       self.outbox_frames_count.values())],
             })
             df.to_csv(path, index=False)
 
     def get_agent_value(self, agent_id):
-        if agent_id in agents:
+        # agents hosted by shards are not readable from this process
+        if agent_id in agents and not isinstance(agents[agent_id], sharding.ShardedAgent):
             return agents[agent_id].value
         else:
             return None
@@ -0,0 +1,109 @@
+"""
+Agent hosts run agents created by the factory handlers.
+
+By default every agent runs on its own thread (see `handlers._spawn_agent`). `AsyncAgentHost` instead runs all agents
+as coroutines on a single asyncio event loop, which removes the per-agent threads (and GIL contention) when hosting
+thousands of agents in one process. The event loop is created by the selected clock (see `clock.VirtualClock`).
+"""
+import asyncio
+import concurrent.futures
+import threading
+
+from mascoord.src import clock, logger
+
+THREADS = 'threads'
+ASYNCIO = 'asyncio'
+
+HOST_MODES = [THREADS, ASYNCIO]
+
+log = logger.get_logger('AgentHost')
+
+
+class AgentTask:
+    """
+    Handle of an agent running on an `AsyncAgentHost`. Provides the `join` method of `threading.Thread` so the
+    handlers can treat hosted agents and agent threads alike.
+    """
+
+    def __init__(self, future, loop):
+        self._future = future
+        self._loop = loop
+
+    def join(self, timeout=None):
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        # waiting on the event loop would block the agent, which then terminates asynchronously
+        if running_loop is not self._loop:
+            clock.wait(self._future, timeout)
+
+    def is_alive(self):
+        return not self._future.done()
+
+
+class AsyncAgentHost:
+    """
+    Runs agents as coroutines on one asyncio event loop (in a dedicated thread).
+    """
+
+    def __init__(self):
+        self.loop = clock.new_event_loop()
+        # called with the exception of a hosted agent that failed
+        self._failure_callbacks = []
+        self._thread = threading.Thread(target=self._run, name='async-agent-host', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def spawn(self, create_agent):
+        """
+        Creates and runs an agent on the event loop.
+
+        :param create_agent: callable that takes the event loop and returns an agent (or any object with a `run_async`
+            coroutine, such as the simulation environment), called on the event loop thread
+        :return: an `AgentTask` to wait for the agent to terminate
+        """
+        return AgentTask(asyncio.run_coroutine_threadsafe(self._run_agent(create_agent), self.loop), self.loop)
+
+    def add_failure_callback(self, callback):
+        """
+        Registers `callback(exception)`, called on the event loop thread when a hosted agent fails (including when it
+        cannot be created).
+        """
+        self._failure_callbacks.append(callback)
+
+    def call(self, func):
+        """
+        Calls `func(loop)` on the event loop thread and returns its result. Used to create the transports of
+        components that are consumed on the event loop.
+        """
+        future = concurrent.futures.Future()
+
+        def callback():
+            try:
+                future.set_result(func(self.loop))
+            except Exception as e:
+                future.set_exception(e)
+
+        self.loop.call_soon_threadsafe(callback)
+        clock.wait(future)
+        return future.result()
+
+    async def _run_agent(self, create_agent):
+        try:
+            agent = create_agent(self.loop)
+            if agent:
+                await agent.run_async()
+        except Exception as e:
+            log.exception(f'Hosted agent failed: {str(e)}')
+            for callback in self._failure_callbacks:
+                callback(e)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
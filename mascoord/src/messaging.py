@@ -1,7 +1,5 @@
-import datetime
-import json
-
 import config
+from mascoord.src import clock, codec
 
 COMM_EXCHANGE = f'{config.DOMAIN}.ddcop'
 
@@ -59,6 +57,20 @@ AGENT_REPORT = 'AGENT_REPORT'
 
 METRICS_REPORT = 'METRICS_REPORT'
 
+# messages consumed by the dashboard (through the middleware) which only understands JSON
+DASHBOARD_MESSAGE_TYPES = {
+    AGENT_CONNECTION_MSG,
+    AGENT_REGISTRATION_DASHBOARD,
+    AGENT_CPA_REPORT,
+    AGENT_DISCONNECTION,
+    AGENT_RESET,
+    AGENT_STATE_CHANGED,
+    AGENT_SHUTDOWN,
+    AGENT_REPORT,
+    SAVED_SIMULATIONS_REPORT,
+    DCOP_ALGORITHM,
+}
+
 # C-CoCoA message types
 UPDATE_STATE_MESSAGE = 'UpdateStateMsg'
 INQUIRY_MESSAGE = 'InquiryMessage'
@@ -70,6 +82,17 @@ VALUE_MESSAGE = 'ValueMessage'
 UTIL_MESSAGE = 'UtilMessage'
 REQUEST_UTIL_MESSAGE = 'RequestUtilMessage'
 
+# messages exchanged by the agents running a DCOP, their payload carries the time step of the sender
+DCOP_MESSAGE_TYPES = {
+    UPDATE_STATE_MESSAGE,
+    INQUIRY_MESSAGE,
+    COST_MESSAGE,
+    EXECUTION_REQUEST,
+    VALUE_MESSAGE,
+    UTIL_MESSAGE,
+    REQUEST_UTIL_MESSAGE,
+}
+
 # Sim environment message
 AGENT_ADDED = 'AGENT_ADDED'
 AGENT_REMOVED = 'AGENT_REMOVED'
@@ -86,11 +109,11 @@ DDFS_PSEUDO_CHILD_MSG = 'DDFS_PSEUDO_CHILD_MSG'
 
 
 def _create_msg(msg_type, data):
-    return json.dumps({
+    return codec.encode({
         'type': msg_type,
         'payload': data,
-        'timestamp': datetime.datetime.now().timestamp()
-    })
+        'timestamp': clock.time()
+    }, fmt=codec.JSON if msg_type in DASHBOARD_MESSAGE_TYPES else None)
 
 
 def create_test_message(data):
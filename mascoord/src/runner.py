@@ -1,3 +1,4 @@
+import functools
 import os
 import pickle
 import random
@@ -6,13 +7,11 @@ import threading
 import time
 from argparse import ArgumentParser
 
-import pika
-
 import config
 import logger
 import messaging
 from mascoord.definitions import ROOT_DIR
-from mascoord.src import handlers
+from mascoord.src import clock, codec, handlers, transport
 from mascoord.src.envs.mobile_sensing import GridWorld
 from mascoord.src.envs.scenario import MSTScenario
 from mascoord.src.utils import notify_wrap
@@ -20,14 +19,15 @@ from mascoord.src.utils import notify_wrap
 log = logger.get_logger('Runner')
 
 
-def on_message(ch, method, properties, body):
-    msg = eval(body.decode('utf-8'))
-    func = handlers.directory.get(msg['type'], None)
+def on_message(body, directory=None):
+    directory = handlers.directory if directory is None else directory
+    for msg in codec.decode_frame(body):
+        func = directory.get(msg['type'], None)
 
-    if func:
-        func(msg)
-    else:
-        log.warning(f'Message type {msg["type"]} has no handler')
+        if func:
+            func(msg)
+        else:
+            log.warning(f'Message type {msg["type"]} has no handler')
 
 
 class Runner:
@@ -35,35 +35,27 @@ class Runner:
     def __init__(self, exec_args):
         self.exec_args = exec_args
 
-        self.client = pika.BlockingConnection(pika.ConnectionParameters(
-            host=config.BROKER_URL,
-            port=config.BROKER_PORT,
-            heartbeat=0,  # only for experiment purposes - not recommended (https://www.rabbitmq.com/heartbeats.html)
-            credentials=pika.credentials.PlainCredentials(config.PIKA_USERNAME, config.PIKA_PASSWORD))
-        )
-        self.channel = self.client.channel()
-        self.channel.exchange_declare(exchange=messaging.COMM_EXCHANGE, exchange_type='topic')
+        # with the virtual clock, every component of the simulation is consumed on the event loop of the agent host
+        if clock.is_virtual():
+            self.transport = handlers.agent_host.call(lambda loop: transport.create_transport(loop=loop))
+        else:
+            self.transport = transport.create_transport()
+        self.transport.declare_exchange()
 
         self._terminate = False
 
         # factory queue
         self.queue_name = 'factory-queue'
-        self.channel.queue_declare(queue=self.queue_name, exclusive=True)
+        self.transport.declare_queue(self.queue_name, exclusive=True)
 
         # register topics (aka routing keys) associated to the factory queue
-        self.channel.queue_bind(
-            exchange=messaging.COMM_EXCHANGE,
-            queue=self.queue_name,
-            routing_key=f'{messaging.DASHBOARD_COMMAND_CHANNEL}.#'
-        )
-        self.channel.queue_bind(
-            exchange=messaging.COMM_EXCHANGE,
-            queue=self.queue_name,
-            routing_key=f'{messaging.FACTORY_COMMAND_CHANNEL}.#'
-        )
+        self.transport.bind(self.queue_name, f'{messaging.DASHBOARD_COMMAND_CHANNEL}.#')
+        self.transport.bind(self.queue_name, f'{messaging.FACTORY_COMMAND_CHANNEL}.#')
 
-        # subscribe to dashboard commands
-        self.channel.basic_consume(queue=self.queue_name, on_message_callback=on_message, auto_ack=True)
+        # subscribe to dashboard commands, the handlers of the simulation environment's messages are bound to it when it
+        # is created
+        self.directory = dict(handlers.directory)
+        self.transport.consume(self.queue_name, functools.partial(on_message, directory=self.directory))
 
         # send available simulations to dashboard
         simulations = os.listdir(os.path.join(ROOT_DIR, 'simulations'))
@@ -72,23 +64,24 @@ class Runner:
                 'date': sim.removesuffix('.sim'),
                 'filename': sim,
             } for sim in simulations if '.sim' in sim]
-            self.channel.basic_publish(exchange=messaging.COMM_EXCHANGE,
-                                       routing_key=f'{messaging.MONITORING_CHANNEL}',
-                                       body=messaging.create_saved_simulations_report({
-                                           'simulations': parsed_sim,
-                                       }))
+            self.transport.publish(routing_key=f'{messaging.MONITORING_CHANNEL}',
+                                   body=messaging.create_saved_simulations_report({
+                                       'simulations': parsed_sim,
+                                   }))
 
         # report algorithm in use
-        self.channel.basic_publish(exchange=messaging.COMM_EXCHANGE,
-                                   routing_key=f'{messaging.MONITORING_CHANNEL}',
-                                   body=messaging.create_dcop_algorithm_report({
-                                       'dcop': handlers.dcop_algorithm.name,
-                                   }))
+        self.transport.publish(routing_key=f'{messaging.MONITORING_CHANNEL}',
+                               body=messaging.create_dcop_algorithm_report({
+                                   'dcop': handlers.dcop_algorithm.name,
+                               }))
 
         # for simulation environment
         self.sim_env = None
         self._sim_env_stop_sig = threading.Event()
 
+        # exception of the simulation environment or of an agent hosted on the event loop (virtual clock)
+        self._hosted_failure = None
+
     @property
     def terminate(self):
         return self._terminate
@@ -96,6 +89,9 @@ class Runner:
     @terminate.setter
     def terminate(self, flag):
         self._terminate = flag
+        if flag:
+            # wake up the message loop so that it sees the flag
+            self.transport.add_callback_threadsafe(lambda: None)
 
     def execute_sim_with_dashboard(self):
         log.info('Executing sim with dashboard (start dashboard to execute commands)')
@@ -103,21 +99,30 @@ class Runner:
         self.release_resources()
 
     def _listen_for_messages(self):
+        start_cpu_time = time.thread_time()
         while not self.terminate:
-            self.client.sleep(0)
+            self.transport.process_events()
+        log.info(f'Message loop CPU time: {time.thread_time() - start_cpu_time:.2f}s')
+
+    async def run_async(self):
+        """
+        Consumes the factory messages on the event loop of the agent host (virtual clock).
+        """
+        while not self.terminate:
+            await self.transport.process_events_async()
 
     def execute_graph_gen(self):
         log.info('Executing graph gen')
 
         handlers.add_agent_handler({'num_agents': self.exec_args.num_agents})
 
-        time.sleep(60)
+        clock.sleep(60)
 
         handlers.change_constraint_handler({'num_agents': self.exec_args.num_const_change})
 
         handlers.remove_agent_handler({'num_agents': self.exec_args.num_remove})
 
-        time.sleep(30)
+        clock.sleep(30)
 
     def execute_sim_from_files(self, sim_file):
         log.info(f'Executing from sim files, using predefined network: {config.shared_config.use_predefined_graph}')
@@ -126,19 +131,25 @@ class Runner:
     def release_resources(self):
         log.info('Runner is closing')
 
-        # remove rabbitmq resources
-        self.channel.queue_unbind(exchange=messaging.COMM_EXCHANGE,
-                                  queue=self.queue_name,
-                                  routing_key=f'{messaging.DASHBOARD_COMMAND_CHANNEL}.#')
-        self.channel.queue_unbind(exchange=messaging.COMM_EXCHANGE,
-                                  queue=self.queue_name,
-                                  routing_key=f'{messaging.FACTORY_COMMAND_CHANNEL}.#')
-        self.channel.queue_delete(self.queue_name)
-        self.client.close()
+        # remove transport resources
+        self.transport.unbind(self.queue_name, f'{messaging.DASHBOARD_COMMAND_CHANNEL}.#')
+        self.transport.unbind(self.queue_name, f'{messaging.FACTORY_COMMAND_CHANNEL}.#')
+        self.transport.delete_queue(self.queue_name)
+        self.transport.close()
 
         log.info('Runner was closed successfully')
 
     def start_simulation_environment(self, args):
+        # start sim environment
+        if clock.is_virtual():
+            # nothing else ends the simulation when the environment or an agent fails on the event loop
+            handlers.agent_host.add_failure_callback(self._on_hosted_failure)
+            handlers.agent_host.spawn(functools.partial(self._create_simulation_environment, args))
+        else:
+            self._create_simulation_environment(args)
+            threading.Thread(target=self.sim_env, daemon=True).start()
+
+    def _create_simulation_environment(self, args, loop=None):
         self.sim_env = GridWorld(
             size=args.grid_size,
             num_targets=args.num_targets,
@@ -149,6 +160,14 @@ class Runner:
             dcop_alg=args.algs[0],
             graph_alg=args.graph_alg,
             seed=args.seed,
+            loop=loop,
+            vectorized=args.vectorized,
+            trace=args.trace,
+            trace_compression=not args.no_trace_compression,
+            barrier=args.barrier,
+            barrier_deadline=args.barrier_deadline,
+            barrier_quorum=args.barrier_quorum,
+            history_depth=args.history_depth,
         )
 
         # override sim-ended func to call stop signal
@@ -156,22 +175,39 @@ class Runner:
             self.sim_env.on_simulation_ended,
             self._on_dynamic_sim_env_ended,
         )
-
-        # start sim environment
-        threading.Thread(target=self.sim_env, daemon=True).start()
+        # the agents added by the environment are handed to it and join its bus
+        self.directory[messaging.AGENT_ADDED] = functools.partial(
+            handlers.agent_added_handler, sim_env=self.sim_env, bus=self.sim_env.bus,
+        )
+        return self.sim_env
 
     def _on_dynamic_sim_env_ended(self):
-        self._terminate = True
+        # called from the thread of the simulation environment
+        self.terminate = True
+
+    def _on_hosted_failure(self, e):
+        self._hosted_failure = e
+        self.terminate = True
 
     def wait(self):
-        self._listen_for_messages()
+        if clock.is_virtual():
+            handlers.agent_host.spawn(lambda loop: self).join()
+        else:
+            self._listen_for_messages()
         self.release_resources()
+
+        if self._hosted_failure is not None:
+            raise RuntimeError('The simulation failed') from self._hosted_failure
         log.info('Simulation ended')
 
     def on_force_exit(self, sig, frame):
         log.info('Simulation terminated')
         self.terminate = True
 
+        # the metrics and snapshots are written on a background thread
+        if self.sim_env is not None:
+            self.sim_env.close_writer()
+
 
 if __name__ == '__main__':
     parser = ArgumentParser()
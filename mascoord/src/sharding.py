@@ -0,0 +1,293 @@
+"""
+Multi-process agent hosting.
+
+A `ShardPool` starts a number of worker processes (shards) that host the agents created by the factory handlers, so
+the DCOP computations of the agents are not confined to the GIL of the factory process. Each shard runs a command
+loop (add, remove, change constraint, report, stats, ...) over a pipe and hosts its agents exactly like the factory
+would (threads or the asyncio host). The factory keeps a `ShardedAgent` stand-in for every agent, which forwards the
+lifecycle commands to the owning shard.
+
+Agents of different shards communicate through the broker, hence sharding requires the rabbitmq transport.
+"""
+import math
+import multiprocessing
+import random
+import threading
+import zlib
+
+import numpy as np
+
+import config
+from mascoord.src import codec, logger, transport
+
+HASH = 'hash'
+LOCALITY = 'locality'
+
+PLACEMENTS = [HASH, LOCALITY]
+
+# shard commands
+CONFIGURE = 'configure'
+ADD = 'add'
+REMOVE = 'remove'
+CHANGE_CONSTRAINT = 'change_constraint'
+SELECT_RANDOM_NEIGHBOR = 'select_random_neighbor'
+REPORT = 'report'
+HISTORY = 'history'
+STATS = 'stats'
+RESET = 'reset'
+STOP = 'stop'
+
+log = logger.get_logger('ShardPool')
+
+
+class ShardedAgent:
+    """
+    Stand-in, in the factory process, for an agent hosted by a shard.
+
+    Provides the parts of the `Agent` (and `threading.Thread`) interfaces used by the handlers.
+    """
+
+    def __init__(self, agent_id, shard):
+        self.agent_id = agent_id
+        self.shard = shard
+        self.terminate = False
+
+    def shutdown(self):
+        self.terminate = True
+        self.shard.request(REMOVE, self.agent_id)
+
+    def join(self, timeout=None):
+        # the shard has already joined the agent when `shutdown` returns
+        pass
+
+    def change_constraint(self, coefficients, neighbor_id):
+        self.shard.request(CHANGE_CONSTRAINT, self.agent_id, coefficients, neighbor_id)
+
+    def select_random_neighbor(self):
+        return self.shard.request(SELECT_RANDOM_NEIGHBOR, self.agent_id)
+
+    def send_report(self):
+        self.shard.request(REPORT, self.agent_id)
+
+    def get_child_edges_history(self):
+        return self.shard.request(HISTORY, self.agent_id)['edges']
+
+    def get_child_connections_history(self):
+        return self.shard.request(HISTORY, self.agent_id)['cons']
+
+    @property
+    def domain(self):
+        return self.shard.request(HISTORY, self.agent_id)['domain']
+
+    def __str__(self):
+        return self.agent_id
+
+
+class Shard:
+    """
+    A worker process hosting agents.
+    """
+
+    def __init__(self, shard_id, context, settings):
+        self.shard_id = shard_id
+        self.num_agents = 0
+        self._lock = threading.Lock()
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=_shard_main,
+            args=(shard_id, child_conn, settings),
+            name=f'shard-{shard_id}',
+            daemon=True,
+        )
+        self._process.start()
+        child_conn.close()
+
+    def request(self, command, *args):
+        with self._lock:
+            self._conn.send((command, args))
+            ok, result = self._conn.recv()
+
+        if not ok:
+            raise RuntimeError(f'shard-{self.shard_id} failed to execute {command}: {result}')
+        return result
+
+    def close(self):
+        if self._process.is_alive():
+            self.request(STOP)
+        self._process.join()
+
+
+class ShardPool:
+    """
+    Distributes agents across worker processes.
+
+    Placement is either by hash of the agent ID or by locality: an agent is placed on the shard hosting most of its
+    neighbors in the predefined graph (constraints of the simulation file), as long as that shard is not overloaded.
+    """
+
+    def __init__(self, num_shards, placement=HASH, seed=0):
+        if placement not in PLACEMENTS:
+            raise ValueError(f'Unknown placement strategy: {placement}')
+
+        self.placement = placement
+        self.agent_shard = {}
+        self._neighbors = {}
+        self._configuration = None
+
+        # fork is not safe with the threads of the factory process
+        context = multiprocessing.get_context('spawn')
+        settings = {
+            'transport': transport.get_backend(),
+            'connection_pool_size': transport.get_connection_pool_size(),
+            'message_format': codec.get_format(),
+            'outbox_enabled': transport.is_outbox_enabled(),
+            'logger_level': config.shared_config.logger_level,
+            'seed': seed,
+        }
+        self.shards = [Shard(i, context, settings) for i in range(num_shards)]
+        log.info(f'Started {num_shards} shards, placement = {placement}')
+
+    def configure(self, configuration):
+        """
+        Sends the handlers' configuration (algorithms, shared config, constraints) to the shards if it has changed.
+        """
+        if configuration != self._configuration:
+            for shard in self.shards:
+                shard.request(CONFIGURE, configuration)
+            self._configuration = configuration
+
+            # neighborhoods of the predefined graph (keys of the coefficients dict are 'agent1,agent2')
+            self._neighbors.clear()
+            for key in configuration['coefficients_dict']:
+                agent1, agent2 = key.split(',')
+                self._neighbors.setdefault(agent1, set()).add(agent2)
+                self._neighbors.setdefault(agent2, set()).add(agent1)
+
+    def _select_shard(self, agent_id):
+        if self.placement == LOCALITY:
+            capacity = math.ceil((len(self.agent_shard) + 1) / len(self.shards) * 1.25)
+            counts = np.zeros(len(self.shards))
+            for neighbor in self._neighbors.get(agent_id, ()):
+                if neighbor in self.agent_shard:
+                    counts[self.agent_shard[neighbor].shard_id] += 1
+
+            candidates = [s for s in self.shards if s.num_agents < capacity]
+            return max(candidates, key=lambda s: (counts[s.shard_id], -s.num_agents))
+
+        return self.shards[zlib.crc32(agent_id.encode('utf-8')) % len(self.shards)]
+
+    def add_agent(self, agent_id, configuration):
+        self.configure(configuration)
+
+        shard = self._select_shard(agent_id)
+        shard.request(ADD, agent_id)
+        shard.num_agents += 1
+        self.agent_shard[agent_id] = shard
+
+        return ShardedAgent(agent_id, shard)
+
+    def gather_stats(self):
+        """
+        Collects the stats of the active agents of all shards.
+
+        :return: list of per-agent stats and the edge costs computed by the shards
+        """
+        agent_stats = []
+        edge_costs = {}
+        for shard in self.shards:
+            shard_agent_stats, shard_edge_costs = shard.request(STATS)
+            agent_stats.extend(shard_agent_stats)
+            edge_costs.update(shard_edge_costs)
+        return agent_stats, edge_costs
+
+    def reset(self):
+        for shard in self.shards:
+            shard.request(RESET)
+            shard.num_agents = 0
+        self.agent_shard.clear()
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+def _shard_main(shard_id, conn, settings):
+    # set before the agent modules create their loggers
+    config.shared_config.logger_level = settings['logger_level']
+
+    # the agent modules import handlers and utils as top-level modules (see factory.py)
+    import handlers
+    import utils
+
+    random.seed(settings['seed'] + shard_id)
+    np.random.seed(settings['seed'] + shard_id)
+    transport.set_backend(settings['transport'])
+    transport.set_connection_pool_size(settings['connection_pool_size'])
+    codec.set_format(settings['message_format'])
+    transport.set_outbox_enabled(settings['outbox_enabled'])
+
+    shard_log = logger.get_logger(f'shard-{shard_id}')
+
+    def configure(configuration):
+        vars(config.shared_config).update(configuration['shared_config'])
+        handlers.set_dcop_algorithm(configuration['dcop_algorithm'])
+        handlers.set_graph_algorithm(configuration['graph_algorithm'])
+        handlers.set_domain_size(configuration['domain_size'])
+        if handlers.host_mode != configuration['host_mode']:
+            handlers.set_host_mode(configuration['host_mode'])
+        utils.coefficients_dict = configuration['coefficients_dict']
+
+        # metrics are aggregated by the factory
+        handlers.metrics.can_save = False
+
+    def remove(agent_id):
+        selected_agent = handlers.agents[agent_id]
+        selected_agent.shutdown()
+        handlers.agent_id_to_thread[agent_id].join()
+        handlers.terminated_agents.append(selected_agent)
+
+    def change_constraint(agent_id, coefficients, neighbor_id):
+        handlers.agents[agent_id].change_constraint(coefficients, neighbor_id)
+
+    def history(agent_id):
+        node = handlers.agents[agent_id]
+        return {
+            'edges': node.get_child_edges_history(),
+            'cons': node.get_child_connections_history(),
+            'domain': node.domain,
+        }
+
+    def stats():
+        agent_stats = [handlers.get_agent_stats(node) for node in handlers.agents.values() if not node.terminate]
+        return agent_stats, dict(handlers.metrics.edge_cost_per_agent)
+
+    def reset():
+        handlers.reset_buffers()
+        handlers.metrics.can_save = False
+
+    commands = {
+        CONFIGURE: configure,
+        ADD: handlers._spawn_agent,
+        REMOVE: remove,
+        CHANGE_CONSTRAINT: change_constraint,
+        SELECT_RANDOM_NEIGHBOR: lambda agent_id: handlers.agents[agent_id].select_random_neighbor(),
+        REPORT: lambda agent_id: handlers.agent_report_handler({'agent_id': agent_id}),
+        HISTORY: history,
+        STATS: stats,
+        RESET: reset,
+        STOP: reset,
+    }
+
+    while True:
+        command, args = conn.recv()
+        try:
+            conn.send((True, commands[command](*args)))
+        except Exception as e:
+            shard_log.exception(f'Command {command} failed')
+            conn.send((False, repr(e)))
+
+        if command == STOP:
+            break
+
+    transport.close_connection_pool()
+    conn.close()
@@ -0,0 +1,756 @@
+"""
+Transport layer used by agents, the simulation environment and the factory to exchange messages.
+
+All components publish to the same topic exchange and consume from named queues bound to topics (routing keys).
+Two backends are provided:
+
+* ``rabbitmq`` - publishes through a RabbitMQ broker. By default every transport opens its own connection, with
+  `set_connection_pool_size` transports are multiplexed over a fixed pool of shared connections instead.
+* ``inproc`` - an in-process message bus with the same topic semantics, used to run single-host simulations
+  without a broker.
+
+Agents publish through an `Outbox` that coalesces the messages published during one iteration of their event loop
+into one frame per routing key.
+"""
+import asyncio
+import heapq
+import itertools
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future
+
+import pika
+
+from mascoord.src import codec, config, logger, messaging
+
+RABBITMQ = 'rabbitmq'
+IN_PROCESS = 'inproc'
+
+BACKENDS = [RABBITMQ, IN_PROCESS]
+
+_backend = RABBITMQ
+
+# number of shared broker connections (0 means one connection per transport)
+_connection_pool_size = 0
+_connection_pool = None
+_connection_pool_lock = threading.Lock()
+
+# coalesce the messages published by agents (see Outbox)
+_outbox_enabled = True
+
+# channels read by the dashboard, which expects one JSON message per delivery
+UNBATCHED_CHANNELS = [messaging.MONITORING_CHANNEL, messaging.METRICS_CHANNEL]
+
+log = logger.get_logger('Transport')
+
+
+def set_backend(name):
+    global _backend
+
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown transport backend: {name}')
+    _backend = name
+
+
+def get_backend():
+    return _backend
+
+
+def set_connection_pool_size(size):
+    """
+    Sets the number of broker connections shared by the transports of this process. 0 (default) gives every
+    transport its own connection.
+    """
+    global _connection_pool_size
+
+    if size < 0:
+        raise ValueError(f'Invalid connection pool size: {size}')
+    _connection_pool_size = size
+
+
+def get_connection_pool_size():
+    return _connection_pool_size
+
+
+def set_outbox_enabled(enabled):
+    global _outbox_enabled
+    _outbox_enabled = enabled
+
+
+def is_outbox_enabled():
+    return _outbox_enabled
+
+
+def get_connection_pool():
+    global _connection_pool
+
+    with _connection_pool_lock:
+        if _connection_pool is None:
+            _connection_pool = ConnectionPool(_connection_pool_size)
+        return _connection_pool
+
+
+def close_connection_pool():
+    global _connection_pool
+
+    with _connection_pool_lock:
+        if _connection_pool is not None:
+            _connection_pool.close()
+            _connection_pool = None
+
+
+def create_transport(bus=None, loop=None):
+    """
+    Creates a transport for the selected backend.
+
+    :param bus: the message bus to attach to when using the in-process backend. Defaults to the process-wide bus.
+    :param loop: the asyncio event loop of the consumer, if it runs as a coroutine (see `host.AsyncAgentHost`). Must be
+        called from the thread running the loop.
+    """
+    if loop is not None:
+        if _backend == IN_PROCESS:
+            return AsyncioInProcessTransport(loop, bus)
+        if _connection_pool_size > 0:
+            return AsyncioPooledRabbitMQTransport(loop, get_connection_pool())
+        raise ValueError('Consumers running on an event loop require a connection pool with the rabbitmq backend')
+
+    if _backend == IN_PROCESS:
+        return InProcessTransport(bus)
+    if _connection_pool_size > 0:
+        return PooledRabbitMQTransport(get_connection_pool())
+    return RabbitMQTransport()
+
+
+def _connect():
+    return pika.BlockingConnection(pika.ConnectionParameters(
+        host=config.BROKER_URL,
+        port=config.BROKER_PORT,
+        heartbeat=0,  # only for experiment purposes - not recommended (https://www.rabbitmq.com/heartbeats.html)
+        credentials=pika.credentials.PlainCredentials(config.PIKA_USERNAME, config.PIKA_PASSWORD))
+    )
+
+
+class Transport:
+    """
+    Base class for message transports
+    """
+
+    def declare_exchange(self):
+        """
+        Declares the communication (topic) exchange.
+        """
+        pass
+
+    def declare_queue(self, queue_name, exclusive=False):
+        raise NotImplementedError
+
+    def bind(self, queue_name, routing_key):
+        raise NotImplementedError
+
+    def unbind(self, queue_name, routing_key):
+        raise NotImplementedError
+
+    def delete_queue(self, queue_name):
+        raise NotImplementedError
+
+    def consume(self, queue_name, on_message):
+        """
+        Registers `on_message(body)` to be called for every message delivered to the given queue.
+        """
+        raise NotImplementedError
+
+    def publish(self, routing_key, body):
+        raise NotImplementedError
+
+    def sleep(self, duration):
+        """
+        Processes incoming messages and scheduled callbacks for `duration` seconds.
+        """
+        raise NotImplementedError
+
+    def process_events(self, timeout=None):
+        """
+        Blocks until at least one message or callback has been handled (or `timeout` seconds have elapsed) and then
+        handles whatever else is pending. A `timeout` of None blocks until something happens.
+        """
+        raise NotImplementedError
+
+    async def process_events_async(self):
+        """
+        Coroutine version of `process_events` for consumers running on an asyncio event loop.
+        """
+        raise NotImplementedError
+
+    def call_later(self, delay, callback):
+        """
+        Schedules `callback` to be executed by the consuming thread after `delay` seconds.
+        """
+        raise NotImplementedError
+
+    def add_callback_threadsafe(self, callback):
+        """
+        Requests `callback` to be executed by the consuming thread. Safe to call from any thread.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class RabbitMQTransport(Transport):
+    """
+    Transport backed by a RabbitMQ broker
+    """
+
+    def __init__(self):
+        self.client = _connect()
+        self.channel = self.client.channel()
+
+    def declare_exchange(self):
+        self.channel.exchange_declare(exchange=messaging.COMM_EXCHANGE, exchange_type='topic')
+
+    def declare_queue(self, queue_name, exclusive=False):
+        self.channel.queue_declare(queue=queue_name, exclusive=exclusive)
+
+    def bind(self, queue_name, routing_key):
+        self.channel.queue_bind(exchange=messaging.COMM_EXCHANGE, queue=queue_name, routing_key=routing_key)
+
+    def unbind(self, queue_name, routing_key):
+        self.channel.queue_unbind(exchange=messaging.COMM_EXCHANGE, queue=queue_name, routing_key=routing_key)
+
+    def delete_queue(self, queue_name):
+        self.channel.queue_delete(queue_name)
+
+    def consume(self, queue_name, on_message):
+        def on_message_callback(ch, method, properties, body):
+            on_message(body)
+
+        self.channel.basic_consume(queue=queue_name, on_message_callback=on_message_callback, auto_ack=True)
+
+    def publish(self, routing_key, body):
+        self.channel.basic_publish(exchange=messaging.COMM_EXCHANGE, routing_key=routing_key, body=body)
+
+    def sleep(self, duration):
+        self.client.sleep(duration)
+
+    def process_events(self, timeout=None):
+        self.client.process_data_events(time_limit=timeout)
+
+    def call_later(self, delay, callback):
+        self.client.call_later(delay, callback)
+
+    def add_callback_threadsafe(self, callback):
+        self.client.add_callback_threadsafe(callback)
+
+    def close(self):
+        if self.channel.is_open:
+            self.channel.close()
+        self.client.close()
+
+
+def _topic_matches(pattern_words, key_words):
+    """
+    AMQP topic matching: `*` matches exactly one word and `#` matches zero or more words.
+    """
+    if not pattern_words:
+        return not key_words
+
+    head, rest = pattern_words[0], pattern_words[1:]
+    if head == '#':
+        return any(_topic_matches(rest, key_words[i:]) for i in range(len(key_words) + 1))
+    if not key_words:
+        return False
+    if head == '*' or head == key_words[0]:
+        return _topic_matches(rest, key_words[1:])
+    return False
+
+
+class _BusQueue:
+
+    def __init__(self, name):
+        self.name = name
+        self.backlog = deque()
+        self.consumer = None
+
+
+class MessageBus:
+    """
+    In-process topic exchange.
+
+    Bindings of the form `a.b.#` (the ones used throughout the code base) are indexed by prefix so routing a
+    message costs one dict lookup per word of its routing key. Other patterns are matched word by word.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._prefix_bindings = defaultdict(set)
+        self._exact_bindings = defaultdict(set)
+        self._pattern_bindings = defaultdict(set)
+
+    def declare_queue(self, queue_name):
+        with self._lock:
+            if queue_name not in self._queues:
+                self._queues[queue_name] = _BusQueue(queue_name)
+
+    def delete_queue(self, queue_name):
+        with self._lock:
+            self._queues.pop(queue_name, None)
+            for bindings in (self._prefix_bindings, self._exact_bindings, self._pattern_bindings):
+                for key in list(bindings):
+                    bindings[key].discard(queue_name)
+                    if not bindings[key]:
+                        bindings.pop(key)
+
+    def _bindings_for(self, routing_key):
+        words = routing_key.split('.')
+        if words[-1] == '#' and '*' not in words and '#' not in words[:-1]:
+            return self._prefix_bindings, '.'.join(words[:-1])
+        if '*' in words or '#' in words:
+            return self._pattern_bindings, routing_key
+        return self._exact_bindings, routing_key
+
+    def bind(self, queue_name, routing_key):
+        with self._lock:
+            bindings, key = self._bindings_for(routing_key)
+            bindings[key].add(queue_name)
+
+    def unbind(self, queue_name, routing_key):
+        with self._lock:
+            bindings, key = self._bindings_for(routing_key)
+            if key in bindings:
+                bindings[key].discard(queue_name)
+                if not bindings[key]:
+                    bindings.pop(key)
+
+    def consume(self, queue_name, transport, on_message):
+        with self._lock:
+            bus_queue = self._queues[queue_name]
+            bus_queue.consumer = (transport, on_message)
+            backlog = list(bus_queue.backlog)
+            bus_queue.backlog.clear()
+
+        for body in backlog:
+            transport.deliver(on_message, body)
+
+    def cancel(self, transport):
+        with self._lock:
+            for bus_queue in self._queues.values():
+                if bus_queue.consumer and bus_queue.consumer[0] is transport:
+                    bus_queue.consumer = None
+
+    def _route(self, routing_key):
+        names = set(self._exact_bindings.get(routing_key, ()))
+
+        words = routing_key.split('.')
+        if '' in self._prefix_bindings:
+            names.update(self._prefix_bindings[''])
+        for i in range(1, len(words) + 1):
+            prefix = '.'.join(words[:i])
+            if prefix in self._prefix_bindings:
+                names.update(self._prefix_bindings[prefix])
+
+        for pattern, queue_names in self._pattern_bindings.items():
+            if _topic_matches(pattern.split('.'), words):
+                names.update(queue_names)
+
+        return names
+
+    def publish(self, routing_key, body):
+        deliveries = []
+        with self._lock:
+            for name in self._route(routing_key):
+                bus_queue = self._queues.get(name)
+                if bus_queue is None:
+                    continue
+                if bus_queue.consumer:
+                    deliveries.append(bus_queue.consumer)
+                else:
+                    bus_queue.backlog.append(body)
+
+        for transport, on_message in deliveries:
+            transport.deliver(on_message, body)
+
+
+default_bus = MessageBus()
+
+
+class InboxTransport(Transport):
+    """
+    Base class of transports whose deliveries and thread-safe callbacks are placed on a per-transport inbox.
+
+    The inbox is drained by the consuming thread in `sleep` and `process_events`, so callbacks run on the thread that
+    owns the transport (as with pika).
+    """
+
+    def __init__(self):
+        self._inbox = queue.SimpleQueue()
+        self._timers = []
+        self._timer_seq = itertools.count()
+
+    def deliver(self, on_message, body):
+        self._inbox.put((on_message, (body,)))
+
+    def call_later(self, delay, callback):
+        heapq.heappush(self._timers, (time.monotonic() + delay, next(self._timer_seq), callback))
+
+    def add_callback_threadsafe(self, callback):
+        self._inbox.put((callback, ()))
+
+    def _run_due_timers(self):
+        handled = 0
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, callback = heapq.heappop(self._timers)
+            callback()
+            handled += 1
+        return handled
+
+    def sleep(self, duration):
+        deadline = time.monotonic() + duration
+        while True:
+            self._run_due_timers()
+
+            now = time.monotonic()
+            timeout = deadline - now
+            if self._timers:
+                timeout = min(timeout, self._timers[0][0] - now)
+
+            try:
+                if timeout > 0:
+                    callback, args = self._inbox.get(timeout=timeout)
+                else:
+                    callback, args = self._inbox.get_nowait()
+            except queue.Empty:
+                if time.monotonic() >= deadline:
+                    break
+                continue
+
+            callback(*args)
+
+    def process_events(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        handled = self._run_due_timers()
+        while not handled:
+            now = time.monotonic()
+            wait = max(0., self._timers[0][0] - now) if self._timers else None
+            if deadline is not None:
+                if now >= deadline:
+                    break
+                wait = deadline - now if wait is None else min(wait, deadline - now)
+
+            try:
+                callback, args = self._inbox.get(timeout=wait)
+            except queue.Empty:
+                handled += self._run_due_timers()
+                continue
+
+            callback(*args)
+            handled += 1
+
+        # handle everything else that is already pending
+        for _ in range(self._inbox.qsize()):
+            callback, args = self._inbox.get_nowait()
+            callback(*args)
+        self._run_due_timers()
+
+
+class InProcessTransport(InboxTransport):
+    """
+    Transport attached to an in-process message bus.
+    """
+
+    def __init__(self, bus=None):
+        super(InProcessTransport, self).__init__()
+        self.bus = bus if bus is not None else default_bus
+
+    def declare_queue(self, queue_name, exclusive=False):
+        self.bus.declare_queue(queue_name)
+
+    def bind(self, queue_name, routing_key):
+        self.bus.bind(queue_name, routing_key)
+
+    def unbind(self, queue_name, routing_key):
+        self.bus.unbind(queue_name, routing_key)
+
+    def delete_queue(self, queue_name):
+        self.bus.delete_queue(queue_name)
+
+    def consume(self, queue_name, on_message):
+        self.bus.consume(queue_name, self, on_message)
+
+    def publish(self, routing_key, body):
+        # consumers always receive bytes, as with pika
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.bus.publish(routing_key, body)
+
+    def close(self):
+        self.bus.cancel(self)
+
+
+class _PooledConnection:
+    """
+    A broker connection (and channel) shared by several transports.
+
+    The connection is driven by its own I/O thread. Other threads use it through `submit` (fire and forget) and `call`
+    (wait for the result), which run the given function on the I/O thread.
+    """
+
+    def __init__(self, name):
+        self.client = _connect()
+        self.channel = self.client.channel()
+        self.num_transports = 0
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._closing:
+            self.client.process_data_events(time_limit=None)
+
+        if self.channel.is_open:
+            self.channel.close()
+        self.client.close()
+
+    def submit(self, func):
+        def callback():
+            try:
+                func()
+            except Exception as e:
+                log.error(f'{self._thread.name}: {str(e)}')
+
+        self.client.add_callback_threadsafe(callback)
+
+    def call(self, func):
+        if threading.current_thread() is self._thread:
+            return func()
+
+        future = Future()
+
+        def callback():
+            try:
+                future.set_result(func())
+            except Exception as e:
+                future.set_exception(e)
+
+        self.client.add_callback_threadsafe(callback)
+        return future.result()
+
+    def close(self):
+        def stop():
+            self._closing = True
+
+        self.client.add_callback_threadsafe(stop)
+        self._thread.join()
+
+
+class ConnectionPool:
+    """
+    A fixed number of broker connections over which transports are multiplexed (each transport is assigned to the
+    connection with the fewest transports).
+    """
+
+    def __init__(self, size):
+        self._lock = threading.Lock()
+        self.connections = [_PooledConnection(f'broker-connection-{i}') for i in range(size)]
+
+    def acquire(self):
+        with self._lock:
+            connection = min(self.connections, key=lambda c: c.num_transports)
+            connection.num_transports += 1
+            return connection
+
+    def release(self, connection):
+        with self._lock:
+            connection.num_transports -= 1
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+
+
+class PooledRabbitMQTransport(InboxTransport):
+    """
+    Transport that shares a pooled broker connection with other transports.
+
+    Broker operations are executed by the I/O thread of the connection and deliveries are routed to the inbox of the
+    transport that registered the consumer.
+    """
+
+    def __init__(self, pool):
+        super(PooledRabbitMQTransport, self).__init__()
+        self.pool = pool
+        self.connection = pool.acquire()
+        self.channel = self.connection.channel
+        self._consumer_tags = []
+
+    def declare_exchange(self):
+        self.connection.call(lambda: self.channel.exchange_declare(
+            exchange=messaging.COMM_EXCHANGE,
+            exchange_type='topic',
+        ))
+
+    def declare_queue(self, queue_name, exclusive=False):
+        self.connection.call(lambda: self.channel.queue_declare(queue=queue_name, exclusive=exclusive))
+
+    def bind(self, queue_name, routing_key):
+        self.connection.call(lambda: self.channel.queue_bind(
+            exchange=messaging.COMM_EXCHANGE,
+            queue=queue_name,
+            routing_key=routing_key,
+        ))
+
+    def unbind(self, queue_name, routing_key):
+        self.connection.call(lambda: self.channel.queue_unbind(
+            exchange=messaging.COMM_EXCHANGE,
+            queue=queue_name,
+            routing_key=routing_key,
+        ))
+
+    def delete_queue(self, queue_name):
+        self.connection.call(lambda: self.channel.queue_delete(queue_name))
+
+    def consume(self, queue_name, on_message):
+        def on_message_callback(ch, method, properties, body):
+            self.deliver(on_message, body)
+
+        consumer_tag = self.connection.call(lambda: self.channel.basic_consume(
+            queue=queue_name,
+            on_message_callback=on_message_callback,
+            auto_ack=True,
+        ))
+        self._consumer_tags.append(consumer_tag)
+
+    def publish(self, routing_key, body):
+        self.connection.submit(lambda: self.channel.basic_publish(
+            exchange=messaging.COMM_EXCHANGE,
+            routing_key=routing_key,
+            body=body,
+        ))
+
+    def close(self):
+        def cancel_consumers():
+            # consumers of deleted queues have already been cancelled by the broker
+            for consumer_tag in self._consumer_tags:
+                if consumer_tag in self.channel.consumer_tags:
+                    self.channel.basic_cancel(consumer_tag)
+
+        self.connection.call(cancel_consumers)
+        self._consumer_tags.clear()
+        self.pool.release(self.connection)
+
+
+class AsyncioTransportMixin:
+    """
+    Inbox of transports whose consumer is a coroutine running on an asyncio event loop.
+
+    Deliveries, timers and thread-safe callbacks are queued on the loop and handled when the consumer awaits
+    `process_events_async`. The blocking `sleep` and `process_events` are not available.
+    """
+
+    def _init_inbox(self, loop):
+        self.loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self._pending = deque()
+        self._has_events = asyncio.Event()
+
+    def _enqueue(self, item):
+        self._pending.append(item)
+        self._has_events.set()
+
+    def _put(self, item):
+        if threading.get_ident() == self._loop_thread_id:
+            self._enqueue(item)
+        else:
+            self.loop.call_soon_threadsafe(self._enqueue, item)
+
+    def deliver(self, on_message, body):
+        self._put((on_message, (body,)))
+
+    def call_later(self, delay, callback):
+        self.loop.call_later(delay, self._enqueue, (callback, ()))
+
+    def add_callback_threadsafe(self, callback):
+        self._put((callback, ()))
+
+    def sleep(self, duration):
+        raise RuntimeError('Blocking calls are not supported on an event loop, use process_events_async')
+
+    def process_events(self, timeout=None):
+        raise RuntimeError('Blocking calls are not supported on an event loop, use process_events_async')
+
+    async def process_events_async(self):
+        if not self._pending:
+            await self._has_events.wait()
+        self._has_events.clear()
+
+        for _ in range(len(self._pending)):
+            callback, args = self._pending.popleft()
+            callback(*args)
+
+
+class AsyncioInProcessTransport(AsyncioTransportMixin, InProcessTransport):
+
+    def __init__(self, loop, bus=None):
+        super(AsyncioInProcessTransport, self).__init__(bus)
+        self._init_inbox(loop)
+
+
+class AsyncioPooledRabbitMQTransport(AsyncioTransportMixin, PooledRabbitMQTransport):
+
+    def __init__(self, loop, pool):
+        super(AsyncioPooledRabbitMQTransport, self).__init__(pool)
+        self._init_inbox(loop)
+
+
+class Outbox:
+    """
+    Collects the messages published by an agent and publishes them as one frame per routing key when flushed.
+
+    Agents flush their outbox before waiting for events, so everything published while handling a batch of events
+    and during the following step goes out together. Consumers unpack frames with `codec.decode_frame`. The order of
+    messages is kept per routing key, messages of different routing keys are not ordered. Messages to the
+    `UNBATCHED_CHANNELS` are published immediately.
+    """
+
+    def __init__(self, publish):
+        """
+        :param publish: the publish function of the transport
+        """
+        self._publish = publish
+        self._pending = {}
+        self.messages_count = 0
+        self.frames_count = 0
+
+    def publish(self, routing_key, body):
+        if not _outbox_enabled or routing_key.startswith(tuple(UNBATCHED_CHANNELS)):
+            self._send(routing_key, body)
+            self.messages_count += 1
+        else:
+            self._pending.setdefault(routing_key, []).append(body)
+
+    def flush(self):
+        pending, self._pending = self._pending, {}
+        for routing_key, bodies in pending.items():
+            frame = codec.encode_batch(bodies) if len(bodies) > 1 else None
+            if frame is not None:
+                self._send(routing_key, frame)
+            else:
+                for body in bodies:
+                    self._send(routing_key, body)
+            self.messages_count += len(bodies)
+
+    def _send(self, routing_key, body):
+        self._publish(routing_key=routing_key, body=body)
+        self.frames_count += 1
+
+    @property
+    def batching_factor(self):
+        """
+        Average number of messages per published frame.
+        """
+        return self.messages_count / self.frames_count if self.frames_count else 0.